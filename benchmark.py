@@ -0,0 +1,344 @@
+"""
+Offline benchmarks for every pipeline stage.
+
+A synthetic corpus (synthetic.py) is generated from a fixed seed and the
+network stages talk to a local stub server (stub_server.py), so runs are
+repeatable and never touch the live API. Each benchmark runs in a fresh
+process, so its peak RSS is its own, and reports records/sec, bytes/sec and
+peak RSS. Results are compared with a stored baseline; a benchmark slower or
+bigger than the baseline by more than --tolerance is flagged and the run
+exits with status 1.
+
+Benchmarks: resolve (resolver.py against the stub), snapshot (resolver.py from a
+local unpaywall_snapshot.py index, no API), download (fetch_scheduler.py),
+extract (PyMuPDF via extractor.py), clean (cleaning.Cleaner.clean_text),
+merge (merger.py dedupe) and chunk (chunking.Chunker, needs the model
+available locally). A benchmark whose dependency is missing is skipped.
+
+Usage:
+    python benchmark.py --save-baseline          # record bench_baseline.json
+    python benchmark.py                          # compare against it
+    python benchmark.py --only clean merge --docs 5000 --repeat 3
+    python benchmark.py --only resolve download --latency 0.05 --rate-429 0.02
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic
+from stub_server import StubServer
+
+BASELINE_PATH = "bench_baseline.json"
+TOLERANCE = 0.2          # 20% slower / bigger than baseline counts as a regression
+EMAIL = "bench@example.com"
+MODEL_NAME = "google/bigbird-roberta-base"
+
+
+# === Benchmarks: setup(ctx) -> job(); job() -> (records, bytes) ===
+# Only job() is timed; ctx holds the corpus paths, the stub URL and options.
+
+def read_dois(ctx):
+    import csv
+
+    with open(ctx["dois_csv"], newline="", encoding="utf-8") as f:
+        return [row["DOI"] for row in csv.DictReader(f)]
+
+
+def load_texts(ctx):
+    from jsonl_io import iter_jsonl
+
+    return [record["text"] for record in iter_jsonl(ctx["jsonl"])]
+
+
+def bench_resolve(ctx):
+    from resolver import resolve_dois
+
+    dois = read_dois(ctx)
+
+    def job():
+        results = resolve_dois(dois, EMAIL, api_base=ctx["api_base"], rate=ctx["rate"],
+                               concurrency=ctx["concurrency"])
+        return len(results), None   # bytes come from the stub's counter
+    return job
+
+
+def bench_snapshot(ctx):
+    from resolver import resolve_dois
+    from unpaywall_snapshot import UnpaywallSnapshot
+
+    dois = read_dois(ctx)
+    index = os.path.join(ctx["workdir"], "bench_snapshot.sqlite")
+    if os.path.exists(index):
+        os.remove(index)
+    snapshot = UnpaywallSnapshot(index, fallback=False, create=True)
+    snapshot.build([ctx["snapshot"]], dois)
+
+    def job():
+        results = resolve_dois(dois, EMAIL, concurrency=ctx["concurrency"], snapshot=snapshot)
+        return len(results), os.path.getsize(ctx["snapshot"])
+    return job
+
+
+def bench_download(ctx):
+    from doi_utils import encode_filename
+    from fetch_scheduler import download_many
+
+    dois = read_dois(ctx)[:ctx["downloads"]]
+    out_dir = tempfile.mkdtemp(dir=ctx["workdir"])
+    jobs = [(doi, f"{ctx['url']}/pdf/{encode_filename(doi)}.pdf",
+             os.path.join(out_dir, encode_filename(doi) + ".pdf")) for doi in dois]
+
+    def job():
+        results = download_many(jobs, workers=ctx["concurrency"]).values()
+        shutil.rmtree(out_dir, ignore_errors=True)
+        return sum(r.ok for r in results), sum(r.size or 0 for r in results)
+    return job
+
+
+def bench_extract(ctx):
+    import fitz  # noqa: F401  (skip cleanly when PyMuPDF is missing)
+
+    from extractor import extract_pdf_text
+
+    pdfs = sorted(os.path.join(ctx["pdf_dir"], name) for name in os.listdir(ctx["pdf_dir"]))
+
+    def job():
+        pages = 0
+        for pdf in pdfs:
+            pages += extract_pdf_text(pdf)[1]
+        ctx["extra"]["pages_per_sec"] = pages
+        return len(pdfs), sum(os.path.getsize(pdf) for pdf in pdfs)
+    return job
+
+
+def bench_clean(ctx):
+    from cleaning import Cleaner
+
+    texts = load_texts(ctx)
+    cleaner = Cleaner()
+
+    def job():
+        for text in texts:
+            cleaner.clean_text(text)
+        return len(texts), sum(len(text.encode("utf-8")) for text in texts)
+    return job
+
+
+def bench_merge(ctx):
+    from merger import merge
+
+    inputs = [ctx["jsonl"], ctx["jsonl_b"]]
+    output = os.path.join(ctx["workdir"], "bench_merged.jsonl")
+
+    def job():
+        stats, _, _ = merge(inputs, output)
+        return sum(s["read"] for s in stats.values()), sum(os.path.getsize(p) for p in inputs)
+    return job
+
+
+def bench_chunk(ctx):
+    from chunking import Chunker, chunk_documents
+    from jsonl_io import iter_jsonl
+
+    chunker = Chunker(ctx["model"], keep_short=True)
+    entries = list(iter_jsonl(ctx["jsonl"]))
+
+    def job():
+        chunks = 0
+        for _, count in chunk_documents(entries, chunker):
+            chunks += count
+        ctx["extra"]["chunks"] = chunks
+        return len(entries), sum(len(e["text"].encode("utf-8")) for e in entries)
+    return job
+
+
+BENCHMARKS = {
+    "resolve": bench_resolve,
+    "snapshot": bench_snapshot,
+    "download": bench_download,
+    "extract": bench_extract,
+    "clean": bench_clean,
+    "merge": bench_merge,
+    "chunk": bench_chunk,
+}
+NETWORK = {"resolve", "download"}
+
+
+# === Runner ===
+
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 / 1024 / 1024 if sys.platform == "darwin" else 1 / 1024   # bytes on macOS, KiB on Linux
+    return max(own, children) * scale
+
+
+def _child(name, ctx, conn):
+    try:
+        ctx["extra"] = {}
+        job = BENCHMARKS[name](ctx)
+        start = time.perf_counter()
+        records, size = job()
+        seconds = time.perf_counter() - start
+        conn.send({"status": "ok", "records": records, "bytes": size, "seconds": seconds,
+                   "peak_rss_mb": round(peak_rss_mb(), 1), "extra": ctx["extra"]})
+    except ImportError as e:
+        conn.send({"status": "skipped", "reason": str(e)})
+    except Exception as e:
+        conn.send({"status": "error", "reason": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_benchmark(name, ctx, server=None):
+    """Run one benchmark in a fresh (spawned) process and return its result."""
+    import multiprocessing as mp
+
+    spawn = mp.get_context("spawn")
+    parent, child = spawn.Pipe(duplex=False)
+    before = server.bytes_sent if server else 0
+    process = spawn.Process(target=_child, args=(name, ctx, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"status": "error", "reason": f"benchmark process died (exit {process.exitcode})"}
+    process.join()
+    if result["status"] != "ok":
+        return result
+
+    if result["bytes"] is None:
+        result["bytes"] = server.bytes_sent - before if server else 0
+    seconds = max(result["seconds"], 1e-9)
+    result["records_per_sec"] = round(result["records"] / seconds, 2)
+    result["bytes_per_sec"] = round(result["bytes"] / seconds, 1)
+    for key, value in list(result["extra"].items()):
+        if key.endswith("_per_sec"):
+            result["extra"][key] = round(value / seconds, 2)
+    return result
+
+
+def best_of(results):
+    ok = [r for r in results if r["status"] == "ok"]
+    if not ok:
+        return results[-1]
+    best = max(ok, key=lambda r: r["records_per_sec"])
+    best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in ok)
+    return best
+
+
+def compare(name, result, baseline, tolerance):
+    """Regression messages for one benchmark (empty when within tolerance)."""
+    base = baseline.get(name)
+    if not base or result["status"] != "ok":
+        return []
+    problems = []
+    for key in ("records_per_sec", "bytes_per_sec"):
+        if base.get(key) and result[key] < base[key] * (1 - tolerance):
+            problems.append(f"{key} {result[key]:,.1f} < baseline {base[key]:,.1f}")
+    if base.get("peak_rss_mb") and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+        problems.append(f"peak RSS {result['peak_rss_mb']} MB > baseline {base['peak_rss_mb']} MB")
+    return problems
+
+
+def format_rate(value):
+    for unit in ("", "K", "M", "G"):
+        if abs(value) < 1000:
+            return f"{value:,.1f}{unit}"
+        value /= 1000
+    return f"{value:,.1f}T"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks with a synthetic corpus and a local Unpaywall stub")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument("--docs", type=int, default=1000, help="DOIs / JSONL documents in the corpus")
+    parser.add_argument("--pdfs", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words", type=int, default=3000)
+    parser.add_argument("--downloads", type=int, default=200, help="PDFs fetched by the download benchmark")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark; the fastest is kept")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate", type=float, default=1000, help="Resolver requests/sec budget")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--workdir", default=None, help="Keep the corpus here instead of a temp dir")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_")
+    print(f"🧪 Generating synthetic corpus in {workdir} ...")
+    corpus = synthetic.generate(workdir, args.docs, args.pdfs, args.pages, args.words)
+    ctx = dict(corpus, workdir=workdir, rate=args.rate, concurrency=args.concurrency,
+               downloads=args.downloads, model=args.model)
+
+    names = args.only or list(BENCHMARKS)
+    server = None
+    if NETWORK & set(names):
+        server = StubServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            rate_429=args.rate_429, pages=args.pages).start()
+        ctx.update(url=server.url, api_base=server.api_base)
+
+    results = {}
+    try:
+        for name in names:
+            results[name] = best_of([run_benchmark(name, ctx, server) for _ in range(args.repeat)])
+    finally:
+        if server is not None:
+            server.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = {name: compare(name, result, baseline, args.tolerance) for name, result in results.items()}
+
+    if args.json:
+        print(json.dumps({"results": results, "regressions": regressions}, indent=2))
+    else:
+        print(f"\n{'benchmark':<10} {'records/s':>11} {'bytes/s':>10} {'peak RSS':>10}  vs baseline")
+        for name, result in results.items():
+            if result["status"] != "ok":
+                print(f"{name:<10} ⏭️ {result['status']}: {result['reason']}")
+                continue
+            base = baseline.get(name, {}).get("records_per_sec")
+            delta = f"{result['records_per_sec'] / base - 1:+.0%}" if base else "-"
+            flag = " ❌" if regressions[name] else ""
+            print(f"{name:<10} {format_rate(result['records_per_sec']):>11} "
+                  f"{format_rate(result['bytes_per_sec']):>9}B {result['peak_rss_mb']:>7.1f} MB  {delta}{flag}")
+            for key, value in result["extra"].items():
+                print(f"{'':<10} {key}: {value}")
+        if server is not None:
+            print(f"\n📡 Stub responses: {dict(server.statuses)}")
+        for name, problems in regressions.items():
+            for problem in problems:
+                print(f"❌ {name}: {problem}")
+
+    if args.save_baseline:
+        keep = ("records_per_sec", "bytes_per_sec", "peak_rss_mb")
+        baseline.update({name: {key: r[key] for key in keep}
+                         for name, r in results.items() if r["status"] == "ok"})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+    elif any(regressions.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
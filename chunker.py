@@ -1,41 +1,48 @@
-from transformers import AutoTokenizer
-import json
+import metrics
+from chunking import Chunker, chunk_documents
+from jsonl_io import iter_records, record_writer
+from token_store import TokenStoreWriter, tokenizer_info
 
 # -------------------- Config --------------------
 model_name = "google/bigbird-roberta-base"
-input_jsonl = "uoa4_training_set.jsonl"
-output_jsonl = "uoa4_training_set_chunked.jsonl"
+input_jsonl = "uoa4_training_set.jsonl"  # .gz / .zst or a .corpus store also accepted
+output_jsonl = "uoa4_training_set_chunked.jsonl"  # .gz / .zst to compress, .corpus for a Parquet store
 chunk_size = 4096
 stride = 512  # overlap to preserve context
-
-# Load tokenizer
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-# Load original dataset
-with open(input_jsonl, "r", encoding="utf-8") as f:
-    examples = [json.loads(line) for line in f]
-
-chunked_data = []
-
-for entry in examples:
-    text = entry["text"]
-    label = entry["label"].strip()
-    inputs = tokenizer(text, return_tensors="pt", truncation=False)
-    input_ids = inputs["input_ids"][0]
-
-    for i in range(0, len(input_ids), chunk_size - stride):
-        chunk_ids = input_ids[i:i + chunk_size]
-        if len(chunk_ids) < 10:
-            continue  # skip tiny trailing chunks
-        chunk_text = tokenizer.decode(chunk_ids, skip_special_tokens=True)
-        chunked_data.append({
-            "text": chunk_text,
-            "label": label
-        })
-
-# Save chunked dataset
-with open(output_jsonl, "w", encoding="utf-8") as out_f:
-    for item in chunked_data:
-        out_f.write(json.dumps(item) + "\n")
-
-print(f"✅ Saved {len(chunked_data)} chunked examples to {output_jsonl}")
+batch_size = 64  # documents per tokenizer call
+workers = 1  # >1 tokenizes batches on a multiprocessing pool
+token_store_dir = None  # e.g. "uoa4_training_set_tokens" -> memory-mapped token ids for training
+shard_size = None  # e.g. 100_000 -> uoa4_training_set_chunked-00000.jsonl, ...
+metrics_json = None  # e.g. "chunker_metrics.json" -> run summary with docs/sec and chunks/sec
+metrics_prom = None  # e.g. "chunker.prom" -> Prometheus text metrics
+
+def main():
+    metrics_args = metrics.options(prom=metrics_prom, json=metrics_json)
+    metrics.start(metrics_args)
+    # Load fast tokenizer
+    chunker = Chunker(model_name, chunk_size=chunk_size, stride=stride,
+                      with_ids=token_store_dir is not None)
+
+    # Stream the dataset line by line and write chunks as they are produced,
+    # so memory stays flat regardless of corpus size.
+    # Chunk text is sliced from the original string via offset mappings (no decode)
+    examples = iter_records(input_jsonl)
+    store = None
+    if token_store_dir:
+        store = TokenStoreWriter(token_store_dir, tokenizer_info(chunker.tokenizer),
+                                 extra={"chunk_size": chunk_size, "stride": stride})
+    with record_writer(output_jsonl, shard_size=shard_size, stage="chunked") as out:
+        for chunks, _ in chunk_documents(examples, chunker, batch_size=batch_size, workers=workers):
+            for item in chunks:
+                if store is not None:
+                    store.add(item.pop("input_ids"), item["label"])
+                out.write(item)
+
+    if store is not None:
+        store.close()
+        print(f"🧮 Token ids for {store.count} chunks saved to {token_store_dir}")
+    print(f"✅ Saved {out.count} chunked examples to {', '.join(out.paths)}")
+    metrics.finish(metrics_args)
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,101 @@
-from transformers import AutoTokenizer
-import json
+import metrics
+from chunking import Chunker, chunk_documents
+from jsonl_io import iter_records, record_writer
+from length_buckets import build_index, report, write_index
+from token_store import TokenStoreWriter, tokenizer_info
 from collections import defaultdict
 import matplotlib.pyplot as plt
 
 # -------------------- Config --------------------
 model_name = "google/bigbird-roberta-base"
-input_jsonl = "uoa4_full_trainset.jsonl"
-output_jsonl = "uoa4_full_trainset_chunked.jsonl"
+input_jsonl = "uoa4_full_trainset.jsonl"  # .gz / .zst or a .corpus store also accepted
+output_jsonl = "uoa4_full_trainset_chunked.jsonl"  # .gz / .zst to compress, .corpus for a Parquet store
 chunk_size = 4096
 stride = 512  # overlap to preserve context
-
-# Load tokenizer
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-# Load original dataset
-with open(input_jsonl, "r", encoding="utf-8") as f:
-    examples = [json.loads(line) for line in f]
-
-chunked_data = []
-chunk_dist = defaultdict(int)  # e.g., {1: 103, 2: 74, 3: 6}
-
-for entry in examples:
-    text = entry["text"]
-    label = str(entry["label"]).strip()
-    inputs = tokenizer(text, return_tensors="pt", truncation=False)
-    input_ids = inputs["input_ids"][0]
-    total_tokens = len(input_ids)
-
-    # Short doc — keep as one chunk
-    if total_tokens <= chunk_size:
-        chunk_text = tokenizer.decode(input_ids, skip_special_tokens=True)
-        chunked_data.append({"text": chunk_text, "label": label})
-        chunk_dist[1] += 1
-        continue
-
-    # Long doc — chunk with stride
-    count = 0
-    for i in range(0, total_tokens, chunk_size - stride):
-        chunk_ids = input_ids[i:i + chunk_size][:chunk_size]
-        if len(chunk_ids) < 10:
-            continue
-        chunk_text = tokenizer.decode(chunk_ids, skip_special_tokens=True)
-        chunked_data.append({"text": chunk_text, "label": label})
-        count += 1
-
-    if count > 0:
-        chunk_dist[count] += 1
-    else:
-        chunk_dist[0] += 1  
-
-# Save to disk
-with open(output_jsonl, "w", encoding="utf-8") as out_f:
-    for item in chunked_data:
-        out_f.write(json.dumps(item) + "\n")
-
-# -------------------- Print Summary --------------------
-print(f"✅ Saved {len(chunked_data)} chunked examples to {output_jsonl}\n")
-
-total_docs = sum(chunk_dist.values())
-single_chunk = chunk_dist[1]
-multi_chunk = sum(count for c, count in chunk_dist.items() if c > 1)
-skipped = chunk_dist[0]
-
-print("📊 Chunking Distribution:")
-for c in sorted(chunk_dist):
-    print(f" - {c} chunk(s): {chunk_dist[c]} docs")
-
-print(f"\n📦 Total documents: {total_docs}")
-print(f"✅ Single-chunk: {single_chunk}")
-print(f"🧱 Multi-chunk: {multi_chunk}")
-print(f"🚫 Skipped: {skipped}")
-
-# -------------------- Optional: Plot --------------------
-try:
-    import matplotlib.pyplot as plt
-
-    chunk_keys = sorted(k for k in chunk_dist if k > 0)
-    chunk_vals = [chunk_dist[k] for k in chunk_keys]
-
-    plt.figure(figsize=(10, 5))
-    plt.bar(chunk_keys, chunk_vals)
-    plt.xlabel("Chunks per Document")
-    plt.ylabel("Number of Documents")
-    plt.title("Chunk Distribution")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
-except ImportError:
-    pass  
+batch_size = 64  # documents per tokenizer call
+workers = 1  # >1 tokenizes batches on a multiprocessing pool
+token_store_dir = None  # e.g. "uoa4_full_trainset_tokens" -> memory-mapped token ids for training
+shard_size = None  # e.g. 100_000 -> uoa4_full_trainset_chunked-00000.jsonl, ...
+metrics_json = None  # e.g. "chunker_metrics.json" -> run summary with docs/sec and chunks/sec
+metrics_prom = None  # e.g. "chunker.prom" -> Prometheus text metrics
+length_buckets = None  # e.g. 8 -> num_tokens per chunk, a length-bucketed batch index and a padding report
+train_batch_size = 4  # batch size the batch index and padding report are built for
+batch_index_path = "uoa4_full_trainset_batches.json"
+
+def main():
+    metrics_args = metrics.options(prom=metrics_prom, json=metrics_json)
+    metrics.start(metrics_args)
+    # Load fast tokenizer; short docs (<= chunk_size tokens) are kept as one chunk
+    chunker = Chunker(model_name, chunk_size=chunk_size, stride=stride, keep_short=True,
+                      with_ids=token_store_dir is not None, with_lengths=length_buckets is not None)
+
+    chunk_dist = defaultdict(int)  # e.g., {1: 103, 2: 74, 3: 6}
+    lengths, labels = [], []  # per chunk, in output order, for the batch index
+
+    # Stream the dataset line by line and write chunks as they are produced,
+    # so memory stays flat regardless of corpus size.
+    # Chunk text is sliced from the original string via offset mappings (no decode)
+    examples = iter_records(input_jsonl)
+    store = None
+    if token_store_dir:
+        store = TokenStoreWriter(token_store_dir, tokenizer_info(chunker.tokenizer),
+                                 extra={"chunk_size": chunk_size, "stride": stride})
+    with record_writer(output_jsonl, shard_size=shard_size, stage="chunked") as out:
+        for chunks, count in chunk_documents(examples, chunker, batch_size=batch_size, workers=workers):
+            for item in chunks:
+                if store is not None:
+                    store.add(item.pop("input_ids"), item["label"])
+                if length_buckets:
+                    lengths.append(item["num_tokens"])
+                    labels.append(item["label"])
+                out.write(item)
+            chunk_dist[count] += 1
+
+    if store is not None:
+        store.close()
+        print(f"🧮 Token ids for {store.count} chunks saved to {token_store_dir}")
+
+    # -------------------- Print Summary --------------------
+    print(f"✅ Saved {out.count} chunked examples to {', '.join(out.paths)}\n")
+
+    total_docs = sum(chunk_dist.values())
+    single_chunk = chunk_dist[1]
+    multi_chunk = sum(count for c, count in chunk_dist.items() if c > 1)
+    skipped = chunk_dist[0]
+
+    print("📊 Chunking Distribution:")
+    for c in sorted(chunk_dist):
+        print(f" - {c} chunk(s): {chunk_dist[c]} docs")
+
+    print(f"\n📦 Total documents: {total_docs}")
+    print(f"✅ Single-chunk: {single_chunk}")
+    print(f"🧱 Multi-chunk: {multi_chunk}")
+    print(f"🚫 Skipped: {skipped}")
+    metrics.finish(metrics_args)
+
+    if length_buckets:
+        index, _ = build_index(lengths, labels, length_buckets, train_batch_size, chunk_size)
+        write_index(batch_index_path, index)
+        print(f"\n{report(index)}")
+        print(f"💾 Batch index ({len(index['batches'])} batches) saved to {batch_index_path}")
+
+    # -------------------- Optional: Plot --------------------
+    try:
+        import matplotlib.pyplot as plt
+
+        chunk_keys = sorted(k for k in chunk_dist if k > 0)
+        chunk_vals = [chunk_dist[k] for k in chunk_keys]
+
+        plt.figure(figsize=(10, 5))
+        plt.bar(chunk_keys, chunk_vals)
+        plt.xlabel("Chunks per Document")
+        plt.ylabel("Number of Documents")
+        plt.title("Chunk Distribution")
+        plt.grid(True)
+        plt.tight_layout()
+        plt.show()
+    except ImportError:
+        pass  
+
+if __name__ == "__main__":
+    main()
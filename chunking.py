@@ -0,0 +1,169 @@
+"""
+Chunking engine shared by chunker.py and chunker2.py.
+
+Documents are tokenized in batches with the fast (Rust) tokenizer and
+`return_offsets_mapping=True`, so each chunk's text is sliced straight out of
+the original string instead of running tokenizer.decode on every window.
+Input is consumed lazily, so it can stream from jsonl_io.iter_records, and
+batches can optionally be spread over a multiprocessing pool.
+
+Window semantics match the original scripts: windows of `chunk_size` tokens
+(special tokens included) starting every `chunk_size - stride` tokens, and
+windows shorter than `min_tokens` are skipped. With `keep_short=True`
+(chunker2.py) a document that fits in one window is always kept whole.
+With `with_ids=True` each chunk also carries its "input_ids" for
+token_store.TokenStoreWriter, and with `with_lengths=True` its "num_tokens"
+(special tokens included, as the model sees it) for length_buckets.py.
+
+Usage:
+    chunker = Chunker("google/bigbird-roberta-base", keep_short=True)
+    for chunks, count in chunk_documents(examples, chunker, workers=4):
+        chunk_dist[count] += 1
+"""
+
+import os
+import time
+
+import metrics
+from parallel import batched, imap_bounded
+
+CHUNK_SIZE = 4096
+STRIDE = 512        # overlap to preserve context
+MIN_TOKENS = 10     # skip tiny trailing chunks
+BATCH_SIZE = 64
+
+
+class Chunker:
+    """Token-window chunker built on a fast tokenizer's offset mapping."""
+
+    def __init__(self, model_name, chunk_size=CHUNK_SIZE, stride=STRIDE,
+                 min_tokens=MIN_TOKENS, keep_short=False, with_ids=False, with_lengths=False):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.stride = stride
+        self.min_tokens = min_tokens
+        self.keep_short = keep_short
+        self.with_ids = with_ids
+        self.with_lengths = with_lengths
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        if not self.tokenizer.is_fast:
+            raise ValueError(f"{model_name} has no fast tokenizer; offset mappings need one")
+
+    def config(self):
+        """Picklable settings used to rebuild the chunker in worker processes."""
+        return (self.model_name, self.chunk_size, self.stride, self.min_tokens,
+                self.keep_short, self.with_ids, self.with_lengths)
+
+    def windows(self, total_tokens):
+        """Yield (start, end) token windows for a document of total_tokens."""
+        if self.keep_short and total_tokens <= self.chunk_size:
+            yield 0, total_tokens
+            return
+        for i in range(0, total_tokens, self.chunk_size - self.stride):
+            end = min(i + self.chunk_size, total_tokens)
+            if end - i < self.min_tokens:
+                continue
+            yield i, end
+
+    def chunk_ids(self, input_ids, special, start, end):
+        """Token ids for a window, re-wrapped in the model's special tokens.
+
+        Equivalent to tokenizing the chunk text again ([CLS] ... [SEP]) and
+        truncating to chunk_size, without running the tokenizer.
+        """
+        inner = [tok for tok, sp in zip(input_ids[start:end], special[start:end]) if not sp]
+        limit = self.chunk_size - self.tokenizer.num_special_tokens_to_add()
+        return self.tokenizer.build_inputs_with_special_tokens(inner[:limit])
+
+    def encode(self, texts):
+        return self.tokenizer(
+            texts,
+            truncation=False,
+            return_offsets_mapping=True,
+            return_special_tokens_mask=True,
+            return_attention_mask=False,
+            verbose=False,
+        )
+
+    def chunk_batch(self, entries):
+        """Chunk a list of {"text", "label"} entries; returns [(chunks, count)] per entry."""
+        texts = [entry["text"] if isinstance(entry["text"], str) else "" for entry in entries]
+        encoded = self.encode(texts)
+        num_special = self.tokenizer.num_special_tokens_to_add()
+        results = []
+        for entry, text, input_ids, offsets, special in zip(
+                entries, texts, encoded["input_ids"], encoded["offset_mapping"],
+                encoded["special_tokens_mask"]):
+            label = str(entry["label"]).strip()
+            chunks = []
+            for start, end in self.windows(len(offsets)):
+                chunk = {"text": slice_text(text, offsets, special, start, end), "label": label}
+                if entry.get("doi"):
+                    chunk["doi"] = entry["doi"]
+                if self.with_ids:
+                    chunk["input_ids"] = self.chunk_ids(input_ids, special, start, end)
+                if self.with_lengths:
+                    inner = end - start - sum(special[start:end])
+                    chunk["num_tokens"] = min(inner + num_special, self.chunk_size)
+                chunks.append(chunk)
+            results.append((chunks, len(chunks)))
+        return results
+
+
+def slice_text(text, offsets, special, start, end):
+    """Original text covered by the non-special tokens in [start, end)."""
+    first = start
+    while first < end and special[first]:
+        first += 1
+    last = end - 1
+    while last >= first and special[last]:
+        last -= 1
+    if first > last:
+        return ""
+    return text[offsets[first][0]:offsets[last][1]]
+
+
+_worker_chunker = None
+
+
+def _init_worker(config):
+    global _worker_chunker
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_chunker = Chunker(*config)
+
+
+def _chunk_in_worker(batch):
+    return _worker_chunker.chunk_batch(batch)
+
+
+def chunk_documents(entries, chunker, batch_size=BATCH_SIZE, workers=1):
+    """Yield (chunks, count) per entry, in input order.
+
+    `entries` may be any iterable (e.g. jsonl_io.iter_records) and is consumed
+    lazily. With workers > 1 batches are tokenized on a multiprocessing pool;
+    each worker loads its own copy of the tokenizer and at most 2 * workers
+    batches are in flight, so memory stays bounded on large inputs.
+    """
+    if workers <= 1:
+        for batch in batched(entries, batch_size):
+            start = time.perf_counter()
+            results = chunker.chunk_batch(batch)
+            metrics.observe("chunk_batch_seconds", time.perf_counter() - start)
+            _count(results)
+            yield from results
+        return
+
+    import multiprocessing as mp
+
+    with mp.get_context("spawn").Pool(workers, initializer=_init_worker,
+                                      initargs=(chunker.config(),)) as pool:
+        for results in imap_bounded(pool, _chunk_in_worker, batched(entries, batch_size), 2 * workers):
+            _count(results)
+            yield from results
+
+
+def _count(results):
+    metrics.inc("chunk_docs_total", len(results))
+    metrics.inc("chunks_total", sum(count for _, count in results))
@@ -1,56 +1,145 @@
-
 """
 Script: Combine full-text files with REF star ratings into a JSONL dataset.
 
 Requirements:
-- Each text file corresponds to a DOI (with special characters replaced)
+- Each text file corresponds to a DOI (named with doi_utils.encode_filename)
 - A CSV with columns: DOI, Assigned Star
-- Text files are .txt and named like sanitized DOIs
+- Text files are .txt and named like encoded DOIs (older sanitized names are also found)
+
+How it works:
+- texts_folder is scanned once with os.scandir into a DOI -> path index
+  (names decoded with doi_utils, so the codec matches every other script)
+- the index is joined against the CSV with a pandas merge, not row by row
+- files are read on a thread pool and records are streamed to output_path
+  (.gz / .zst compress the output, a .corpus path writes a Parquet store)
+- DOIs without a usable text file go to missing_path instead of one print each
+- section offsets written by `extractor.py --sections` (<name>.sections.json)
+  ride along as a "sections" field, so cleaning skips its START/END scans
 
 Usage:
 - Set your input paths below (csv_path, texts_folder, output_path)
 """
 
+import hashlib
 import os
-import json
+import re
+from multiprocessing.pool import ThreadPool
+
 import pandas as pd
 
+import metrics
+from doi_utils import DOI_PREFIXES, decode_filename, filename_candidates, filename_stem, normalize_doi
+from extractor import read_sections
+from jsonl_io import record_writer
+from parallel import imap_bounded
+
 # --------------- USER INPUT ----------------
 csv_path = ""          # CSV file with DOI and Assigned Star
 texts_folder = ""          # Folder containing .txt files
-output_path = ""  # Output file path
+output_path = ""  # Output file path (.jsonl, .jsonl.gz, .jsonl.zst or a .corpus store)
+missing_path = "combine_missing.csv"  # DOIs with no (or an empty) text file
+workers = 16      # reader threads
+metrics_json = None  # e.g. "combiner_metrics.json" -> run summary with docs/sec and skip reasons
+metrics_prom = None  # e.g. "combiner.prom" -> Prometheus text metrics
 # -------------------------------------------
 
-def sanitize_doi(doi):
-    return doi.replace("/", "_").replace(":", "_")
+PREFIX_RE = "^(?:" + "|".join(re.escape(prefix) for prefix in DOI_PREFIXES) + ")"
 
-def main():
-    df = pd.read_csv(csv_path)
-    records = []
+def normalize_dois(dois):
+    """Vectorized normalize_doi over a pandas Series."""
+    return (dois.where(dois.map(lambda d: isinstance(d, str)), "")
+            .str.strip()
+            .str.replace(PREFIX_RE, "", regex=True, case=False)
+            .str.strip()
+            .str.lower())
 
-    for _, row in df.iterrows():
-        doi = row["DOI"]
-        label = row["Assigned Star"]
-        file_name = sanitize_doi(doi) + ".txt"
-        file_path = os.path.join(texts_folder, file_name)
+def index_text_files(folder):
+    """One directory scan -> DataFrame(key, path) plus a {stem: path} map for legacy names."""
+    keys, paths, stems = [], [], {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".txt") or not entry.is_file():
+                continue
+            stem = filename_stem(entry.name)
+            stems[stem] = entry.path
+            keys.append(normalize_doi(decode_filename(stem)))
+            paths.append(entry.path)
+    index = pd.DataFrame({"key": keys, "path": paths}).drop_duplicates("key")
+    return index, stems
 
+def find_text_file(doi, stems=None):
+    if stems is not None:
+        for file_name in filename_candidates(doi.strip()):
+            if file_name in stems:
+                return stems[file_name]
+        return None
+    for file_name in filename_candidates(doi.strip(), ".txt"):
+        file_path = os.path.join(texts_folder, file_name)
         if os.path.isfile(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read().strip()
-                if text:
-                    records.append({
-                        "text": text,
-                        "label": str(label)
-                    })
-        else:
-            print(f"⚠️ Missing file for DOI: {doi}")
-
-    with open(output_path, "w", encoding="utf-8") as out_file:
-        for record in records:
-            json.dump(record, out_file)
-            out_file.write("\n")
-
-    print(f"✅ Saved {len(records)} records to {output_path}")
+            return file_path
+    return None
+
+def join_ratings(df, folder):
+    """Ratings rows with a "path" column (None where no text file exists)."""
+    index, stems = index_text_files(folder)
+    df = df.assign(key=normalize_dois(df["DOI"]))
+    df = df.merge(index, on="key", how="left")
+    # Files saved under an older sanitized name don't decode to their DOI
+    unmatched = df["path"].isna() & df["DOI"].map(lambda d: isinstance(d, str))
+    df.loc[unmatched, "path"] = df.loc[unmatched, "DOI"].map(lambda d: find_text_file(d, stems))
+    return df
+
+def read_document(path):
+    """Stripped text plus its section offsets (shifted to match), or None without a sidecar."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    text = raw.strip()
+    sections = read_sections(path)
+    if sections is not None:
+        lead = len(raw) - len(raw.lstrip())
+        start = min(max(0, sections["start"] - lead), len(text))
+        end = min(max(start, sections["end"] - lead), len(text))
+        sections = dict(sections, start=start, end=end)
+    return text, sections
+
+def read_row(row):
+    doi, label, path = row
+    if not isinstance(path, str):
+        return doi, label, None, None, "No text file"
+    text, sections = read_document(path)
+    return doi, label, text, sections, None if text else "Empty text"
+
+def make_record(doi, label, text, sections=None):
+    record = {"doi": doi, "text": text, "label": str(label),
+              "extraction_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()}
+    if sections is not None:
+        record["sections"] = sections
+    return record
+
+def main():
+    metrics_args = metrics.options(prom=metrics_prom, json=metrics_json)
+    metrics.start(metrics_args)
+    df = join_ratings(pd.read_csv(csv_path), texts_folder)
+    rows = zip(df["DOI"], df["Assigned Star"], df["path"])
+    missing = []
+
+    with ThreadPool(workers) as pool, \
+            record_writer(output_path, stage="combined", source=texts_folder) as out:
+        for doi, label, text, sections, reason in imap_bounded(pool, read_row, rows, 4 * workers):
+            metrics.inc("combine_docs_total", result=reason or "written")
+            if reason:
+                missing.append({"DOI": doi, "Reason": reason})
+            else:
+                out.write(make_record(doi, label, text, sections))
+                metrics.inc("combine_text_chars_total", len(text))
+
+    print(f"✅ Saved {out.count} records to {output_path}")
+    if missing:
+        report = pd.DataFrame(missing)
+        report.to_csv(missing_path, index=False)
+        counts = ", ".join(f"{reason}: {n}" for reason, n in report["Reason"].value_counts().items())
+        print(f"⚠️ {len(missing)} DOIs skipped ({counts}), see {missing_path}")
+    metrics.finish(metrics_args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,303 @@
+"""
+Sharded, zstd-compressed Parquet corpus store.
+
+One storage format for every hand-off (combiner -> merger -> cleaner ->
+chunkers) instead of .txt folders, JSON arrays and JSONL that each stage
+re-parses in full. A store is a directory ending in ".corpus":
+
+    part-00000.parquet ...   shards of SHARD_SIZE rows, zstd, in row groups of at most
+                             ROW_GROUP_SIZE rows or ROW_GROUP_BYTES of text
+    doi_index.sqlite         normalized DOI -> (shard, row group, row in group)
+    corpus.json              schema, shard list, counts (written on close)
+
+Columns: doi, text, label, source, extraction_sha256, stage, meta (JSON of
+any other record fields). Reads can project columns and push filters such as
+label == 4 down to Parquet row-group statistics, so untouched columns and
+row groups are never decompressed. get(doi) decodes only the requested
+columns of the small row groups that hold the DOI's records.
+
+jsonl_io.iter_records and jsonl_io.record_writer dispatch here for ".corpus"
+paths, so the dataset scripts read and write a store wherever they accept a
+JSONL path. Needs `pip install pyarrow`.
+
+Usage:
+    with CorpusWriter("uoa4.corpus", stage="cleaned") as out:
+        out.write({"doi": "10.1/x", "text": text, "label": 4})
+
+    store = CorpusStore("uoa4.corpus")
+    for record in store.iter_records(columns=["text", "label"], filters={"label": 4}):
+        ...
+    store.get("10.1/x")   # every record (e.g. chunk) stored for that DOI
+"""
+
+import json
+import os
+import sqlite3
+from itertools import groupby
+
+from doi_utils import normalize_doi
+
+FORMAT_VERSION = 2
+SUFFIX = ".corpus"
+META_FILE = "corpus.json"
+INDEX_FILE = "doi_index.sqlite"
+SHARD_SIZE = 100_000
+ROW_GROUP_SIZE = 1_000
+ROW_GROUP_BYTES = 4 * 1024 * 1024   # text per row group, bounds what a DOI lookup decodes
+COMPRESSION = "zstd"
+COLUMNS = ("doi", "text", "label", "source", "extraction_sha256", "stage", "meta")
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading/writing .corpus stores needs `pip install pyarrow`")
+    return pyarrow
+
+
+def is_corpus(path):
+    """True for ".corpus" paths and for directories holding a finished store."""
+    path = path.rstrip("/\\")
+    return path.endswith(SUFFIX) or os.path.isfile(os.path.join(path, META_FILE))
+
+
+def row_group_starts(texts, max_rows=ROW_GROUP_SIZE, max_bytes=ROW_GROUP_BYTES):
+    """First row of each row group: at most max_rows rows and about max_bytes of text (chars)."""
+    starts = [0]
+    size = 0
+    for i, text in enumerate(texts):
+        length = len(text or "")
+        if i > starts[-1] and (i - starts[-1] >= max_rows or size + length > max_bytes):
+            starts.append(i)
+            size = 0
+        size += length
+    return starts
+
+
+def schema():
+    pa = _arrow()
+    return pa.schema([(name, pa.string()) for name in COLUMNS])
+
+
+class CorpusWriter:
+    """Write records into a fresh store; same write/count/close API as JSONLWriter."""
+
+    def __init__(self, path, stage=None, source=None, shard_size=SHARD_SIZE):
+        _arrow()
+        self.path = path.rstrip("/\\")
+        self.stage = stage
+        self.source = source
+        self.shard_size = shard_size
+        self.count = 0
+        self.shards = []
+        self.rows = {name: [] for name in COLUMNS}
+        self.int_labels = True
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):  # a store is always rewritten whole
+            if name.endswith(".parquet") or name in (META_FILE, INDEX_FILE):
+                os.remove(os.path.join(self.path, name))
+        self.index = sqlite3.connect(os.path.join(self.path, INDEX_FILE))
+        self.index.execute("CREATE TABLE docs (doi TEXT NOT NULL, shard INTEGER NOT NULL, "
+                           "row_group INTEGER NOT NULL, row INTEGER NOT NULL)")
+
+    @property
+    def paths(self):
+        return [os.path.join(self.path, shard["file"]) for shard in self.shards]
+
+    def write(self, record):
+        record = dict(record)
+        label = record.pop("label", None)
+        if label is not None and not isinstance(label, int):
+            self.int_labels = False
+        row = {
+            "doi": record.pop("doi", None),
+            "text": record.pop("text", None),
+            "label": None if label is None else str(label),
+            "source": record.pop("source", None) or self.source,
+            "extraction_sha256": record.pop("extraction_sha256", None),
+            "stage": self.stage or record.pop("stage", None),
+        }
+        record.pop("stage", None)
+        row["meta"] = json.dumps(record, ensure_ascii=False) if record else None
+        for name, value in row.items():
+            self.rows[name].append(value)
+        self.count += 1
+        if len(self.rows["doi"]) >= self.shard_size:
+            self._flush()
+
+    def _flush(self):
+        pa = _arrow()
+        n = len(self.rows["doi"])
+        if not n:
+            return
+        name = f"part-{len(self.shards):05d}.parquet"
+        table = pa.table(self.rows, schema=schema())
+        starts = row_group_starts(self.rows["text"])
+        with pa.parquet.ParquetWriter(os.path.join(self.path, name), schema(),
+                                      compression=COMPRESSION) as writer:
+            for group, (start, end) in enumerate(zip(starts, starts[1:] + [n])):
+                writer.write_table(table.slice(start, end - start), row_group_size=end - start)
+                self.index.executemany(
+                    "INSERT INTO docs VALUES (?, ?, ?, ?)",
+                    [(normalize_doi(doi), len(self.shards), group, row)
+                     for row, doi in enumerate(self.rows["doi"][start:end]) if doi],
+                )
+        self.shards.append({"file": name, "rows": n, "row_groups": len(starts)})
+        self.rows = {name: [] for name in COLUMNS}
+
+    def close(self):
+        if self.index is None:
+            return
+        self._flush()
+        self.index.execute("CREATE INDEX docs_doi ON docs (doi)")
+        self.index.commit()
+        self.index.close()
+        self.index = None
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "columns": list(COLUMNS),
+            "compression": COMPRESSION,
+            "row_group_size": ROW_GROUP_SIZE,
+            "row_group_bytes": ROW_GROUP_BYTES,
+            "label_type": "int" if self.int_labels else "str",
+            "count": self.count,
+            "shards": self.shards,
+        }
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusStore:
+    """Read side: projected/filtered streaming scans and DOI lookups."""
+
+    def __init__(self, path):
+        self.path = path.rstrip("/\\")
+        meta_path = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"{path} is not a finished corpus store (no {META_FILE})")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported corpus format {self.meta.get('format_version')}")
+        self.int_labels = self.meta["label_type"] == "int"
+        self._index = None
+        self._files = {}
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def dataset(self):
+        pa = _arrow()
+        files = [os.path.join(self.path, shard["file"]) for shard in self.meta["shards"]]
+        return pa.dataset.dataset(files, schema=schema(), format="parquet")
+
+    def expression(self, filters):
+        """{"label": 4, "stage": ["cleaned", "chunked"]} -> pyarrow filter expression."""
+        pa = _arrow()
+        expr = None
+        for name, value in (filters or {}).items():
+            if name not in COLUMNS:
+                raise KeyError(f"Unknown column {name!r}; filterable columns are {COLUMNS}")
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            term = pa.dataset.field(name).isin([str(v) for v in values])
+            expr = term if expr is None else expr & term
+        return expr
+
+    def to_table(self, columns=None, filters=None):
+        return self.dataset().to_table(columns=columns, filter=self.expression(filters))
+
+    def iter_records(self, columns=None, filters=None, batch_size=1024):
+        """Stream records as dicts, reading only `columns` and matching row groups."""
+        scanner = self.dataset().to_batches(columns=columns, filter=self.expression(filters),
+                                            batch_size=batch_size)
+        for batch in scanner:
+            for row in batch.to_pylist():
+                yield self._record(row)
+
+    def _record(self, row):
+        meta = row.pop("meta", None)
+        record = {name: value for name, value in row.items() if value is not None}
+        if self.int_labels and "label" in record:
+            record["label"] = int(record["label"])
+        if meta:
+            record.update(json.loads(meta))
+        return record
+
+    def get(self, doi, columns=None):
+        """All records stored for a DOI (several when the store holds chunks).
+
+        Each row group holding one of them is read once, `columns` only, and sliced.
+        """
+        pa = _arrow()
+        if self._index is None:
+            self._index = sqlite3.connect(os.path.join(self.path, INDEX_FILE))
+        rows = self._index.execute(
+            "SELECT shard, row_group, row FROM docs WHERE doi = ? ORDER BY shard, row_group, row",
+            (normalize_doi(doi),),
+        ).fetchall()
+        records = []
+        for (shard, group), hits in groupby(rows, key=lambda hit: hit[:2]):
+            if shard not in self._files:
+                name = self.meta["shards"][shard]["file"]
+                self._files[shard] = pa.parquet.ParquetFile(os.path.join(self.path, name))
+            table = self._files[shard].read_row_group(group, columns=columns)
+            records.extend(self._record(table.slice(row, 1).to_pylist()[0]) for _, _, row in hits)
+        return records
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._files = {}
+
+
+def iter_corpus(path, columns=None, filters=None):
+    store = CorpusStore(path)
+    try:
+        yield from store.iter_records(columns, filters)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from jsonl_io import iter_records, record_writer
+
+    parser = argparse.ArgumentParser(description="Convert between JSON/JSONL and .corpus stores, or inspect one")
+    parser.add_argument("source", help="JSON/JSONL file or .corpus store")
+    parser.add_argument("dest", nargs="?", help="Output .jsonl(.gz/.zst) or .corpus; omit to print stats")
+    parser.add_argument("--stage", default=None)
+    parser.add_argument("--label", action="append", help="Only records with this label (repeatable)")
+    args = parser.parse_args()
+
+    filters = {"label": args.label} if args.label else None
+    if is_corpus(args.source):
+        records = iter_corpus(args.source, filters=filters)
+    else:
+        records = (r for r in iter_records(args.source)
+                   if not args.label or str(r.get("label")) in args.label)
+
+    if args.dest:
+        with record_writer(args.dest, ensure_ascii=False, stage=args.stage) as out:
+            for record in records:
+                out.write(record)
+        print(f"✅ Wrote {out.count} records to {args.dest}")
+    else:
+        store = CorpusStore(args.source)
+        size = sum(os.path.getsize(p) for p in
+                   (os.path.join(store.path, s["file"]) for s in store.meta["shards"]))
+        print(f"📦 {len(store)} records in {len(store.meta['shards'])} shards, {size / 1e6:.1f} MB")
+        if filters:
+            print(f"🔎 Matching --label: {store.to_table(columns=['label'], filters=filters).num_rows}")
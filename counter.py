@@ -1,21 +1,211 @@
-import zipfile
+import argparse
+import gzip
+import io
 import json
+import os
+import zipfile
+from bisect import bisect_right
 from collections import Counter
 
-# Enter zip path
-zip_path = ""
-extract_path = ""
+from cleaning import MIN_CHARS
+from jsonl_io import iter_records, read_records
+from merger import digest, normalize_text
 
-# Unzip
-with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-    zip_ref.extractall(extract_path)
+# Dataset stats in one streaming pass: nothing is extracted to disk and no
+# file is loaded whole. Zip members, .gz/.zst and plain JSON/JSONL all work.
+#
+#   python counter.py uoa4_full_trainset.zip
+#   python counter.py a.jsonl b.json.gz --tokenizer google/bigbird-roberta-base --json
 
-# Find JSON and count labels
-import os
-json_file = [f for f in os.listdir(extract_path) if f.endswith(".json")][0]
-with open(os.path.join(extract_path, json_file), "r", encoding='utf-8') as f:
-    data = [json.loads(line) for line in f]
+# === Config ===
+WORKERS = os.cpu_count() or 1
+RECORD_SUFFIXES = (".json", ".jsonl", ".json.gz", ".jsonl.gz")
+LENGTH_BINS = [0, 1, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000]  # characters
+TOKEN_BINS = [0, 512, 1024, 2048, 4096, 8192, 16384]                      # tokens
+TOKEN_BATCH = 64
+
+def bin_names(bins):
+    names = []
+    for lo, hi in zip(bins, bins[1:] + [None]):
+        if hi is None:
+            names.append(f"{lo}+")
+        elif hi - lo == 1:
+            names.append(str(lo))
+        else:
+            names.append(f"{lo}-{hi - 1}")
+    return names
+
+LENGTH_NAMES = bin_names(LENGTH_BINS)
+TOKEN_NAMES = bin_names(TOKEN_BINS)
+
+def bin_of(bins, names, value):
+    return names[bisect_right(bins, value) - 1]
+
+class DatasetStats:
+    """Counts for one input (or the total); text digests give the duplicate rate."""
+
+    def __init__(self, name, min_chars=MIN_CHARS):
+        self.name = name
+        self.min_chars = min_chars
+        self.records = 0
+        self.chars = 0
+        self.empty = 0
+        self.short = 0
+        self.labels = Counter()
+        self.lengths = Counter()
+        self.tokens = Counter()
+        self.digests = set()
+
+    @property
+    def duplicates(self):
+        return self.records - len(self.digests)
+
+    def add(self, record, token_count=None):
+        text = record.get("text")
+        text = text if isinstance(text, str) else ""
+        label = record.get("label")
+        self.records += 1
+        self.chars += len(text)
+        self.labels["<missing>" if label is None else str(label)] += 1
+        self.lengths[bin_of(LENGTH_BINS, LENGTH_NAMES, len(text))] += 1
+        if not text.strip():
+            self.empty += 1
+        elif len(text) <= self.min_chars:
+            self.short += 1
+        if token_count is not None:
+            self.tokens[bin_of(TOKEN_BINS, TOKEN_NAMES, token_count)] += 1
+        self.digests.add(digest(normalize_text(text)))
+
+    def merge(self, other):
+        self.records += other.records
+        self.chars += other.chars
+        self.empty += other.empty
+        self.short += other.short
+        self.labels.update(other.labels)
+        self.lengths.update(other.lengths)
+        self.tokens.update(other.tokens)
+        self.digests |= other.digests
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "records": self.records,
+            "mean_chars": round(self.chars / self.records, 1) if self.records else 0,
+            "empty": self.empty,
+            "short": self.short,
+            "duplicates": self.duplicates,
+            "duplicate_rate": round(self.duplicates / self.records, 4) if self.records else 0,
+            "labels": dict(self.labels.most_common()),
+            "char_lengths": {name: self.lengths[name] for name in LENGTH_NAMES},
+            "token_lengths": ({name: self.tokens[name] for name in TOKEN_NAMES}
+                              if self.tokens else None),
+        }
+
+# === Inputs ===
+def list_sources(paths):
+    """(path, zip member or None) for every record file to count."""
+    sources = []
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if name.endswith(RECORD_SUFFIXES) and not name.startswith("__MACOSX/"):
+                        sources.append((path, name))
+        else:
+            sources.append((path, None))
+    return sources
+
+def iter_source(path, member):
+    if member is None:
+        yield from iter_records(path)
+        return
+    with zipfile.ZipFile(path) as zf, zf.open(member) as raw:
+        stream = gzip.GzipFile(fileobj=raw) if member.endswith(".gz") else raw
+        yield from read_records(io.TextIOWrapper(stream, encoding="utf-8"))
+
+# === Counting (one task per source) ===
+_tokenizers = {}
+
+def count_tokens(tokenizer_name, texts):
+    if tokenizer_name not in _tokenizers:
+        from transformers import AutoTokenizer
+        _tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+    encoded = _tokenizers[tokenizer_name](texts, truncation=False, return_attention_mask=False,
+                                          verbose=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+def count_source(task):
+    path, member, tokenizer_name, min_chars = task
+    stats = DatasetStats(f"{path}:{member}" if member else path, min_chars)
+    if not tokenizer_name:
+        for record in iter_source(path, member):
+            stats.add(record)
+        return stats
+    batch = []
+    for record in iter_source(path, member):
+        batch.append(record)
+        if len(batch) >= TOKEN_BATCH:
+            flush_tokens(stats, batch, tokenizer_name)
+    flush_tokens(stats, batch, tokenizer_name)
+    return stats
+
+def flush_tokens(stats, batch, tokenizer_name):
+    if not batch:
+        return
+    texts = [r.get("text") if isinstance(r.get("text"), str) else "" for r in batch]
+    for record, n in zip(batch, count_tokens(tokenizer_name, texts)):
+        stats.add(record, n)
+    batch.clear()
+
+def count_all(paths, tokenizer_name=None, workers=WORKERS, min_chars=MIN_CHARS):
+    """Per-source stats plus a merged total (duplicates counted across sources)."""
+    tasks = [(path, member, tokenizer_name, min_chars) for path, member in list_sources(paths)]
+    if workers <= 1 or len(tasks) <= 1:
+        per_source = [count_source(task) for task in tasks]
+    else:
+        import multiprocessing as mp
+        with mp.get_context("spawn").Pool(min(workers, len(tasks))) as pool:
+            per_source = pool.map(count_source, tasks, chunksize=1)
+    total = DatasetStats("TOTAL", min_chars)
+    for stats in per_source:
+        total.merge(stats)
+    return per_source, total
+
+# === Output ===
+def print_table(per_source, total, min_chars):
+    for stats in per_source + ([total] if len(per_source) > 1 else []):
+        d = stats.as_dict()
+        print(f"\n📂 {d['name']}")
+        print(f"   records {d['records']}   mean chars {d['mean_chars']}   empty {d['empty']}   "
+              f"short (<= {min_chars} chars) {d['short']}   "
+              f"duplicates {d['duplicates']} ({d['duplicate_rate']:.2%})")
+        print("   labels: " + ", ".join(f"{k}: {v}" for k, v in d["labels"].items()))
+
+    d = total.as_dict()
+    for title, hist in (("Text length (chars)", d["char_lengths"]),
+                        ("Token length", d["token_lengths"])):
+        if not hist:
+            continue
+        print(f"\n📊 {title}")
+        peak = max(hist.values()) or 1
+        for name, n in hist.items():
+            print(f"   {name:>12} {n:>9}  {'█' * round(30 * n / peak)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming label/length/duplicate stats for JSON/JSONL datasets")
+    parser.add_argument("inputs", nargs="+", help="Zip archives, JSON arrays or JSONL files (.gz/.zst ok)")
+    parser.add_argument("--tokenizer", default=None, help="Also histogram token lengths with this tokenizer")
+    parser.add_argument("--min-chars", type=int, default=MIN_CHARS, help="Texts at or below this are 'short'")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--json", action="store_true", help="Print the stats as JSON")
+    args = parser.parse_args()
+
+    per_source, total = count_all(args.inputs, args.tokenizer, args.workers, args.min_chars)
+    if args.json:
+        print(json.dumps({"sources": [s.as_dict() for s in per_source], "total": total.as_dict()},
+                         indent=2, ensure_ascii=False))
+    else:
+        print_table(per_source, total, args.min_chars)
 
-labels = [item['label'] for item in data]
-label_counts = dict(Counter(labels))
-print(label_counts)
+if __name__ == "__main__":
+    main()
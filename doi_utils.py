@@ -0,0 +1,202 @@
+"""
+Shared DOI helpers: normalization, a reversible filename codec and an
+index-based filename -> DOI matcher.
+
+Filename codec
+    "%", "_" and characters Windows rejects in filenames are percent-escaped,
+    then "/" becomes "_". Decoding reverses both steps, so DOIs that already
+    contain "_" or ":" round-trip exactly. DOIs without those characters get
+    the same names as the old doi.replace("/", "_") scheme, so existing
+    ref_pdfs/ and uoa4_texts/ folders keep matching.
+
+    encode_filename("10.1000/a_b:c")  -> "10.1000_a%5Fb%3Ac"
+    decode_filename("10.1000_a%5Fb%3Ac") -> "10.1000/a_b:c"
+
+Matcher
+    DOIMatcher(dois).match(filename) tries an exact hash lookup on the decoded
+    name and on the legacy sanitized names first, then falls back to an
+    Aho-Corasick scan for DOIs embedded in longer filenames. Matching N files
+    against M DOIs is linear in the total length instead of N x M.
+"""
+
+import os
+from collections import deque
+
+DOI_PREFIXES = (
+    "https://doi.org/",
+    "http://doi.org/",
+    "https://dx.doi.org/",
+    "http://dx.doi.org/",
+    "doi.org/",
+    "doi:",
+)
+
+FILE_EXTENSIONS = (".pdf", ".txt", ".json", ".jsonl")
+
+# Escaped before "/" -> "_" so decoding is unambiguous
+_ESCAPE = set('%_\\:*?"<>|')
+
+
+def normalize_doi(doi):
+    """Canonical form: trimmed, no resolver prefix, lower case."""
+    if not isinstance(doi, str):
+        return ""
+    doi = doi.strip()
+    lowered = doi.lower()
+    for prefix in DOI_PREFIXES:
+        if lowered.startswith(prefix):
+            doi = doi[len(prefix):]
+            break
+    return doi.strip().lower()
+
+
+def encode_filename(doi):
+    """Lossless DOI -> filename stem (no extension)."""
+    out = []
+    for ch in doi:
+        if ch in _ESCAPE or ord(ch) < 32:
+            out.append("%%%02X" % ord(ch))
+        elif ch == "/":
+            out.append("_")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def decode_filename(stem):
+    """Inverse of encode_filename."""
+    out = []
+    i = 0
+    while i < len(stem):
+        ch = stem[i]
+        if ch == "_":
+            out.append("/")
+        elif ch == "%" and _is_hex(stem[i + 1:i + 3]):
+            out.append(chr(int(stem[i + 1:i + 3], 16)))
+            i += 2
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _is_hex(s):
+    return len(s) == 2 and all(c in "0123456789abcdefABCDEF" for c in s)
+
+
+def filename_stem(filename):
+    """Basename without a known extension (DOIs themselves may contain dots)."""
+    name = os.path.basename(filename)
+    stem, ext = os.path.splitext(name)
+    return stem if ext.lower() in FILE_EXTENSIONS else name
+
+
+def doi_from_filename(filename):
+    """DOI for a file named with encode_filename (extension optional)."""
+    return decode_filename(filename_stem(filename))
+
+
+def legacy_names(doi):
+    """Stems produced by the old per-script sanitizers."""
+    return [doi.replace("/", "_"), doi.replace("/", "_").replace(":", "_")]
+
+
+def filename_candidates(doi, ext=""):
+    """Current name first, then legacy names, without duplicates."""
+    names = [encode_filename(doi)] + legacy_names(doi)
+    return [name + ext for name in dict.fromkeys(names)]
+
+
+class AhoCorasick:
+    """Multi-pattern substring automaton over plain strings."""
+
+    def __init__(self, patterns=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [None]     # pattern ending exactly at this node
+        self.link = [0]       # nearest suffix node with an output
+        self.built = False
+        for pattern, value in patterns:
+            self.add(pattern, value)
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(None)
+                self.link.append(0)
+            node = nxt
+        if self.out[node] is None:
+            self.out[node] = (len(pattern), value)
+        self.built = False
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                fn = self.fail[nxt]
+                self.link[nxt] = fn if self.out[fn] is not None else self.link[fn]
+        self.built = True
+
+    def iter_matches(self, text):
+        """Yield (end_index, length, value) for every pattern occurrence."""
+        if not self.built:
+            self.build()
+        node = 0
+        goto, fail, out, link = self.goto, self.fail, self.out, self.link
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if out[node] is not None else link[node]
+            while hit:
+                length, value = out[hit]
+                yield i, length, value
+                hit = link[hit]
+
+    def longest_match(self, text):
+        best = None
+        for _, length, value in self.iter_matches(text):
+            if best is None or length > best[0]:
+                best = (length, value)
+        return best[1] if best else None
+
+
+class DOIMatcher:
+    """Map filenames to DOIs by exact key lookup, then by substring automaton."""
+
+    def __init__(self, dois):
+        self.exact = {}
+        self.automaton = AhoCorasick()
+        for doi in dois:
+            if not isinstance(doi, str) or not doi.strip():
+                continue
+            doi = doi.strip()
+            keys = {normalize_doi(doi), encode_filename(normalize_doi(doi)).lower()}
+            keys.update(name.lower() for name in legacy_names(normalize_doi(doi)))
+            for key in keys:
+                self.exact.setdefault(key, doi)
+                self.automaton.add(key, doi)
+        self.automaton.build()
+
+    def match(self, filename):
+        """Return the DOI for a filename, or None."""
+        stem = filename_stem(filename)
+        key = stem.lower()
+        for candidate in (normalize_doi(decode_filename(stem)), key):
+            if candidate in self.exact:
+                return self.exact[candidate]
+        return self.automaton.longest_match(key)
@@ -1,6 +1,8 @@
 import os
 import pandas as pd
 
+from doi_utils import doi_from_filename, normalize_doi
+
 # --- CONFIGURE ---
 CSV_FILE = 'extracted_dois.csv'      # Your CSV file with DOIs or whatever you named it
 PDF_FOLDER = 'ref_pdfs/'             # Folder containing the PDF files
@@ -9,16 +11,15 @@ DOI_COLUMN = 'DOI'                   # Column name in your CSV
 
 # --- STEP 1: Load DOIs from CSV ---
 df = pd.read_csv(CSV_FILE)
-doi_set = set(df[DOI_COLUMN].astype(str).str.strip())
+doi_set = {normalize_doi(doi): doi for doi in df[DOI_COLUMN].dropna().astype(str).str.strip()}
 
 # --- STEP 2: Extract DOI from PDF filenames and map them ---
 matched = []
 for fname in os.listdir(PDF_FOLDER):
     if fname.lower().endswith('.pdf'):
-        name = os.path.splitext(fname)[0]  # Remove .pdf extension
-        doi = name.replace("_", "/")       # Convert filename to DOI
+        doi = normalize_doi(doi_from_filename(fname))  # Decode filename back to its DOI
         if doi in doi_set:
-            matched.append({'DOI': doi, 'PDF_File': fname})
+            matched.append({'DOI': doi_set[doi], 'PDF_File': fname})
 
 # --- STEP 3: Save matched DOIs with filenames to CSV ---
 matched_df = pd.DataFrame(matched)
@@ -1,12 +1,22 @@
-import requests
-import time
 import os
 import pandas as pd
 
+from doi_utils import encode_filename
+from fetch_scheduler import download_many
+from resolver import resolve_dois
+from unpaywall_cache import UnpaywallCache
+from unpaywall_snapshot import UnpaywallSnapshot
+
 # === SETUP ===
 EMAIL = " "     # Put your email here
 CSV_PATH = "extracted_dois.csv"  # Path to the CSV file containing DOIs or whatever
 PDF_DIR = "ref_pdfs"
+STORE_DIR = os.path.join(PDF_DIR, ".by_hash")  # One copy per unique PDF, hard-linked per DOI
+RATE_LIMIT = 10   # Unpaywall requests per second
+CONCURRENCY = 20  # Unpaywall requests in flight
+DOWNLOAD_WORKERS = 16  # PDF downloads in flight, spread across hosts
+CACHE_PATH = "unpaywall_cache.sqlite"  # Unpaywall responses reused across runs
+SNAPSHOT_INDEX = None  # e.g. "unpaywall_snapshot.sqlite" from unpaywall_snapshot.py; misses still use the API
 os.makedirs(PDF_DIR, exist_ok=True)
 
 # === LOAD DOIs ===
@@ -15,40 +25,30 @@ dois = df['DOI'].dropna().unique()
 
 # === DEFINE FUNCTIONS ===
 
-def get_pdf_url(doi):
-    """Check Unpaywall for OA PDF URL"""
-    api_url = f"https://api.unpaywall.org/v2/{doi}?email={EMAIL}"
-    try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
-            data = response.json()
-            location = data.get("best_oa_location", {})
-            return location.get("url_for_pdf")
-    except Exception as e:
-        print(f"Error fetching {doi}: {e}")
-    return None
-
-def download_pdf(pdf_url, filename):
-    """Download PDF from URL"""
-    try:
-        response = requests.get(pdf_url)
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            print(f"✅ Downloaded: {filename}")
-            return True
-    except Exception as e:
-        print(f"❌ Failed to download {pdf_url}: {e}")
-    return False
+def report_resolved(doi, pdf_urls, error):
+    """Print resolver progress as results come in"""
+    print(f"🔎 Checked DOI: {doi}" + (f" ({len(pdf_urls)} locations)" if pdf_urls else f" ({error})"))
+
+def report_downloaded(doi, result):
+    """Print download results as they come in"""
+    if result.ok:
+        print(f"✅ Downloaded: {result.path} from {result.url}")
+    else:
+        print(f"❌ Failed to download {doi}: {result.reason}")
 
 # === MAIN LOOP ===
 
+snapshot = UnpaywallSnapshot(SNAPSHOT_INDEX) if SNAPSHOT_INDEX else None
+resolved = resolve_dois(dois, EMAIL, rate=RATE_LIMIT, concurrency=CONCURRENCY,
+                        cache=UnpaywallCache(CACHE_PATH), snapshot=snapshot,
+                        on_result=report_resolved)
+
+jobs = []
 for doi in dois:
-    print(f"🔎 Checking DOI: {doi}")
-    pdf_url = get_pdf_url(doi)
-    if pdf_url:
-        filename = os.path.join(PDF_DIR, doi.replace("/", "_") + ".pdf")
-        download_pdf(pdf_url, filename)
+    pdf_urls, _ = resolved[doi]
+    if pdf_urls:
+        jobs.append((doi, pdf_urls, os.path.join(PDF_DIR, encode_filename(doi) + ".pdf")))
     else:
         print(f"⚠️  No OA version for DOI: {doi}")
-    time.sleep(1)  
+
+download_many(jobs, on_result=report_downloaded, workers=DOWNLOAD_WORKERS, store_dir=STORE_DIR)
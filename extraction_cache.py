@@ -0,0 +1,170 @@
+"""
+Content-addressed cache of extracted PDF text.
+
+Entries are keyed by the PDF's SHA-256, the PyMuPDF/MuPDF version and the
+extraction options, so:
+
+- reruns over ref_pdfs/ or in unpawall api.py skip every unchanged PDF;
+- the same PDF saved under several DOIs is extracted once;
+- upgrading PyMuPDF or changing the options misses cleanly, without
+  returning text produced by different settings.
+
+Page texts are stored zlib-compressed in SQLite. Every hit refreshes the
+entry's last-used time, and the least recently used entries are evicted
+once the cache is over max_bytes.
+
+Usage:
+    cache = ExtractionCache("extraction_cache.sqlite", options=TEXT_OPTIONS)
+    pages = cache.get(sha256)          # list of page texts, or None
+    cache.put(sha256, pages)
+
+    python extraction_cache.py extraction_cache.sqlite     # size and entry count
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+CACHE_PATH = "extraction_cache.sqlite"
+MAX_BYTES = 2 * 1024 ** 3     # evict least recently used entries beyond this
+COMMIT_EVERY = 200
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pymupdf_version():
+    import fitz  # PyMuPDF
+
+    return f"pymupdf-{fitz.VersionBind}/mupdf-{fitz.VersionFitz}"
+
+
+class ExtractionCache:
+    """(PDF sha256, extractor version, options) -> page texts, LRU-bounded."""
+
+    def __init__(self, path=CACHE_PATH, options=None, version=None, max_bytes=MAX_BYTES):
+        self.path = path
+        self.version = version or pymupdf_version()
+        self.options = json.dumps(options or {}, sort_keys=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS extractions (
+                sha256 TEXT NOT NULL,
+                version TEXT NOT NULL,
+                options TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (sha256, version, options)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)")
+        self.conn.commit()
+
+    def get(self, sha256):
+        """Page texts for this PDF under the current version/options, or None."""
+        key = (sha256, self.version, self.options)
+        row = self.conn.execute(
+            "SELECT body FROM extractions WHERE sha256 = ? AND version = ? AND options = ?", key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE extractions SET last_used = ? WHERE sha256 = ? AND version = ? AND options = ?",
+            (time.time(),) + key,
+        )
+        self._wrote()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, sha256, pages):
+        body = zlib.compress(json.dumps(pages, ensure_ascii=False).encode("utf-8"), 6)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sha256, self.version, self.options, len(pages), body, len(body), time.time()),
+        )
+        self._wrote()
+
+    def _wrote(self):
+        self.writes += 1
+        if self.writes >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        self.writes = 0
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for rowid, size in self.conn.execute(
+            "SELECT rowid, size FROM extractions ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM extractions WHERE rowid = ?", (rowid,))
+            total -= size
+            removed += 1
+        self.conn.commit()
+        return removed
+
+    def stats(self):
+        count, size, pages = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(pages), 0) FROM extractions"
+        ).fetchone()
+        return {"entries": count, "bytes": size, "pages": pages,
+                "hits": self.hits, "misses": self.misses}
+
+    def report(self):
+        stats = self.stats()
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f"📦 Extraction cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate); "
+                f"{stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or shrink the extraction cache")
+    parser.add_argument("path", nargs="?", default=CACHE_PATH)
+    parser.add_argument("--max-mb", type=float, default=None, help="Evict down to this size")
+    args = parser.parse_args()
+
+    max_bytes = int(args.max_mb * 1e6) if args.max_mb is not None else MAX_BYTES
+    cache = ExtractionCache(args.path, version="-", max_bytes=max_bytes)
+    if args.max_mb is not None:
+        print(f"🧹 Evicted {cache.evict()} entries")
+    stats = cache.stats()
+    versions = cache.conn.execute(
+        "SELECT version, COUNT(*) FROM extractions GROUP BY version ORDER BY version"
+    ).fetchall()
+    print(f"📦 Entries: {stats['entries']} ({stats['pages']} pages)")
+    print(f"💾 Size: {stats['bytes'] / 1e6:.1f} MB")
+    for version, count in versions:
+        print(f" - {version}: {count}")
+    cache.close()
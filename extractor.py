@@ -0,0 +1,534 @@
+"""
+Script: Extract text from a folder of PDFs on a pool of worker processes.
+
+- One worker per core by default; each PDF gets a wall-clock timeout and a
+  worker that overruns it is killed and replaced, so one malformed PDF can't
+  stall the run.
+- Workers are recycled after MAX_TASKS_PER_WORKER PDFs to bound PyMuPDF leaks.
+- Writes one .txt per PDF and a status log in the same format as
+  uoa4_extraction_log.csv (DOI, Status, Reason, Assigned Star).
+- Page texts are cached by PDF content hash, PyMuPDF version and extraction
+  options (extraction_cache.py). Reruns skip unchanged PDFs, and identical
+  PDFs saved under several DOIs are extracted once.
+- --sections streams pages and stops at the references. cleaning.py's body
+  start (ABSTRACT/INTRODUCTION/...) and REFERENCES/BIBLIOGRAPHY rules are
+  applied page by page, so the cleaned text comes out the same. Each .txt
+  ends where the references begin and gets a `<name>.sections.json` with
+  the body offsets. combiner.py and cleaning.Cleaner use these offsets
+  instead of re-scanning the document. --headings only accepts a
+  REFERENCES/BIBLIOGRAPHY line that stands on its own, not the word
+  inside a sentence.
+
+Usage:
+    python extractor.py ref_pdfs/ --out-dir uoa4_texts --log uoa4_extraction_log.csv
+    python extractor.py ref_pdfs/ --ratings DOI___Star_Ratings_for_UoA_4.csv --timeout 60
+    python extractor.py ref_pdfs/ --sections      # stop at the references, write offsets
+    python extractor.py ref_pdfs/ --cache ""      # no extraction cache
+"""
+
+import csv
+import json
+import multiprocessing as mp
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, as_completed
+from multiprocessing.connection import wait
+
+import metrics
+from cleaning import END_RE, START_RE
+from doi_utils import doi_from_filename
+from extraction_cache import CACHE_PATH, ExtractionCache, file_sha256
+
+WORKERS = os.cpu_count() or 1
+TIMEOUT = 120               # seconds per PDF
+MAX_TASKS_PER_WORKER = 200
+LOG_COLUMNS = ["DOI", "Status", "Reason", "Assigned Star"]
+
+# Extraction options are part of the cache key: "mode" goes to page.get_text,
+# "sections" stops at the references, "headings" wants a standalone heading line
+TEXT_OPTIONS = {"mode": "text"}
+SECTION_OPTIONS = {"mode": "text", "sections": True}
+HEADING_OPTIONS = {"mode": "text", "sections": True, "headings": True}
+HEADING_END_RE = re.compile(r'^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?(REFERENCES|BIBLIOGRAPHY)[ \t]*:?[ \t]*$',
+                            re.IGNORECASE | re.MULTILINE)
+
+
+def extract_options(sections=False, headings=False):
+    if headings:
+        return HEADING_OPTIONS
+    return SECTION_OPTIONS if sections else TEXT_OPTIONS
+
+
+def open_cache(path=CACHE_PATH, options=TEXT_OPTIONS):
+    """ExtractionCache for the current PyMuPDF version and `options` (None if path is empty)."""
+    return ExtractionCache(path, options=options) if path else None
+
+
+def iter_pdf_pages(pdf_path, mode="text"):
+    """Yield page texts one at a time; closing the generator early skips the rest."""
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield page.get_text(mode)
+
+
+def scan_sections(pages, headings=False):
+    """Read page texts until the references start; returns (pages read, sections).
+
+    sections = {"start", "end", "references", "pages"}, with start/end being
+    offsets into "".join(pages read). They match what cleaning.Cleaner finds:
+    the first START_RE hit, then the first END_RE hit after it (or from 0
+    when there is no start). Pages are only abandoned once both are found.
+    """
+    end_re = HEADING_END_RE if headings else END_RE
+    read = []
+    offset = 0
+    start = None
+    first_end = None   # END hit before any START; used if no START turns up
+    for text in pages:
+        read.append(text)
+        base = offset
+        offset += len(text)
+        pos = 0
+        if start is None:
+            match = START_RE.search(text)
+            if match is None:
+                if first_end is None:
+                    match = end_re.search(text)
+                    if match:
+                        first_end = base + match.start()
+                continue
+            start = base + match.start()
+            pos = match.start()
+        match = end_re.search(text, pos)
+        if match:
+            return read, {"start": start, "end": base + match.start(), "references": True, "pages": len(read)}
+    if start is None and first_end is not None:
+        return read, {"start": 0, "end": first_end, "references": True, "pages": len(read)}
+    return read, {"start": start or 0, "end": offset, "references": False, "pages": len(read)}
+
+
+def extract_pdf_pages(pdf_path, options=TEXT_OPTIONS):
+    """Return page texts of one PDF; with options["sections"], none past the references page."""
+    pages = iter_pdf_pages(pdf_path, options["mode"])
+    try:
+        with metrics.timer("extract_seconds"):
+            if options.get("sections"):
+                read = scan_sections(pages, options.get("headings", False))[0]
+            else:
+                read = list(pages)
+    finally:
+        pages.close()
+    metrics.inc("extract_pages_total", len(read))
+    return read
+
+
+def render(pages, options=TEXT_OPTIONS):
+    """(text, sections) from page texts; sections is None unless options["sections"]."""
+    if not options.get("sections"):
+        return "".join(pages), None
+    pages, sections = scan_sections(pages, options.get("headings", False))
+    return "".join(pages)[:sections["end"]], sections
+
+
+def cached_pages(pdf_path, cache, sha256=None, options=TEXT_OPTIONS):
+    """extract_pdf_pages through the cache; `sha256` skips hashing when the caller knows it."""
+    sha256 = sha256 or file_sha256(pdf_path)
+    pages = cache.get(sha256)
+    metrics.inc("extract_cache_total", result="miss" if pages is None else "hit")
+    if pages is None:
+        pages = extract_pdf_pages(pdf_path, options)
+        cache.put(sha256, pages)
+    return pages
+
+
+def extract_document(pdf_path, cache=None, sha256=None, options=TEXT_OPTIONS):
+    """Return (text, pages read, sections) for one PDF; sections is None unless options["sections"]."""
+    if cache is None:
+        pages = extract_pdf_pages(pdf_path, options)
+    else:
+        pages = cached_pages(pdf_path, cache, sha256, options)
+    text, sections = render(pages, options)
+    return text, len(pages), sections
+
+
+def extract_pdf_text(pdf_path, cache=None, sha256=None, options=TEXT_OPTIONS):
+    """Return (text, page_count) for one PDF."""
+    return extract_document(pdf_path, cache, sha256, options)[:2]
+
+
+def extract_pages_task(pdf_path, options=TEXT_OPTIONS):
+    """Worker task: (status, reason, pages) with pages None on failure."""
+    try:
+        return "success", "", extract_pdf_pages(pdf_path, options)
+    except Exception as e:
+        return "failed", f"Extraction error: {e}", None
+
+
+def sections_path(txt_path):
+    return os.path.splitext(txt_path)[0] + ".sections.json"
+
+
+def read_sections(txt_path):
+    """Section offsets written next to a .txt, or None."""
+    path = sections_path(txt_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_atomic(path, content):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def write_text(out_path, text, sections=None):
+    """Write a .txt and its sections sidecar (removing a stale one)."""
+    _write_atomic(out_path, text)
+    if sections is not None:
+        _write_atomic(sections_path(out_path), json.dumps(sections))
+    elif os.path.exists(sections_path(out_path)):
+        os.remove(sections_path(out_path))
+
+
+def save_text(pages, out_path, options=TEXT_OPTIONS):
+    """Write the page texts (cut at the references in section mode). Returns (status, reason, chars)."""
+    text, sections = render(pages, options)
+    if not text.strip():
+        return "failed", "Empty text", 0
+    write_text(out_path, text, sections)
+    return "success", "", len(text)
+
+
+def extract_to_file(pdf_path, out_path, options=TEXT_OPTIONS):
+    """Worker task: extract one PDF and write its text. Returns (status, reason, pages, chars)."""
+    status, reason, pages = extract_pages_task(pdf_path, options)
+    if pages is None:
+        return status, reason, 0, 0
+    status, reason, chars = save_text(pages, out_path, options)
+    return status, reason, len(pages), chars
+
+
+def _worker_main(conn):
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        func, args = task
+        conn.send(func(*args))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.task = None
+        self.started = None
+        self.done = 0
+
+    def submit(self, task, func, args):
+        self.task = task
+        self.started = time.monotonic()
+        self.conn.send((func, args))
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class TaskFailed(Exception):
+    """A pooled task overran its timeout, lost its worker or was cancelled; str() is the reason."""
+
+
+class WorkerPool:
+    """Spawned worker processes fed from a queue, with a per-task timeout.
+
+    submit() returns a concurrent.futures.Future (wrap it with
+    asyncio.wrap_future in async code). A task's clock starts when a worker
+    picks it up, not when it is queued. A task over `timeout` has its worker
+    killed and replaced and fails with TaskFailed("Timeout after Ns"); a
+    crashed worker fails its task with TaskFailed("Worker crashed").
+    """
+
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT, max_tasks=MAX_TASKS_PER_WORKER):
+        self.ctx = mp.get_context("spawn")
+        self.size = max(1, workers)
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.pending = deque()
+        self.workers = []
+        self.closed = False
+        self.cancelled = False
+        self.woken = False      # a wakeup byte is already on its way to the supervisor
+        self.lock = threading.Lock()
+        self.wakeup, self.waker = self.ctx.Pipe(duplex=False)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("WorkerPool is closed")
+            self.pending.append((future, func, args))
+            wake, self.woken = not self.woken, True
+        if wake:
+            self.waker.send_bytes(b"!")
+        return future
+
+    def close(self, cancel=False):
+        """Stop the pool once queued tasks finish; cancel=True drops them and kills busy workers."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.cancelled = cancel
+            wake, self.woken = not self.woken, True
+        if wake:
+            self.waker.send_bytes(b"!")
+        self.thread.join()
+
+    def _start_tasks(self):
+        with self.lock:
+            self.woken = False
+            if self.cancelled:
+                for future, _, _ in self.pending:
+                    future.cancel()
+                self.pending.clear()
+            for i in range(self.size):
+                if not self.pending:
+                    break
+                if i == len(self.workers):
+                    self.workers.append(_Worker(self.ctx))
+                worker = self.workers[i]
+                if worker.task is not None:
+                    continue
+                if worker.done >= self.max_tasks:
+                    worker.stop()
+                    worker = self.workers[i] = _Worker(self.ctx)
+                while self.pending:
+                    future, func, args = self.pending.popleft()
+                    if future.set_running_or_notify_cancel():
+                        worker.submit(future, func, args)
+                        break
+            busy = [w for w in self.workers if w.task is not None]
+            finished = self.closed and (self.cancelled or not (self.pending or busy))
+        return busy, finished
+
+    def _run(self):
+        try:
+            while True:
+                busy, finished = self._start_tasks()
+                if finished:
+                    return
+                deadline = min((w.started + self.timeout for w in busy), default=None)
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                ready = wait([w.conn for w in busy] + [self.wakeup], timeout=timeout)
+                if self.wakeup in ready:
+                    while self.wakeup.poll():
+                        self.wakeup.recv_bytes()
+                for i, worker in enumerate(self.workers):
+                    if worker.task is None:
+                        continue
+                    if worker.conn in ready:
+                        future = worker.task
+                        try:
+                            result = worker.conn.recv()
+                        except (EOFError, OSError):
+                            worker.kill()
+                            self.workers[i] = _Worker(self.ctx)
+                            future.set_exception(TaskFailed("Worker crashed"))
+                            continue
+                        worker.task = None
+                        worker.done += 1
+                        future.set_result(result)
+                    elif time.monotonic() - worker.started >= self.timeout:
+                        future = worker.task
+                        worker.kill()
+                        self.workers[i] = _Worker(self.ctx)
+                        future.set_exception(TaskFailed(f"Timeout after {self.timeout:g}s"))
+        finally:
+            with self.lock:
+                self.closed = True   # if the supervisor died, later submits fail instead of hanging
+                for future, _, _ in self.pending:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(TaskFailed("Pool stopped"))
+                self.pending.clear()
+            for worker in self.workers:
+                if worker.task is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+                    worker.task.set_exception(TaskFailed("Cancelled"))
+            self.wakeup.close()
+            self.waker.close()
+
+
+def run_tasks(tasks, func, workers=WORKERS, timeout=TIMEOUT, max_tasks=MAX_TASKS_PER_WORKER):
+    """Run func(*args) for each (task_id, args) and yield (task_id, result, error).
+
+    A task exceeding `timeout` seconds has its worker killed and yields
+    error "Timeout after Ns"; a crashed worker yields "Worker crashed".
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return
+    pool = WorkerPool(min(workers, len(tasks)), timeout, max_tasks)
+    try:
+        futures = {pool.submit(func, *args): task_id for task_id, args in tasks}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except TaskFailed as e:
+                yield futures[future], None, str(e)
+    finally:
+        pool.close(cancel=True)
+
+
+def load_ratings(csv_path):
+    if not csv_path:
+        return {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return {row["DOI"].strip(): row.get("Assigned Star", "") for row in csv.DictReader(f)}
+
+
+def extract_folder(pdf_dir, out_dir, log_path, workers=WORKERS, timeout=TIMEOUT,
+                   ratings=None, force=False, cache=None, options=TEXT_OPTIONS):
+    os.makedirs(out_dir, exist_ok=True)
+    ratings = ratings or {}
+    log = []
+    todo = []
+    for entry in sorted(os.scandir(pdf_dir), key=lambda e: e.name):
+        if not entry.is_file() or not entry.name.lower().endswith(".pdf"):
+            continue
+        out_path = os.path.join(out_dir, os.path.splitext(entry.name)[0] + ".txt")
+        doi = doi_from_filename(entry.name)
+        if os.path.exists(out_path) and not force:
+            log.append([doi, "✅ success", "", ratings.get(doi, "")])
+            continue
+        todo.append((entry, out_path))
+
+    # One task per distinct PDF; `targets` lists the .txt files each one feeds
+    tasks = []
+    targets = {}
+    cached = []
+    hashes = {}   # (device, inode) -> sha256, so hard-linked copies are read once
+    for entry, out_path in todo:
+        if cache is None:
+            tasks.append((entry.name, (entry.path, options)))
+            targets[entry.name] = [(entry.name, out_path)]
+            continue
+        stat = entry.stat()
+        sha256 = hashes.get((stat.st_dev, stat.st_ino))
+        if sha256 is None:
+            sha256 = hashes[stat.st_dev, stat.st_ino] = file_sha256(entry.path)
+        if sha256 in targets:
+            targets[sha256].append((entry.name, out_path))
+            continue
+        pages = cache.get(sha256)
+        metrics.inc("extract_cache_total", result="miss" if pages is None else "hit")
+        if pages is not None:
+            cached.append((entry.name, out_path, pages))
+            continue
+        tasks.append((sha256, (entry.path, options)))
+        targets[sha256] = [(entry.name, out_path)]
+
+    duplicates = len(todo) - len(cached) - len(tasks)
+    print(f"📄 {len(tasks)} PDFs to extract on {min(workers, len(tasks)) or 0} workers "
+          f"({len(log)} already done, {len(cached)} from cache, {duplicates} duplicates)")
+    start = time.monotonic()
+    pages_total = 0
+    failures = 0
+
+    def record(name, status, reason):
+        nonlocal failures
+        doi = doi_from_filename(name)
+        metrics.inc("extract_docs_total", status=status)
+        if status == "success":
+            log.append([doi, "✅ success", "", ratings.get(doi, "")])
+        else:
+            failures += 1
+            print(f"❌ {name}: {reason}")
+            log.append([doi, "❌ failed", reason, ratings.get(doi, "")])
+
+    for name, out_path, pages in cached:
+        status, reason, _ = save_text(pages, out_path, options)
+        record(name, status, reason)
+
+    for i, (task_id, result, error) in enumerate(run_tasks(tasks, extract_pages_task, workers, timeout), 1):
+        status, reason, pages = result if error is None else ("failed", error, None)
+        if pages is not None:
+            pages_total += len(pages)
+            metrics.inc("extract_pages_total", len(pages))
+            if cache is not None:
+                cache.put(task_id, pages)
+        for name, out_path in targets[task_id]:
+            if pages is not None:
+                status, reason, _ = save_text(pages, out_path, options)
+            record(name, status, reason)
+        if i % 100 == 0:
+            elapsed = time.monotonic() - start
+            print(f"[{i}/{len(tasks)}] {pages_total / max(elapsed, 1e-9):.1f} pages/sec")
+
+    elapsed = time.monotonic() - start
+    with open(log_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(LOG_COLUMNS)
+        writer.writerows(log)
+
+    print(f"\n✅ Wrote {len(todo) - failures}/{len(todo)} texts in {elapsed:.1f}s")
+    print(f"📈 {pages_total} pages extracted, {pages_total / max(elapsed, 1e-9):.1f} pages/sec")
+    if cache is not None:
+        cache.commit()
+        print(cache.report())
+    print(f"❌ Failures: {failures}. Log saved to {log_path}")
+    return log
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract text from a folder of PDFs in parallel")
+    parser.add_argument("pdf_dir")
+    parser.add_argument("--out-dir", default="uoa4_texts")
+    parser.add_argument("--log", default="uoa4_extraction_log.csv")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="Seconds per PDF")
+    parser.add_argument("--ratings", default=None, help="CSV with DOI and Assigned Star columns")
+    parser.add_argument("--force", action="store_true", help="Re-extract PDFs that already have a .txt")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Extraction cache path ('' to disable)")
+    parser.add_argument("--sections", action="store_true",
+                        help="Stop at the references and write <name>.sections.json body offsets")
+    parser.add_argument("--headings", action="store_true",
+                        help="With --sections, end only at a standalone REFERENCES/BIBLIOGRAPHY line")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args)
+
+    options = extract_options(args.sections or args.headings, args.headings)
+    cache = open_cache(args.cache, options)
+    extract_folder(args.pdf_dir, args.out_dir, args.log, args.workers, args.timeout,
+                   load_ratings(args.ratings), args.force, cache, options)
+    if cache is not None:
+        cache.close()
+    metrics.finish(args)
@@ -0,0 +1,447 @@
+"""
+Host-aware scheduler for PDF downloads.
+
+Most OA PDFs come from a handful of publisher and repository hosts, and some
+of them throttle us or go down. Jobs are queued per host and handed to one
+shared thread pool round-robin across hosts, so a slow host never holds up
+the others. Each host gets:
+
+- a concurrency limit that adapts AIMD-style: +1/limit per success (about +1
+  per round of requests) and halved on a 429/503, at most once per second;
+- a pause when throttled: the Retry-After it sent, otherwise exponential
+  backoff with jitter (retried jobs also back off on their own);
+- a circuit breaker: after BREAKER_FAILURES failures in a row its jobs are
+  set aside for a cooldown (doubling on every trip) while other hosts keep
+  going, then a single probe decides whether it reopens. After MAX_TRIPS
+  trips the jobs left fail with "Circuit open", which the ledger treats as
+  retryable, so a later --resume run picks them up.
+
+Permanent failures (404, Not a PDF, Too large) end that location at once and
+do not count against the host.
+
+A job can list several candidate URLs for one document, ranked best first
+(resolver.py collects every Unpaywall oa_location). The first candidate
+starts on its own. If no PDF bytes have arrived after HEDGE_AFTER seconds,
+or it fails, the next candidate starts alongside it, and so on. Each
+candidate streams to its own `<dest>.locN` file. The first complete PDF is
+moved to `dest` and the other transfers are cancelled. result.url records
+the winning location.
+
+Usage:
+    results = download_many([(doi, [url, fallback_url], dest), ...], store_dir=STORE_DIR)
+
+    with FetchScheduler(workers=16) as scheduler:
+        result = scheduler.submit(url, dest).result()
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import metrics
+from fetcher import (THROTTLE_REASONS, DownloadResult, attempt_download, backoff_delay,
+                     host_of, is_permanent, store_pdf)
+
+WORKERS = 16            # downloads in flight across all hosts
+INITIAL_LIMIT = 2       # starting concurrency per host
+MAX_LIMIT = 8
+MIN_LIMIT = 1
+RETRIES = 4             # attempts per location
+HEDGE_AFTER = 5.0       # seconds without PDF bytes before trying the next location
+BACKOFF = 1             # base seconds for exponential backoff
+BREAKER_FAILURES = 5    # failures in a row that open a host's circuit
+BREAKER_COOLDOWN = 30   # seconds set aside on the first trip
+MAX_TRIPS = 3
+MAX_RETRY_AFTER = 300   # longest Retry-After we honour as-is
+DECREASE_INTERVAL = 1.0
+
+
+class Job:
+    """One document: its candidate URLs, best first, and the race between them."""
+
+    __slots__ = ("urls", "dest", "future", "cancel", "next", "live", "streaming",
+                 "hedge_token", "reasons")
+
+    def __init__(self, urls, dest):
+        self.urls = urls
+        self.dest = dest
+        self.future = Future()
+        self.cancel = threading.Event()
+        self.next = 0           # index of the next location to start
+        self.live = 0           # locations started and not yet given up
+        self.streaming = False  # some location is sending PDF bytes
+        self.hedge_token = None
+        self.reasons = []
+
+    def mark_streaming(self):
+        self.streaming = True
+
+
+class Attempt:
+    """One location of a job, retried on its host."""
+
+    __slots__ = ("job", "index", "url", "tries", "probe")
+
+    def __init__(self, job, index):
+        self.job = job
+        self.index = index
+        self.url = job.urls[index]
+        self.tries = 0
+        self.probe = False
+
+    @property
+    def path(self):
+        return f"{self.job.dest}.loc{self.index}"
+
+
+class HostState:
+    """Queue, concurrency limit, pause and circuit breaker for one host."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = float(limit)
+        self.queue = deque()    # attempts not tried yet
+        self.retry = []         # (not_before, seq, attempt) heap
+        self.in_flight = 0
+        self.not_before = 0.0   # host-wide pause (Retry-After / throttling backoff)
+        self.failures = 0       # in a row
+        self.trips = 0
+        self.open_until = None  # set while the circuit is open
+        self.last_decrease = 0.0
+        self.ok = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def pending(self):
+        return len(self.queue) + len(self.retry)
+
+    def capacity(self, now):
+        """How many more requests may start now."""
+        if now < self.not_before:
+            return 0
+        if self.open_until is not None:
+            if now < self.open_until or self.in_flight:
+                return 0
+            return 1  # half-open: one probe
+        return int(self.limit) - self.in_flight
+
+    def next_attempt(self, now):
+        if self.retry and self.retry[0][0] <= now:
+            return heapq.heappop(self.retry)[2]
+        if self.queue:
+            return self.queue.popleft()
+        return None
+
+    def ready_at(self):
+        """Earliest time a queued attempt could start, ignoring the concurrency limit."""
+        job_at = 0.0 if self.queue else self.retry[0][0]
+        return max(self.not_before, self.open_until or 0.0, job_at)
+
+    def report(self):
+        state = "open" if self.open_until is not None else "closed"
+        return (f" - {self.name:<40} limit={self.limit:4.1f} ✅ {self.ok:>5} ❌ {self.failed:>4} "
+                f"throttled {self.throttled:>4} trips {self.trips} ({state})")
+
+
+class FetchScheduler:
+    """Thread pool that interleaves downloads across hosts with per-host limits."""
+
+    def __init__(self, workers=WORKERS, initial_limit=INITIAL_LIMIT, max_limit=MAX_LIMIT,
+                 retries=RETRIES, backoff=BACKOFF, breaker_failures=BREAKER_FAILURES,
+                 breaker_cooldown=BREAKER_COOLDOWN, max_trips=MAX_TRIPS, hedge_after=HEDGE_AFTER,
+                 store_dir=None, **fetch_kwargs):
+        self.workers = workers
+        self.initial_limit = min(initial_limit, max_limit)
+        self.max_limit = max_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.max_trips = max_trips
+        self.hedge_after = hedge_after
+        self.store_dir = store_dir
+        self.fetch_kwargs = fetch_kwargs
+        self.hosts = {}
+        self.timers = []        # (at, token, job) hedge deadlines
+        self.cursor = 0
+        self.running = 0
+        self.closed = False
+        self.hedged = 0
+        self.wins = {}          # location rank -> documents won
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.thread = threading.Thread(target=self._dispatch, daemon=True)
+        self.thread.start()
+
+    def submit(self, urls, dest):
+        """Queue a download from one URL or a ranked list; the Future resolves to a DownloadResult."""
+        if isinstance(urls, str):
+            urls = [urls]
+        job = Job(list(dict.fromkeys(urls)), dest)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("FetchScheduler is closed")
+            if not job.urls:
+                job.future.set_result(DownloadResult(False, "No OA PDF", None, 0, None))
+            else:
+                self._start_next(job, time.monotonic())
+                self.cond.notify()
+        return job.future
+
+    def close(self, cancel=False):
+        """Wait for queued jobs to finish (or cancel them) and stop the workers."""
+        with self.cond:
+            self.closed = True
+            if cancel:
+                for host in self.hosts.values():
+                    for attempt in list(host.queue) + [item[2] for item in host.retry]:
+                        attempt.job.cancel.set()
+                        attempt.job.future.cancel()
+                    host.queue.clear()
+                    host.retry.clear()
+                self.timers.clear()
+            self.cond.notify()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(cancel=exc_type is not None)
+
+    def report(self):
+        with self.cond:
+            lines = [host.report() for host in self.hosts.values()]
+            if self.hedged:
+                wins = ", ".join(f"#{rank + 1}: {count}" for rank, count in sorted(self.wins.items()))
+                lines.append(f" - hedged {self.hedged} times; wins by location rank {wins}")
+            return lines
+
+    # === Dispatch ===
+
+    def _dispatch(self):
+        with self.cond:
+            while True:
+                wake = self._launch_ready()
+                if self.closed and not self.running and not any(h.pending() for h in self.hosts.values()):
+                    return
+                self.cond.wait(None if wake is None else max(0.0, wake - time.monotonic()))
+
+    def _launch_ready(self):
+        """Fire due hedges, then start attempts one host at a time, round-robin.
+
+        Returns when to look again (or None to wait for a completion).
+        """
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, token, job = heapq.heappop(self.timers)
+            if token == job.hedge_token and not job.streaming and not job.future.done():
+                self.hedged += 1
+                metrics.inc("download_hedges_total")
+                self._start_next(job, now)
+
+        launched = True
+        while launched and self.running < self.workers:
+            launched = False
+            hosts = list(self.hosts.values())
+            first = self.cursor
+            for offset in range(len(hosts)):
+                if self.running >= self.workers:
+                    break
+                index = (first + offset) % len(hosts)
+                host = hosts[index]
+                if host.capacity(now) <= 0:
+                    continue
+                attempt = host.next_attempt(now)
+                if attempt is None:
+                    continue
+                if attempt.job.future.done():
+                    launched = True  # another location already won
+                    continue
+                self._start(host, attempt, now)
+                self.cursor = index + 1
+                launched = True
+
+        wake = self.timers[0][0] if self.timers else None
+        for host in self.hosts.values():
+            if host.pending() and host.open_until != float("inf"):
+                at = host.ready_at()
+                if at > now and (wake is None or at < wake):
+                    wake = at
+        return wake
+
+    def _start_next(self, job, now):
+        """Queue the job's next location (if any) at the front of its host's queue."""
+        while job.next < len(job.urls):
+            attempt = Attempt(job, job.next)
+            job.next += 1
+            host = self.hosts.get(host_of(attempt.url))
+            if host is None:
+                host = self.hosts[host_of(attempt.url)] = HostState(host_of(attempt.url), self.initial_limit)
+            if host.open_until == float("inf"):
+                job.reasons.append(self._circuit_reason(host))
+                continue
+            job.live += 1
+            if attempt.index == 0:
+                host.queue.append(attempt)
+            else:
+                host.queue.appendleft(attempt)  # hedges jump the queue
+            return
+        if not job.live:
+            self._fail(job)
+
+    def _start(self, host, attempt, now):
+        job = attempt.job
+        attempt.probe = host.open_until is not None
+        if attempt.tries == 0 and attempt.index == job.next - 1 and job.next < len(job.urls):
+            job.hedge_token = next(self.seq)
+            heapq.heappush(self.timers, (now + self.hedge_after, job.hedge_token, job))
+        host.in_flight += 1
+        self.running += 1
+        self.pool.submit(self._run, host, attempt)
+
+    def _run(self, host, attempt):
+        job = attempt.job
+        try:
+            result = attempt_download(attempt.url, attempt.path, host.name, cancel=job.cancel,
+                                      on_pdf=job.mark_streaming, **self.fetch_kwargs)
+        except Exception as e:
+            result = DownloadResult(False, f"Download exception: {e}", None, 0, None)
+        with self.cond:
+            host.in_flight -= 1
+            self.running -= 1
+            self._settle(host, attempt, result, time.monotonic())
+            self.cond.notify()
+
+    # === Outcomes ===
+
+    def _settle(self, host, attempt, result, now):
+        job = attempt.job
+        attempt.tries += 1
+        if result.ok:
+            host.ok += 1
+            host.failures = 0
+            if host.open_until is not None:
+                print(f"🔌 Circuit closed for {host.name}")
+                host.open_until = None
+                host.trips = 0
+                host.limit = MIN_LIMIT
+            host.limit = min(self.max_limit, host.limit + 1 / host.limit)
+            metrics.set_gauge("host_concurrency_limit", host.limit, host=host.name)
+            self._win(attempt, result)
+            return
+        if job.future.done():
+            if not job.future.cancelled():
+                _remove(attempt.path + ".part")  # lost the race; keep parts of cancelled runs for resume
+            return
+        if is_permanent(result.reason):
+            host.failures = 0   # the host answered; the document is the problem
+            self._drop(host, attempt, result.reason, now)
+            return
+
+        host.failures += 1
+        delay = backoff_delay(attempt.tries - 1, self.backoff)
+        if result.reason in THROTTLE_REASONS:
+            host.throttled += 1
+            if now - host.last_decrease >= DECREASE_INTERVAL:
+                host.limit = max(MIN_LIMIT, host.limit / 2)
+                host.last_decrease = now
+                metrics.set_gauge("host_concurrency_limit", host.limit, host=host.name)
+            pause = delay if result.retry_after is None else min(result.retry_after, MAX_RETRY_AFTER)
+            host.not_before = max(host.not_before, now + pause)
+        if attempt.probe or (host.open_until is None and host.failures >= self.breaker_failures):
+            self._trip(host, now)
+
+        if host.open_until == float("inf"):
+            self._drop(host, attempt, self._circuit_reason(host), now)
+        elif attempt.tries >= self.retries:
+            self._drop(host, attempt, f"Download failed after {attempt.tries} attempts: {result.reason}", now)
+        else:
+            metrics.inc("download_retries_total", host=host.name)
+            heapq.heappush(host.retry, (now + delay, next(self.seq), attempt))
+            if attempt.index == attempt.job.next - 1:
+                self._start_next(attempt.job, now)  # don't wait out the backoff
+
+    def _win(self, attempt, result):
+        job = attempt.job
+        if job.future.done():
+            _remove(attempt.path)  # a faster location already won
+            return
+        job.cancel.set()
+        store_pdf(attempt.path, job.dest, result.sha256, self.store_dir)
+        self.wins[attempt.index] = self.wins.get(attempt.index, 0) + 1
+        metrics.inc("download_location_wins_total", rank=attempt.index + 1)
+        job.future.set_result(result._replace(path=job.dest, url=attempt.url))
+
+    def _drop(self, host, attempt, reason, now):
+        """Give up on one location; move on to the next, or fail the job when none are left."""
+        job = attempt.job
+        host.failed += 1
+        job.live -= 1
+        job.reasons.append(reason)
+        if job.next < len(job.urls):
+            self._start_next(job, now)
+        elif not job.live:
+            self._fail(job)
+
+    def _fail(self, job):
+        if len(job.urls) == 1 or all(is_permanent(reason) for reason in job.reasons):
+            reason = job.reasons[0]
+        else:
+            reason = f"All {len(job.urls)} locations failed: " + "; ".join(job.reasons)
+        job.future.set_result(DownloadResult(False, reason, None, 0, None))
+
+    def _trip(self, host, now):
+        host.trips += 1
+        metrics.inc("circuit_trips_total", host=host.name)
+        if host.trips > self.max_trips:
+            host.open_until = float("inf")
+            attempts = list(host.queue) + [item[2] for item in host.retry]
+            host.queue.clear()
+            host.retry.clear()
+            print(f"🔌 Giving up on {host.name} after {self.max_trips} trips; "
+                  f"{len(attempts)} downloads moved to other locations or left for --resume")
+            for attempt in attempts:
+                if not attempt.job.future.done():
+                    self._drop(host, attempt, self._circuit_reason(host), now)
+            return
+        cooldown = self.breaker_cooldown * 2 ** (host.trips - 1)
+        host.open_until = now + cooldown
+        print(f"🔌 Circuit open for {host.name} after {host.failures} failures in a row; "
+              f"setting {host.pending()} downloads aside for {cooldown:g}s")
+
+    def _circuit_reason(self, host):
+        return f"Circuit open: {host.name}"
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def download_many(jobs, on_result=None, **options):
+    """Download (key, url or ranked urls, dest) jobs through one FetchScheduler.
+
+    Returns {key: DownloadResult}; on_result(key, result) is called as each
+    job finishes. Options are FetchScheduler settings plus fetch_once
+    keywords (store_dir, timeout, ...).
+    """
+    results = {}
+    with FetchScheduler(**options) as scheduler:
+        futures = {scheduler.submit(urls, dest): key for key, urls, dest in jobs}
+        for future in as_completed(futures):
+            key = futures[future]
+            results[key] = future.result()
+            if on_result is not None:
+                on_result(key, results[key])
+        if scheduler.hosts:
+            print("📈 Per-host downloads:")
+            for line in scheduler.report():
+                print(line)
+    return results
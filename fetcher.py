@@ -0,0 +1,256 @@
+"""
+Shared PDF download engine for downloadloop.py and unpawall api.py.
+
+- Streams the body in fixed-size chunks to `<dest>.part`, then atomically
+  renames it into place, so a half-written file never looks finished.
+- Aborts as soon as the first bytes show the body is not a PDF (HTML landing
+  pages) or the size cap is exceeded.
+- Resumes a leftover `.part` file with an HTTP Range request, as long as the
+  206 reply's Content-Range starts where the part ends.
+- Hashes the content while streaming; with `store_dir` set, identical PDFs
+  reached through different DOIs/URLs are stored once and hard-linked.
+- Retries back off exponentially with jitter and honour Retry-After.
+- A fetch can be cancelled mid-stream (`cancel` event) and reports the
+  moment its body is confirmed to be a PDF (`on_pdf`), which
+  fetch_scheduler uses to hedge across an article's OA locations.
+
+For many PDFs across many hosts use fetch_scheduler.download_many, which
+adds per-host concurrency limits, circuit breaking and hedging on top of
+attempt_download.
+
+Usage:
+    result = download_pdf(url, "ref_pdfs/10.1000_xyz.pdf", store_dir="ref_pdfs/.by_hash")
+    if result.ok:
+        print(result.sha256, result.size)
+    else:
+        print(result.reason)
+"""
+
+import hashlib
+import os
+import random
+import re
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+}
+CHUNK_SIZE = 64 * 1024
+MAX_BYTES = 200 * 1024 * 1024   # refuse anything bigger than 200 MB
+SNIFF_BYTES = 1024              # PDF header must appear in the first KB
+RETRY_LIMIT = 2
+TIMEOUT = 20
+MAX_BACKOFF = 60                # longest single wait between attempts, seconds
+
+CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-")
+
+PERMANENT_REASONS = {"Not a PDF", "HTTP 404", "HTTP 410"}
+
+THROTTLE_REASONS = {"HTTP 429", "HTTP 503"}
+
+# retry_after: seconds the server asked us to wait (429/503), else None
+# url: the location that was downloaded (set by fetch_scheduler)
+DownloadResult = namedtuple("DownloadResult", "ok reason sha256 size path retry_after url",
+                            defaults=(None, None))
+
+_session = None
+
+
+def get_session():
+    """Process-wide keep-alive session."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update(HEADERS)
+    return _session
+
+
+def looks_like_pdf(head):
+    return b"%PDF" in head[:SNIFF_BYTES]
+
+
+def host_of(url):
+    return urlsplit(url).hostname or "unknown"
+
+
+def is_permanent(reason):
+    """Failures a retry won't change."""
+    return reason in PERMANENT_REASONS or reason.startswith("Too large")
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (delay in seconds or an HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=2, cap=MAX_BACKOFF):
+    """Exponential backoff with jitter for the retry after attempt number `attempt` (0-based)."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _hash_file(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest
+
+
+def _link_or_copy(src, dest):
+    tmp = dest + ".link"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def store_pdf(part, dest, sha256, store_dir):
+    """Move a completed download into place, deduplicating by content hash."""
+    if not store_dir:
+        os.replace(part, dest)
+        return
+    os.makedirs(store_dir, exist_ok=True)
+    blob = os.path.join(store_dir, sha256 + ".pdf")
+    if os.path.exists(blob):
+        os.remove(part)
+    else:
+        os.replace(part, blob)
+    _link_or_copy(blob, dest)
+
+
+def fetch_once(url, dest, session=None, timeout=TIMEOUT, max_bytes=MAX_BYTES,
+               chunk_size=CHUNK_SIZE, store_dir=None, cancel=None, on_pdf=None):
+    """Single streaming attempt; resumes `<dest>.part` if one is left over.
+
+    `cancel` (a threading.Event) stops the transfer between chunks, keeping
+    the part for a later resume; `on_pdf()` is called once the first bytes
+    are confirmed to be a PDF.
+    """
+    session = session or get_session()
+    part = dest + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with session.get(url, stream=True, timeout=timeout, headers=headers) as r:
+        if r.status_code == 416 and offset:
+            os.remove(part)  # stale part larger than the file; start over next time
+            return DownloadResult(False, "Range not satisfiable", None, 0, None)
+        if r.status_code not in (200, 206):
+            return DownloadResult(False, f"HTTP {r.status_code}", None, 0, None,
+                                  retry_after_seconds(r.headers.get("Retry-After")))
+
+        resuming = offset and r.status_code == 206
+        if resuming:
+            match = CONTENT_RANGE_RE.match(r.headers.get("Content-Range", ""))
+            if not match or int(match.group(1)) != offset:
+                os.remove(part)  # server ignored or shifted the range; start over next time
+                return DownloadResult(False, "Range mismatch", None, 0, None)
+        if resuming:
+            digest = _hash_file(part, chunk_size)
+            with open(part, "rb") as f:
+                head = f.read(SNIFF_BYTES)
+            if on_pdf is not None and looks_like_pdf(head):
+                on_pdf()
+        else:
+            offset = 0
+            digest = hashlib.sha256()
+            head = b""
+
+        length = r.headers.get("Content-Length")
+        if length and length.isdigit() and offset + int(length) > max_bytes:
+            return DownloadResult(False, f"Too large: {offset + int(length)} bytes", None, 0, None)
+
+        size = offset
+        with open(part, "ab" if resuming else "wb") as f:
+            for block in r.iter_content(chunk_size=chunk_size):
+                if cancel is not None and cancel.is_set():
+                    return DownloadResult(False, "Cancelled", None, 0, None)
+                if not block:
+                    continue
+                if len(head) < SNIFF_BYTES:
+                    head += block[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        if not looks_like_pdf(head):
+                            break
+                        if on_pdf is not None:
+                            on_pdf()
+                size += len(block)
+                if size > max_bytes:
+                    break
+                digest.update(block)
+                f.write(block)
+
+    if not looks_like_pdf(head):
+        os.remove(part)
+        return DownloadResult(False, "Not a PDF", None, 0, None)
+    if size > max_bytes:
+        os.remove(part)
+        return DownloadResult(False, f"Too large: over {max_bytes} bytes", None, 0, None)
+
+    sha256 = digest.hexdigest()
+    store_pdf(part, dest, sha256, store_dir)
+    return DownloadResult(True, None, sha256, size, dest)
+
+
+def attempt_download(url, dest, host=None, **kwargs):
+    """One fetch_once attempt with metrics; network errors come back as a failed result."""
+    host = host or host_of(url)
+    start = time.perf_counter()
+    try:
+        result = fetch_once(url, dest, **kwargs)
+    except requests.RequestException as e:
+        metrics.inc("download_attempts_total", host=host, result="exception")
+        return DownloadResult(False, f"Download exception: {e}", None, 0, None)
+    metrics.observe("download_seconds", time.perf_counter() - start, host=host)
+    metrics.inc("download_attempts_total", host=host,
+                result="ok" if result.ok else result.reason.split(":")[0])
+    if result.ok:
+        metrics.inc("download_bytes_total", result.size, host=host)
+    return result
+
+
+def download_pdf(url, dest, retries=RETRY_LIMIT, backoff=2, **kwargs):
+    """Download `url` to `dest`, retrying (and resuming) on network errors and throttling."""
+    reason = None
+    host = host_of(url)
+    for attempt in range(retries):
+        result = attempt_download(url, dest, host, **kwargs)
+        if result.ok:
+            return result
+        reason = result.reason
+        print(f"⚠️ Attempt {attempt+1} failed: {reason}")
+        if is_permanent(reason):
+            return result  # retrying won't change the answer
+        if attempt + 1 == retries:
+            break
+        delay = backoff_delay(attempt, backoff)
+        if result.retry_after is not None:
+            if result.retry_after > MAX_BACKOFF:
+                return result  # asked to come back much later; leave it to a --resume run
+            delay = max(delay, result.retry_after)
+        time.sleep(delay)
+    return DownloadResult(False, f"Download failed after {attempt+1} attempts: {reason}", None, 0, None)
@@ -0,0 +1,212 @@
+"""
+Streaming JSONL helpers shared by the dataset scripts.
+
+- open_text: open plain, gzip (.gz) or zstd (.zst/.zstd) files by extension.
+- iter_jsonl: yield records one line at a time.
+- iter_records: like iter_jsonl, but also streams files holding one JSON
+  array (e.g. older ref_training_data.json exports) without loading it whole;
+  read_records does the same for an open stream.
+- JSONLWriter: write records incrementally, optionally rolling over to a new
+  shard every `shard_size` records (out-00000.jsonl.gz, out-00001.jsonl.gz...).
+- record_writer: JSONLWriter, or a corpus_store.CorpusWriter for ".corpus"
+  output paths; iter_records reads ".corpus" stores the same way.
+
+Usage:
+    with JSONLWriter("chunks.jsonl.gz", shard_size=100_000) as out:
+        for record in iter_jsonl("uoa4_full_trainset.jsonl.zst"):
+            out.write(record)
+"""
+
+import gzip
+import io
+import json
+import os
+
+COMPRESSED_SUFFIXES = (".gz", ".zst", ".zstd")
+
+
+def split_suffix(path):
+    """Split "a/b.jsonl.gz" into ("a/b", ".jsonl.gz")."""
+    base = path
+    compression = ""
+    for suffix in COMPRESSED_SUFFIXES:
+        if base.endswith(suffix):
+            base, compression = base[:-len(suffix)], suffix
+            break
+    base, ext = os.path.splitext(base)
+    return base, ext + compression
+
+
+def open_text(path, mode="r"):
+    """Open a text file, transparently (de)compressing .gz and .zst/.zstd."""
+    assert mode in ("r", "w", "a")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith((".zst", ".zstd")):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading/writing .zst files needs `pip install zstandard`")
+        if mode == "r":
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        else:
+            raw = zstandard.ZstdCompressor(level=3).stream_writer(open(path, mode + "b"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def iter_jsonl(path):
+    """Yield one parsed record per non-blank line."""
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_json_array(f, chunk_size=1 << 20):
+    """Yield the elements of a top-level JSON array from a text file object."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # skip whitespace and separators
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+        if pos >= len(buf):
+            if started:
+                raise ValueError("Unexpected end of JSON array")
+            return
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    break  # a value ending at the buffer edge (e.g. 12|3) may be cut short
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more = f.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+        yield item
+        pos = end
+
+
+def iter_records(path):
+    """Yield records from JSONL or a JSON array file (optionally compressed).
+
+    A ".corpus" directory is read through corpus_store instead.
+    """
+    if os.path.isdir(path) or path.rstrip("/\\").endswith(".corpus"):
+        from corpus_store import iter_corpus
+        yield from iter_corpus(path)
+        return
+    with open_text(path) as f:
+        yield from read_records(f)
+
+
+def read_records(f):
+    """Like iter_records, for an already open text stream (e.g. a zip member)."""
+    first = ""
+    while True:
+        ch = f.read(1)
+        if not ch or not ch.isspace():
+            first = ch
+            break
+    if first == "[":
+        yield from iter_json_array(_Prepend(first, f))
+        return
+    pending = first
+    for line in f:
+        line = pending + line
+        pending = ""
+        if line.strip():
+            yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+
+class _Prepend:
+    """File-like wrapper that replays already-consumed text before the rest."""
+
+    def __init__(self, head, f):
+        self.head = head
+        self.f = f
+
+    def read(self, size=-1):
+        if self.head:
+            head, self.head = self.head, ""
+            return head + self.f.read(size - len(head) if size > 0 else size)
+        return self.f.read(size)
+
+
+class JSONLWriter:
+    """Incremental JSONL writer with optional fixed-size output shards."""
+
+    def __init__(self, path, shard_size=None, ensure_ascii=True):
+        self.path = path
+        self.shard_size = shard_size
+        self.ensure_ascii = ensure_ascii
+        self.base, self.suffix = split_suffix(path)
+        self.count = 0
+        self.shard_count = 0
+        self.paths = []
+        self.file = None
+
+    def _next_shard(self):
+        if self.file is not None:
+            self.file.close()
+        if self.shard_size:
+            path = f"{self.base}-{len(self.paths):05d}{self.suffix}"
+        else:
+            path = self.path
+        self.paths.append(path)
+        self.file = open_text(path, "w")
+        self.shard_count = 0
+
+    def write(self, record):
+        if self.file is None or (self.shard_size and self.shard_count >= self.shard_size):
+            self._next_shard()
+        self.file.write(json.dumps(record, ensure_ascii=self.ensure_ascii) + "\n")
+        self.count += 1
+        self.shard_count += 1
+
+    def close(self):
+        if self.file is None and not self.paths:
+            self._next_shard()  # still leave an (empty) output behind
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_writer(path, shard_size=None, ensure_ascii=True, stage=None, source=None):
+    """Writer for `path`: a Parquet corpus store for ".corpus", else JSONL.
+
+    `stage` and `source` are stored as columns by the corpus store and
+    ignored for JSONL.
+    """
+    if path.rstrip("/\\").endswith(".corpus"):
+        from corpus_store import SHARD_SIZE, CorpusWriter
+        return CorpusWriter(path, stage=stage, source=source, shard_size=shard_size or SHARD_SIZE)
+    return JSONLWriter(path, shard_size=shard_size, ensure_ascii=ensure_ascii)
@@ -0,0 +1,173 @@
+"""
+Append-only, crash-safe job ledger for the download/extract scripts.
+
+Every state change for a DOI is appended as one JSON line and fsynced, so a
+crash or Ctrl-C never loses more than the line being written. Replaying the
+file gives the latest state per (DOI, stage), which drives --resume.
+
+Stages: resolved, downloaded, extracted, cleaned (pipeline.py only)
+States: done, failed
+
+Usage:
+    ledger = Ledger("uoa4_ledger.jsonl")
+    if resume and ledger.should_skip(doi, "extracted"):
+        continue
+    ledger.record(doi, "resolved", "done")
+    ledger.record(doi, "downloaded", "failed", reason="Download failed after 2 attempts")
+
+    python ledger.py uoa4_ledger.jsonl          # status summary
+"""
+
+import json
+import os
+import time
+from collections import Counter
+
+STAGES = ("resolved", "downloaded", "extracted", "cleaned")
+MAX_ATTEMPTS = 3
+
+# Failures that will not change on a retry
+PERMANENT_REASONS = (
+    "No OA PDF",
+    "Unpaywall error 404",
+    "Empty text",
+    "Too short after cleaning",
+    "Unknown label",
+    "Not a PDF",
+    "Too large",
+    "HTTP 404",
+    "HTTP 410",
+)
+
+
+def is_retryable(reason):
+    reason = reason or ""
+    return not any(reason.startswith(p) for p in PERMANENT_REASONS)
+
+
+class Ledger:
+    """Per-DOI, per-stage state backed by an append-only JSONL file."""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.latest = {}        # (doi, stage) -> last entry
+        self.attempts = Counter()
+        self.file = None
+        self.torn_tail = False
+        self._replay()
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.torn_tail = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash
+                self._apply(entry)
+
+    def _apply(self, entry):
+        key = (entry["doi"], entry["stage"])
+        self.latest[key] = entry
+        if entry["state"] == "failed":
+            self.attempts[key] += 1
+
+    def record(self, doi, stage, state, reason="", **extra):
+        key = (doi, stage)
+        entry = {
+            "doi": doi,
+            "stage": stage,
+            "state": state,
+            "reason": reason or "",
+            "attempt": self.attempts[key] + 1,
+            "ts": time.time(),
+        }
+        entry.update(extra)
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+            if self.torn_tail:
+                self.file.write("\n")  # don't glue onto a half-written line
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self._apply(entry)
+        return entry
+
+    def get(self, doi, stage):
+        return self.latest.get((doi, stage))
+
+    def is_done(self, doi, stage):
+        entry = self.get(doi, stage)
+        return bool(entry) and entry["state"] == "done"
+
+    def should_skip(self, doi, final_stage, max_attempts=MAX_ATTEMPTS):
+        """True if the DOI finished `final_stage` or failed in a way a retry won't fix."""
+        if self.is_done(doi, final_stage):
+            return True
+        for stage in STAGES:
+            entry = self.get(doi, stage)
+            if entry and entry["state"] == "failed":
+                if not is_retryable(entry["reason"]):
+                    return True
+                if self.attempts[(doi, stage)] >= max_attempts:
+                    return True
+        return False
+
+    def last_failure(self, doi):
+        """Most recent failed entry for the DOI across all stages, if any."""
+        failed = [e for e in (self.get(doi, stage) for stage in STAGES)
+                  if e and e["state"] == "failed"]
+        return max(failed, key=lambda e: e["ts"]) if failed else None
+
+    def summary(self):
+        """Counter of (stage, state) over the latest entry per DOI and stage."""
+        return Counter((stage, entry["state"]) for (_, stage), entry in self.latest.items())
+
+    def failure_reasons(self):
+        return Counter(
+            entry["reason"] for entry in self.latest.values() if entry["state"] == "failed"
+        )
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def print_summary(ledger, top=10):
+    dois = {doi for doi, _ in ledger.latest}
+    summary = ledger.summary()
+    print(f"📒 Ledger: {ledger.path} ({len(dois)} DOIs)")
+    for stage in STAGES:
+        done = summary[(stage, "done")]
+        failed = summary[(stage, "failed")]
+        if done or failed:
+            print(f" - {stage:<10} ✅ {done:>6}   ❌ {failed:>6}")
+    reasons = ledger.failure_reasons()
+    if reasons:
+        print("\n❌ Top failure reasons:")
+        for reason, count in reasons.most_common(top):
+            tag = "retryable" if is_retryable(reason) else "permanent"
+            print(f" - {count:>6}  {reason} ({tag})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show a status summary of a job ledger")
+    parser.add_argument("path")
+    parser.add_argument("--top", type=int, default=10, help="Number of failure reasons to show")
+    args = parser.parse_args()
+
+    with Ledger(args.path) as ledger:
+        print_summary(ledger, args.top)
@@ -0,0 +1,256 @@
+"""
+Length-bucketed batches for chunked training data.
+
+chunker2.py emits chunks in document order: mostly full chunk_size windows
+plus short tails and short documents. A trainer that pads every batch to
+chunk_size, or to the longest chunk of a batch in input order, spends much of
+its compute on padding. Given each chunk's token length this module:
+
+- splits chunks into at most `buckets` length ranges, choosing the
+  boundaries that minimize padding (a small DP over the length histogram, so
+  the run of full chunk_size windows gets a bucket of its own);
+- shuffles each bucket (so labels stay mixed), cuts it into batches and
+  shuffles the batch order, all from one seed;
+- writes the batches as a JSON batch index of chunk positions (the order of
+  the chunked output and of token_store.py), and optionally one shard per
+  bucket in its shuffled order, so a loader can read a shard sequentially;
+- reports the padding ratio (padding tokens / padded tokens) when padding to
+  chunk_size, per batch in input order, and per batch after bucketing.
+
+Lengths come from a token store or from the "num_tokens" field chunker2.py
+writes when `length_buckets` is set.
+
+Usage:
+    python length_buckets.py uoa4_full_trainset_chunked.jsonl --buckets 8 --batch-size 4
+    python length_buckets.py uoa4_full_trainset_tokens --index uoa4_batches.json   # a token store
+    python length_buckets.py chunked.jsonl --shards chunked_buckets.jsonl           # chunked_buckets-b0.jsonl, ...
+"""
+
+import bisect
+import json
+import os
+import random
+from collections import Counter
+
+from jsonl_io import JSONLWriter, iter_jsonl, iter_records, split_suffix
+
+BUCKETS = 8
+BATCH_SIZE = 4
+CHUNK_SIZE = 4096
+SEED = 0
+MAX_BINS = 256   # histogram bins the boundary search works on
+
+
+def bin_step(lengths, max_bins=MAX_BINS):
+    """Histogram bin width: at most max_bins bins up to the longest chunk, and never 0."""
+    return max(1, -(-max(lengths) // max_bins))
+
+
+def bucket_bounds(lengths, buckets=BUCKETS, max_bins=MAX_BINS):
+    """Upper length of each bucket, chosen to minimize the padding to each bucket's longest chunk."""
+    if not lengths:
+        return []
+    step = bin_step(lengths, max_bins)
+    histogram = Counter(-(-length // step) * step for length in lengths)
+    values = sorted(histogram)
+    counts = [0]
+    totals = [0]
+    for value in values:
+        counts.append(counts[-1] + histogram[value])
+        totals.append(totals[-1] + histogram[value] * value)
+
+    def cost(i, j):   # padding when bins i..j share one bucket padded to values[j]
+        return (counts[j + 1] - counts[i]) * values[j] - (totals[j + 1] - totals[i])
+
+    n = len(values)
+    buckets = max(1, min(buckets, n))
+    best = [cost(0, j) for j in range(n)]
+    cuts = []   # per extra bucket: first bin of the last bucket, or -1 if it didn't help
+    for _ in range(1, buckets):
+        row, cut = list(best), [-1] * n
+        for j in range(n):
+            for i in range(1, j + 1):
+                candidate = best[i - 1] + cost(i, j)
+                if candidate < row[j]:
+                    row[j], cut[j] = candidate, i
+        best = row
+        cuts.append(cut)
+    bounds = []
+    j = n - 1
+    for cut in reversed(cuts):
+        if cut[j] != -1:
+            bounds.append(values[j])
+            j = cut[j] - 1
+    bounds.append(values[j])
+    return sorted(bounds)
+
+
+def length_buckets(lengths, buckets=BUCKETS, seed=SEED):
+    """Chunk positions grouped by bucket_bounds, shortest bucket first, in random order."""
+    order = list(range(len(lengths)))
+    random.Random(seed).shuffle(order)
+    bounds = bucket_bounds(lengths, buckets)
+    if not bounds:
+        return []
+    step = bin_step(lengths)
+    groups = [[] for _ in bounds]
+    for position in order:
+        groups[bisect.bisect_left(bounds, -(-lengths[position] // step) * step)].append(position)
+    return [group for group in groups if group]
+
+
+def bucketed_batches(lengths, buckets=BUCKETS, batch_size=BATCH_SIZE, seed=SEED):
+    """Return (groups, batches): each group shuffled, batches cut within groups, batch order shuffled."""
+    rng = random.Random(seed)
+    groups = length_buckets(lengths, buckets, seed)
+    batches = []
+    for group in groups:
+        rng.shuffle(group)
+        batches.extend(group[i:i + batch_size] for i in range(0, len(group), batch_size))
+    rng.shuffle(batches)
+    return groups, batches
+
+
+def sequential_batches(count, batch_size=BATCH_SIZE):
+    return [list(range(i, min(i + batch_size, count))) for i in range(0, count, batch_size)]
+
+
+def padding_ratio(lengths, batches, pad_to=None):
+    """Share of padding when each batch is padded to pad_to, or to its longest chunk."""
+    real = padded = 0
+    for batch in batches:
+        sizes = [lengths[i] for i in batch]
+        real += sum(sizes)
+        padded += (pad_to or max(sizes)) * len(sizes)
+    return 1 - real / padded if padded else 0.0
+
+
+def padding_report(lengths, batches, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    before = sequential_batches(len(lengths), batch_size)
+    return {
+        "pad_to_chunk_size": round(padding_ratio(lengths, before, chunk_size), 4),
+        "input_order": round(padding_ratio(lengths, before), 4),
+        "bucketed": round(padding_ratio(lengths, batches), 4),
+    }
+
+
+def bucket_summary(groups, lengths, labels):
+    return [{"min_tokens": min(lengths[i] for i in group), "max_tokens": max(lengths[i] for i in group),
+             "chunks": len(group), "labels": dict(Counter(labels[i] for i in group))}
+            for group in groups]
+
+
+def build_index(lengths, labels, buckets=BUCKETS, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, seed=SEED):
+    """Batch index (JSON-ready) plus the groups it was cut from."""
+    groups, batches = bucketed_batches(lengths, buckets, batch_size, seed)
+    index = {
+        "num_chunks": len(lengths),
+        "batch_size": batch_size,
+        "chunk_size": chunk_size,
+        "seed": seed,
+        "padding": padding_report(lengths, batches, batch_size, chunk_size),
+        "buckets": bucket_summary(groups, lengths, labels),
+        "batches": batches,
+        "pad_to": [max(lengths[i] for i in batch) for batch in batches],
+    }
+    return index, groups
+
+
+def write_index(path, index):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+
+
+def report(index):
+    padding = index["padding"]
+    lines = [f"📏 Padding over {index['num_chunks']} chunks, batch size {index['batch_size']}:",
+             f" - pad to {index['chunk_size']:<6}          {padding['pad_to_chunk_size']:6.1%}",
+             f" - per batch, input order  {padding['input_order']:6.1%}",
+             f" - per batch, bucketed     {padding['bucketed']:6.1%}"]
+    for k, bucket in enumerate(index["buckets"]):
+        labels = ", ".join(f"{label}: {n}" for label, n in sorted(bucket["labels"].items()))
+        lines.append(f" - bucket {k}: {bucket['min_tokens']}-{bucket['max_tokens']} tokens, "
+                     f"{bucket['chunks']} chunks ({labels})")
+    return "\n".join(lines)
+
+
+def is_token_store(path):
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+def read_lengths(path):
+    """(lengths, labels, chunk_size or None) from a token store or chunked records."""
+    if is_token_store(path):
+        from token_store import TokenStore
+
+        store = TokenStore(path)
+        try:
+            lengths = [store.length(i) for i in range(len(store))]
+            labels = [store.label_name(store.label_ids[i]) for i in range(len(store))]
+            return lengths, labels, store.meta.get("chunk_size")
+        finally:
+            store.close()
+    lengths, labels = [], []
+    for record in iter_records(path):
+        if "num_tokens" not in record:
+            raise ValueError(f"{path}: chunks have no num_tokens; set length_buckets in chunker2.py "
+                             "or pass a token store")
+        lengths.append(record["num_tokens"])
+        labels.append(str(record.get("label")))
+    return lengths, labels, None
+
+
+def write_bucket_shards(input_path, groups, out_path):
+    """One file per bucket (<stem>-b0<ext>, ...) holding its chunks in the bucket's shuffled order.
+
+    Records are first split by bucket in input order, then each shard is
+    reordered on its own, so only one bucket is held in memory at a time.
+    """
+    base, suffix = split_suffix(out_path)
+    paths = [f"{base}-b{k}{suffix}" for k in range(len(groups))]
+    bucket_of = {}
+    for k, group in enumerate(groups):
+        for position in group:
+            bucket_of[position] = k
+    writers = [JSONLWriter(path) for path in paths]
+    try:
+        for position, record in enumerate(iter_records(input_path)):
+            writers[bucket_of[position]].write(record)
+    finally:
+        for writer in writers:
+            writer.close()
+    for path, group in zip(paths, groups):
+        records = dict(zip(sorted(group), list(iter_jsonl(path))))
+        with JSONLWriter(path) as out:
+            for position in group:
+                out.write(records.pop(position))
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Length-bucketed batch index / shards for chunked data")
+    parser.add_argument("input", help="Chunked records with num_tokens, or a token store directory")
+    parser.add_argument("--buckets", type=int, default=BUCKETS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Training batch size")
+    parser.add_argument("--chunk-size", type=int, default=None, help=f"Padded length (default: store's or {CHUNK_SIZE})")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--index", default=None, help="Write the batch index here (JSON)")
+    parser.add_argument("--shards", default=None, help="Write one shard per bucket, e.g. chunked_buckets.jsonl")
+    args = parser.parse_args()
+
+    lengths, labels, stored_chunk_size = read_lengths(args.input)
+    chunk_size = args.chunk_size or stored_chunk_size or CHUNK_SIZE
+    index, groups = build_index(lengths, labels, args.buckets, args.batch_size, chunk_size, args.seed)
+    print(report(index))
+    if args.index:
+        write_index(args.index, index)
+        print(f"💾 Batch index ({len(index['batches'])} batches) saved to {args.index}")
+    if args.shards:
+        if is_token_store(args.input):
+            parser.error("--shards needs chunked records, not a token store")
+        paths = write_bucket_shards(args.input, groups, args.shards)
+        print(f"✅ Saved {len(paths)} bucket shards to {', '.join(paths)}")
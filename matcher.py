@@ -1,10 +1,12 @@
 import os
 import pandas as pd
 
+from doi_utils import DOIMatcher
+
 # Load DOI list
 df = pd.read_csv("newdoi.csv")  # or read_excel if xlsx
 doi_list = df['DOI'].dropna().unique()
-normalized_dois = {doi.replace("/", "_").lower(): doi for doi in doi_list}
+doi_matcher = DOIMatcher(doi_list)
 
 pdf_folder = "newref_pdfs"
 matches = []
@@ -12,14 +14,10 @@ unmatched = []
 
 for filename in os.listdir(pdf_folder):
     if filename.lower().endswith(".pdf"):
-        file_key = filename.replace(".pdf", "").lower()
-        matched = False
-        for doi_key, original_doi in normalized_dois.items():
-            if doi_key in file_key:
-                matches.append({"filename": filename, "matched_doi": original_doi})
-                matched = True
-                break
-        if not matched:
+        matched_doi = doi_matcher.match(filename)
+        if matched_doi:
+            matches.append({"filename": filename, "matched_doi": matched_doi})
+        else:
             unmatched.append(filename)
 
 # Save matched
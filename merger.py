@@ -1,32 +1,92 @@
-import json
+import argparse
+import hashlib
+from collections import Counter
+
+import metrics
+from jsonl_io import JSONLWriter, iter_records, record_writer
 
 # === File paths ===
 old_file = "ref_training_data.json"   # json 1
 new_file = "newdata.json"             # json 2
-combined_file = "combined_training_data.json"  # Output merged dataset
+combined_file = "combined_training_data.jsonl"  # Output merged dataset (JSON Lines)
+
+# === Dedupe keys ===
+# 16-byte blake2b digests instead of full (text, label) tuples, so memory per
+# record is constant no matter how long the documents are.
+def normalize_text(text):
+    return " ".join(str(text).split())
+
+def digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.digest()
+
+def merge(inputs, output, conflicts_path=None):
+    """Stream every input once, write unique (text, label) records as JSONL."""
+    seen = set()          # digest(text, label)
+    text_labels = {}      # digest(text) -> (first label, source index)
+    stats = {path: Counter() for path in inputs}
+    conflicts = []
+
+    with record_writer(output, ensure_ascii=False, stage="merged") as out:
+        for index, path in enumerate(inputs):
+            source = stats[path]
+            for item in iter_records(path):
+                source["read"] += 1
+                text = normalize_text(item.get("text", ""))
+                label = str(item.get("label", ""))
+                text_key = digest(text)
+                key = digest(text, label)
+
+                if key in seen:
+                    source["duplicates"] += 1
+                    metrics.inc("merge_records_total", result="duplicate")
+                    continue
+                seen.add(key)
+
+                first = text_labels.setdefault(text_key, (label, index))
+                if first[0] != label:
+                    source["conflicts"] += 1
+                    metrics.inc("merge_label_conflicts_total")
+                    conflicts.append({"text_digest": text_key.hex(),
+                                      "labels": [first[0], label],
+                                      "sources": [inputs[first[1]], path]})
 
-# === Load both datasets ===
-with open(old_file, "r", encoding="utf-8") as f:
-    old_data = json.load(f)
+                out.write(item)
+                source["written"] += 1
+                metrics.inc("merge_records_total", result="written")
 
-with open(new_file, "r", encoding="utf-8") as f:
-    new_data = json.load(f)
+    if conflicts_path:
+        with JSONLWriter(conflicts_path) as f:
+            for conflict in conflicts:
+                f.write(conflict)
+    return stats, conflicts, out.count
 
-# === Combine datasets ===
-combined_data = old_data + new_data
+def main():
+    parser = argparse.ArgumentParser(description="Merge JSON/JSONL datasets with exact (text, label) dedupe")
+    parser.add_argument("inputs", nargs="*", default=[old_file, new_file],
+                        help="JSON array or JSONL files (.gz/.zst ok) or .corpus stores, earlier files win")
+    parser.add_argument("-o", "--output", default=combined_file)
+    parser.add_argument("--conflicts", default=None,
+                        help="Write same-text/different-label cases to this JSONL file")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args)
 
-# === Deduplicate based on 'text' and 'label' pairs ===
-seen = set()
-deduplicated = []
-for item in combined_data:
-    key = (item['text'], item['label'])
-    if key not in seen:
-        deduplicated.append(item)
-        seen.add(key)
+    stats, conflicts, total = merge(args.inputs, args.output, args.conflicts)
 
-# === Save merged dataset ===
-with open(combined_file, "w", encoding="utf-8") as f:
-    json.dump(deduplicated, f, ensure_ascii=False, indent=2)
+    print(f"✅ Combined and deduplicated dataset saved as: {args.output}")
+    print(f"📊 Total unique samples: {total}")
+    print("\n📂 Per-source contribution:")
+    for path, source in stats.items():
+        print(f" - {path}: read {source['read']}, added {source['written']}, "
+              f"duplicates {source['duplicates']}, label conflicts {source['conflicts']}")
+    if conflicts:
+        print(f"\n⚠️ {len(conflicts)} texts appear with different labels"
+              + (f" (see {args.conflicts})" if args.conflicts else " (use --conflicts to list them)"))
+    metrics.finish(args)
 
-print(f"✅ Combined and deduplicated dataset saved as: {combined_file}")
-print(f"📊 Total unique samples: {len(deduplicated)}")
+if __name__ == "__main__":
+    main()
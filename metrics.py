@@ -0,0 +1,322 @@
+"""
+Shared run metrics: counters, gauges, latency histograms and record spans.
+
+Stages call the module-level helpers:
+
+    metrics.inc("download_bytes_total", size, host=host)
+    metrics.observe("unpaywall_request_seconds", elapsed, status=200)
+    metrics.set_gauge("queue_depth", q.qsize(), stage="extract")
+    with metrics.span("download", doi):
+        ...
+
+Until enable() is called every helper returns immediately (span() hands back
+a shared no-op context), so instrumented code costs one flag check when
+metrics are off. Metrics live in the process that records them: pool workers
+don't report, so stages record in the parent when results come back.
+
+Output:
+- Prometheus text format, written to a file (node_exporter textfile style)
+  and/or served on http://127.0.0.1:<port>/metrics while the run is going;
+- a JSON run summary with per-second rates over the run, histogram
+  percentiles (the largest sample stands in past the top bucket), transfer
+  rates per host, and (with spans on) the slowest records per stage and
+  overall.
+
+Scripts get the flags with add_arguments(parser) and start(args) / finish(args).
+Scripts configured by constants instead of argparse (cleaner.py, chunker.py,
+...) pass options(json="run.json") to start() / finish().
+"""
+
+import contextlib
+import heapq
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SLOWEST = 20   # spans kept per stage in the summary
+
+# (rate name, counter, histogram whose _sum is the busy time), per label set
+RATES = (
+    ("download_bytes_per_second", "download_bytes_total", "download_seconds"),
+    ("extract_pages_per_second", "extract_pages_total", "extract_seconds"),
+)
+
+_enabled = False
+_spans_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_spans = {}
+_record_seconds = {}
+_started = time.time()
+_server = None
+_NULL = contextlib.nullcontext()
+
+
+def enable(spans=False):
+    """Start collecting (clears anything recorded before)."""
+    global _enabled, _spans_enabled, _started
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _spans.clear()
+        _record_seconds.clear()
+        _started = time.time()
+        _enabled = True
+        _spans_enabled = spans
+
+
+def disable():
+    global _enabled, _spans_enabled
+    _enabled = _spans_enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0, 0.0]
+        counts = hist[0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        hist[1] += seconds
+        hist[2] += 1
+        hist[3] = max(hist[3], seconds)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def timer(name, **labels):
+    """Context manager observing its duration into histogram `name`."""
+    return _Timer(name, labels) if _enabled else _NULL
+
+
+class _Span:
+    __slots__ = ("stage", "key", "start")
+
+    def __init__(self, stage, key):
+        self.stage = stage
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            heap = _spans.setdefault(self.stage, [])
+            item = (seconds, str(self.key))
+            if len(heap) < SLOWEST:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            _record_seconds[self.key] = _record_seconds.get(self.key, 0.0) + seconds
+
+
+def span(stage, key):
+    """Time one record (e.g. a DOI) through one stage; no-op unless spans are on."""
+    return _Span(stage, key) if _spans_enabled else _NULL
+
+
+# === Output ===
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+def prometheus_text():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for kind, table in (("counter", _counters), ("gauge", _gauges)):
+            for name in sorted({name for name, _ in table}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (n, labels), value in sorted(table.items()):
+                    if n == name:
+                        lines.append(f"{name}{_labels_text(labels)} {value}")
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), (counts, total, count, _) in sorted(_histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {total}")
+                lines.append(f"{name}_count{_labels_text(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics in a background thread for the rest of the run."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def _percentile(counts, count, q, largest):
+    """Upper bucket bound holding the q-th sample; the largest sample if it is past the top bucket."""
+    target = q * count
+    seen = 0
+    for bound, c in zip(BUCKETS, counts):
+        seen += c
+        if seen >= target:
+            return bound
+    return round(largest, 3)
+
+
+def summary():
+    """JSON-ready run summary."""
+    elapsed = time.time() - _started
+    with _lock:
+        counters = {}
+        for (name, labels), value in sorted(_counters.items()):
+            counters.setdefault(name, []).append(
+                {"labels": dict(labels), "value": value, "per_second": round(value / elapsed, 3)})
+        gauges = {}
+        for (name, labels), value in sorted(_gauges.items()):
+            gauges.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        histograms = {}
+        for (name, labels), (counts, total, count, largest) in sorted(_histograms.items()):
+            histograms.setdefault(name, []).append({
+                "labels": dict(labels), "count": count, "sum": round(total, 3),
+                "mean": round(total / count, 4) if count else 0, "max": round(largest, 3),
+                "p50": _percentile(counts, count, 0.5, largest),
+                "p95": _percentile(counts, count, 0.95, largest),
+                "p99": _percentile(counts, count, 0.99, largest),
+            })
+        rates = {}
+        for rate, counter, histogram in RATES:
+            for (name, labels), value in _counters.items():
+                hist = _histograms.get((histogram, labels))
+                if name == counter and hist and hist[1] > 0:
+                    rates.setdefault(rate, []).append({"labels": dict(labels), "value": round(value / hist[1], 2)})
+        result = {"elapsed_seconds": round(elapsed, 3), "counters": counters, "gauges": gauges,
+                  "histograms": histograms, "rates": rates}
+        if _spans_enabled:
+            result["slowest_spans"] = {
+                stage: [{"key": key, "seconds": round(s, 4)} for s, key in sorted(heap, reverse=True)]
+                for stage, heap in sorted(_spans.items())
+            }
+            slowest = heapq.nlargest(SLOWEST, _record_seconds.items(), key=lambda kv: kv[1])
+            result["slowest_records"] = [{"key": str(k), "seconds": round(s, 4)} for k, s in slowest]
+    return result
+
+
+def write_summary(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary(), f, indent=2)
+
+
+# === CLI glue ===
+
+def add_arguments(parser):
+    group = parser.add_argument_group("metrics")
+    group.add_argument("--metrics-prom", default=None, help="Write Prometheus text metrics to this file")
+    group.add_argument("--metrics-json", default=None, help="Write a JSON run summary to this file")
+    group.add_argument("--metrics-port", type=int, default=None, help="Serve /metrics on this port during the run")
+    group.add_argument("--trace-records", action="store_true", help="Time every record per stage (slowest DOIs)")
+
+
+def options(prom=None, json=None, port=None, trace_records=False):
+    """The add_arguments() flags as an object, for scripts without argparse."""
+    return SimpleNamespace(metrics_prom=prom, metrics_json=json, metrics_port=port,
+                           trace_records=trace_records)
+
+
+def start(args):
+    """Enable metrics if any metrics flag was given."""
+    if args.metrics_prom or args.metrics_json or args.metrics_port or args.trace_records:
+        enable(spans=args.trace_records)
+        if args.metrics_port:
+            serve(args.metrics_port)
+            print(f"📡 Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+
+def finish(args):
+    if not _enabled:
+        return
+    if args.metrics_prom:
+        write_prometheus(args.metrics_prom)
+        print(f"📈 Prometheus metrics saved to {args.metrics_prom}")
+    if args.metrics_json:
+        write_summary(args.metrics_json)
+        print(f"📈 Run summary saved to {args.metrics_json}")
+    if _server is not None:
+        _server.shutdown()
@@ -0,0 +1,360 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+merger.py only drops exact (text, label) repeats. This catches the same paper
+extracted twice with slightly different PyMuPDF output, preprint vs published
+versions, and overlapping chunks that would otherwise land in different splits.
+
+- Each document becomes a set of word 5-shingles, summarised by a 128-value
+  MinHash signature (computed on all cores).
+- Signatures are cut into 16 bands of 8 rows; documents sharing any band are
+  candidates, and candidates are kept only if their estimated Jaccard
+  similarity is >= THRESHOLD. Each document costs one indexed lookup, so a
+  scan is near-linear in the corpus size.
+- The index lives in SQLite, so a later batch can be checked against it
+  without rebuilding (`--index neardup.sqlite` again, `--check-only` to leave
+  it unchanged). Each document joins the cluster of its matches; when it
+  matches several clusters they are merged by relabelling them in SQL to the
+  lowest cluster id, stored in the index.
+- Documents are keyed by "path:line". Rescanning a file skips keys already
+  indexed with the same signature and replaces those whose text changed, so
+  a document never matches its own earlier copy.
+
+Usage:
+    python neardup.py uoa4_full_trainset.jsonl --index neardup.sqlite --clusters clusters.jsonl
+    python neardup.py new_batch.jsonl --index neardup.sqlite --check-only
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import zlib
+from collections import Counter, deque
+
+import numpy as np
+
+from jsonl_io import JSONLWriter, iter_records
+from parallel import batched, imap_bounded
+
+INDEX_PATH = "neardup.sqlite"
+NUM_PERM = 128
+BANDS = 16            # 16 bands x 8 rows: pairs at 0.8 Jaccard collide ~95% of the time
+SHINGLE_SIZE = 5      # words per shingle
+THRESHOLD = 0.8       # minimum estimated Jaccard similarity
+SEED = 1
+BATCH_SIZE = 256
+COMMIT_EVERY = 10000  # docs between index commits during a scan
+WORKERS = os.cpu_count() or 1
+BLOCK = 4096          # shingles hashed per numpy block, bounds memory on huge docs
+
+PRIME = np.uint64(4294967291)  # largest prime below 2**32
+WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """Distinct 32-bit hashes of the lowercase word shingles in text."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = (" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+    return np.fromiter({zlib.crc32(s.encode("utf-8")) for s in shingles}, dtype=np.uint64)
+
+
+class MinHasher:
+    """MinHash signatures from (a * x + b) mod PRIME permutations."""
+
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def config(self):
+        return (self.num_perm, self.shingle_size, self.seed)
+
+    def signature(self, text):
+        """uint32 signature bytes, or None for a text with no words."""
+        if not isinstance(text, str):
+            return None
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return None
+        signature = np.full(self.num_perm, PRIME, dtype=np.uint64)
+        for start in range(0, len(hashes), BLOCK):
+            block = hashes[start:start + BLOCK, None]
+            np.minimum(signature, ((block * self.a + self.b) % PRIME).min(axis=0), out=signature)
+        return signature.astype("<u4").tobytes()
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures (fraction of equal values)."""
+    a = np.frombuffer(sig_a, dtype="<u4")
+    b = np.frombuffer(sig_b, dtype="<u4")
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class NearDupIndex:
+    """Persistent LSH index: documents, band keys and duplicate clusters."""
+
+    def __init__(self, path=INDEX_PATH, num_perm=NUM_PERM, bands=BANDS,
+                 shingle_size=SHINGLE_SIZE, seed=SEED, threshold=THRESHOLD):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.params = {"num_perm": num_perm, "bands": bands,
+                       "shingle_size": shingle_size, "seed": seed}
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                doi TEXT,
+                label TEXT,
+                cluster INTEGER NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (hash INTEGER NOT NULL, doc_id INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS bands_hash ON bands (hash);
+            CREATE INDEX IF NOT EXISTS docs_cluster ON docs (cluster);"""
+        )
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'docs_key'").fetchone() is None:
+            # Indexes from before keys were unique: keep the first copy of each key
+            stale = "SELECT id FROM docs WHERE id NOT IN (SELECT MIN(id) FROM docs GROUP BY key)"
+            self.conn.execute(f"DELETE FROM bands WHERE doc_id IN ({stale})")
+            self.conn.execute(f"DELETE FROM docs WHERE id IN ({stale})")
+            self.conn.execute("CREATE UNIQUE INDEX docs_key ON docs (key)")
+            self.conn.commit()
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO meta VALUES ('params', ?)", (json.dumps(self.params),))
+            self.conn.commit()
+        elif json.loads(row[0]) != self.params:
+            raise ValueError(f"{path} was built with {row[0]}, not {json.dumps(self.params)}; "
+                             "pass matching options or start a new index")
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def band_hashes(self, signature):
+        width = self.rows * 4
+        hashes = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(signature[band * width:(band + 1) * width],
+                                     digest_size=8, salt=band.to_bytes(16, "little")).digest()
+            hashes.append(int.from_bytes(digest, "little", signed=True))
+        return hashes
+
+    def query(self, signature, hashes=None):
+        """[(doc_id, similarity)] for indexed documents at or above the threshold."""
+        hashes = hashes or self.band_hashes(signature)
+        rows = self.conn.execute(
+            f"SELECT id, signature FROM docs WHERE id IN "
+            f"(SELECT doc_id FROM bands WHERE hash IN ({','.join('?' * len(hashes))}))",
+            hashes,
+        ).fetchall()
+        matches = []
+        for doc_id, other in rows:
+            score = similarity(signature, other)
+            if score >= self.threshold:
+                matches.append((doc_id, score))
+        return matches
+
+    def remove(self, doc_id, signature):
+        """Drop a document and its band rows (found through the band index)."""
+        hashes = self.band_hashes(signature)
+        self.conn.execute(f"DELETE FROM bands WHERE doc_id = ? AND hash IN ({','.join('?' * len(hashes))})",
+                          [doc_id, *hashes])
+        self.conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+
+    def add(self, key, signature, doi=None, label=None):
+        """Index a document; returns (doc_id, matches against other documents, whether it was added).
+
+        A key already indexed with this signature is left as is; with a
+        different signature it is replaced.
+        """
+        hashes = self.band_hashes(signature)
+        row = self.conn.execute("SELECT id, signature FROM docs WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            if row[1] == signature:
+                return row[0], [m for m in self.query(signature, hashes) if m[0] != row[0]], False
+            self.remove(*row)
+        matches = self.query(signature, hashes)
+        cur = self.conn.execute(
+            "INSERT INTO docs (key, doi, label, cluster, signature) VALUES (?, ?, ?, -1, ?)",
+            (key, doi, label, signature),
+        )
+        doc_id = cur.lastrowid
+        cluster = doc_id
+        if matches:
+            clusters = {c for (c,) in self.conn.execute(
+                f"SELECT DISTINCT cluster FROM docs WHERE id IN ({','.join('?' * len(matches))})",
+                [m[0] for m in matches],
+            )}
+            cluster = min(clusters)
+            self.conn.execute(
+                f"UPDATE docs SET cluster = ? WHERE cluster IN ({','.join('?' * len(clusters))})",
+                [cluster, *clusters],
+            )
+        self.conn.execute("UPDATE docs SET cluster = ? WHERE id = ?", (cluster, doc_id))
+        self.conn.executemany("INSERT INTO bands VALUES (?, ?)", [(h, doc_id) for h in hashes])
+        return doc_id, matches, True
+
+    def clusters(self, doc_ids=None):
+        """Yield lists of {"key", "doi", "label"} for every cluster with 2+ members.
+
+        With doc_ids, only clusters containing one of those documents.
+        """
+        if doc_ids is None:
+            ids = [c for (c,) in self.conn.execute(
+                "SELECT cluster FROM docs GROUP BY cluster HAVING COUNT(*) > 1")]
+        else:
+            ids = set()
+            for batch in batched(doc_ids, 500):
+                ids.update(c for (c,) in self.conn.execute(
+                    f"SELECT DISTINCT cluster FROM docs WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ))
+        for cluster in sorted(ids):
+            members = self.conn.execute(
+                "SELECT key, doi, label FROM docs WHERE cluster = ? ORDER BY id", (cluster,)
+            ).fetchall()
+            if len(members) > 1:
+                yield [{"key": key, "doi": doi, "label": label} for key, doi, label in members]
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+_worker_hasher = None
+
+
+def _init_worker(config):
+    global _worker_hasher
+    _worker_hasher = MinHasher(*config)
+
+
+def _sign_batch(texts):
+    return [_worker_hasher.signature(text) for text in texts]
+
+
+def sign_records(records, hasher, workers=WORKERS, batch_size=BATCH_SIZE):
+    """Yield (record, signature) in input order; signature is None for empty texts."""
+    if workers <= 1:
+        for record in records:
+            yield record, hasher.signature(record.get("text"))
+        return
+
+    import multiprocessing as mp
+
+    pending = deque()
+
+    def texts():
+        for batch in batched(records, batch_size):
+            pending.append(batch)
+            yield [record.get("text") for record in batch]
+
+    with mp.get_context("spawn").Pool(workers, initializer=_init_worker,
+                                      initargs=(hasher.config(),)) as pool:
+        for signatures in imap_bounded(pool, _sign_batch, texts(), 2 * workers):
+            yield from zip(pending.popleft(), signatures)
+
+
+def keyed_records(paths):
+    """Records from each input with a stable "path:line" key."""
+    for path in paths:
+        for i, record in enumerate(iter_records(path)):
+            record["_key"] = f"{path}:{i}"
+            yield record
+
+
+def scan(paths, index, hasher, workers=WORKERS, batch_size=BATCH_SIZE, commit=True):
+    """Add every record to the index; returns (stats, ids of the scanned documents).
+
+    With commit=False nothing is committed, so the caller can roll the whole
+    scan back (--check-only).
+    """
+    stats = Counter()
+    doc_ids = []
+    for record, signature in sign_records(keyed_records(paths), hasher, workers, batch_size):
+        stats["docs"] += 1
+        if signature is None:
+            stats["empty"] += 1
+            continue
+        label = record.get("label")
+        doc_id, matches, added = index.add(record["_key"], signature, record.get("doi"),
+                                           None if label is None else str(label))
+        doc_ids.append(doc_id)
+        stats["added"] += added
+        if matches:
+            stats["near_duplicates"] += 1
+        if stats["docs"] % COMMIT_EVERY == 0:
+            if commit:
+                index.commit()
+            print(f"🔎 {stats['docs']} docs scanned, {stats['near_duplicates']} near-duplicates")
+    return stats, doc_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate documents or chunks with MinHash/LSH")
+    parser.add_argument("inputs", nargs="+", help="JSON array or JSONL files (.gz/.zst ok)")
+    parser.add_argument("--index", default=INDEX_PATH, help="SQLite index, reused if it exists")
+    parser.add_argument("--clusters", default=None, help="Write duplicate clusters to this JSONL file")
+    parser.add_argument("--check-only", action="store_true",
+                        help="Report matches against the index without adding the inputs to it")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--num-perm", type=int, default=NUM_PERM)
+    parser.add_argument("--bands", type=int, default=BANDS)
+    parser.add_argument("--shingle-size", type=int, default=SHINGLE_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    index = NearDupIndex(args.index, args.num_perm, args.bands, args.shingle_size,
+                         threshold=args.threshold)
+    hasher = MinHasher(args.num_perm, args.shingle_size)
+    existing = len(index)
+    stats, doc_ids = scan(args.inputs, index, hasher, args.workers, commit=not args.check_only)
+
+    clusters = list(index.clusters(doc_ids))
+    mixed = sum(1 for members in clusters if len({m["label"] for m in members}) > 1)
+    if args.clusters:
+        with JSONLWriter(args.clusters, ensure_ascii=False) as out:
+            for members in clusters:
+                out.write({"size": len(members), "members": members})
+
+    if args.check_only:
+        index.rollback()
+    else:
+        index.commit()
+    total = len(index)
+    index.close()
+
+    print(f"📄 Scanned {stats['docs']} docs ({stats['empty']} empty) against {existing} indexed, "
+          f"{stats['docs'] - stats['empty'] - stats['added']} already in the index")
+    print(f"🔁 Near-duplicates: {stats['near_duplicates']} in {len(clusters)} clusters "
+          f"({mixed} with mixed labels)")
+    if args.clusters:
+        print(f"✅ Clusters saved to {args.clusters}")
+    print("ℹ️ Index left unchanged (--check-only)" if args.check_only
+          else f"💾 Index {args.index} now holds {total} docs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Small multiprocessing helpers shared by the dataset scripts.
+"""
+
+from collections import deque
+from itertools import islice
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from any iterable, lazily."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def imap_bounded(pool, func, iterable, window):
+    """Like pool.imap, but keeps at most `window` tasks in flight.
+
+    Pool.imap drains its input as fast as it can, which defeats streaming;
+    this pulls the next item only when an earlier result has been taken.
+    Results are yielded in input order.
+    """
+    in_flight = deque()
+    for item in iterable:
+        in_flight.append(pool.apply_async(func, (item,)))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().get()
+    while in_flight:
+        yield in_flight.popleft().get()
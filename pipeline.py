@@ -0,0 +1,363 @@
+"""
+Script: Run resolve -> download -> extract -> clean as one pipelined job.
+
+Stages are connected by bounded queues, so a slow stage pushes back on the
+ones before it and memory stays flat. Network stages (resolve, download) run
+as async tasks; CPU stages (extract, clean) run in process pools. Each stage
+has its own parallelism and reports its own throughput. Downloads go through
+a fetch_scheduler.FetchScheduler, which spreads them across hosts with
+per-host limits. The download stage can hold more DOIs than there are
+download threads, so a throttled host doesn't starve the others.
+
+Input is a CSV with DOI and Assigned Star columns (like
+DOI___Star_Ratings_for_UoA_4.csv). Raw text lands in --text-dir (the same
+layout combiner.py reads) and cleaned records are streamed to --output as
+JSONL with the same fields and filters as cleaner.py. Extraction runs on an
+extractor.WorkerPool, so a PDF that overruns --extract-timeout has its worker
+killed and replaced without holding up the PDFs queued behind it.
+
+Each cleaned record is flushed before the ledger marks the DOI "cleaned".
+--resume skips DOIs already cleaned and appends to --output; without it the
+output is rewritten from scratch.
+
+Usage:
+    python pipeline.py DOI___Star_Ratings_for_UoA_4.csv --email you@example.com
+    python pipeline.py ratings.csv --email you@example.com --download-workers 16 --extract-workers 8
+    python pipeline.py ratings.csv --email you@example.com --api-base http://127.0.0.1:8000/v2   # stub_server.py
+"""
+
+import asyncio
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from cleaning import LABEL_MAP, MIN_CHARS, Cleaner
+from doi_utils import encode_filename
+from extractor import (TEXT_OPTIONS, TaskFailed, WorkerPool, extract_options, extract_pages_task,
+                       open_cache, read_sections, save_text)
+from fetch_scheduler import HEDGE_AFTER, FetchScheduler
+from ledger import Ledger
+from resolver import API_BASE, TokenBucket, make_session, resolve_doi
+from unpaywall_cache import UnpaywallCache
+from unpaywall_snapshot import UnpaywallSnapshot
+
+RESOLVE_WORKERS = 20
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_WINDOW = 32   # DOIs handed to the fetch scheduler at once
+EXTRACT_WORKERS = os.cpu_count() or 1
+CLEAN_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+QUEUE_SIZE = 64
+RATE_LIMIT = 10
+EXTRACT_TIMEOUT = 120
+REPORT_EVERY = 30   # seconds between progress lines
+
+DONE = object()
+
+
+_cleaner = None
+
+
+def open_output(path, resume):
+    """Output for cleaned records: appended to on --resume (minus any torn last line), else truncated."""
+    if resume and os.path.exists(path):
+        with open(path, "rb+") as f:
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+        return open(path, "a", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def clean_file(txt_path):
+    """Process-pool task: read raw text (and any section offsets) and run the cleaner.py rules on it."""
+    global _cleaner
+    if _cleaner is None:
+        _cleaner = Cleaner()
+    with open(txt_path, "r", encoding="utf-8") as f:
+        return _cleaner.clean_text(f.read(), read_sections(txt_path))
+
+
+class Stage:
+    """Parallelism and throughput counters for one pipeline stage."""
+
+    def __init__(self, name, workers, ledger_stage):
+        self.name = name
+        self.workers = workers
+        self.ledger_stage = ledger_stage
+        self.ok = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def report(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        total = self.ok + self.failed
+        rate = total / elapsed if elapsed > 0 else 0.0
+        util = self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+        return (f" - {self.name:<9} workers={self.workers:<3} ✅ {self.ok:>6} ❌ {self.failed:>5} "
+                f"{rate:7.2f}/s  busy {util:5.0%}")
+
+
+async def run_stage(stage, handler, inbox, outbox, downstream_workers, ledger):
+    """Pull items from inbox, pass them through handler, push non-None results to outbox.
+
+    A handler that raises is ledgered as a retryable failure of its stage, so --resume retries the DOI.
+    """
+
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is DONE:
+                return
+            metrics.set_gauge("queue_depth", inbox.qsize(), stage=stage.name)
+            start = time.monotonic()
+            try:
+                with metrics.span(stage.name, item.get("doi")):
+                    result = await handler(item)
+            except Exception as e:
+                print(f"❌ {stage.name} error for {item.get('doi')}: {e}")
+                ledger.record(item["doi"], stage.ledger_stage, "failed", f"Stage error: {e!r}")
+                result = None
+            elapsed = time.monotonic() - start
+            stage.busy += elapsed
+            metrics.observe("stage_seconds", elapsed, stage=stage.name)
+            metrics.inc("stage_records_total", stage=stage.name, result="failed" if result is None else "ok")
+            if result is None:
+                stage.failed += 1
+                continue
+            stage.ok += 1
+            if outbox is not None:
+                await outbox.put(result)
+
+    stage.started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(stage.workers)))
+    stage.finished = time.monotonic()
+    if outbox is not None:
+        for _ in range(downstream_workers):
+            await outbox.put(DONE)
+
+
+async def run_pipeline(rows, email, pdf_dir, text_dir, output_path, ledger, resume=False,
+                       resolve_workers=RESOLVE_WORKERS, download_workers=DOWNLOAD_WORKERS,
+                       download_window=DOWNLOAD_WINDOW, hedge_after=HEDGE_AFTER,
+                       extract_workers=EXTRACT_WORKERS, clean_workers=CLEAN_WORKERS,
+                       queue_size=QUEUE_SIZE, rate=RATE_LIMIT, extract_timeout=EXTRACT_TIMEOUT, api_base=API_BASE,
+                       cache=None, snapshot=None, extract_cache=None, extract_opts=TEXT_OPTIONS):
+    loop = asyncio.get_running_loop()
+    stages = [
+        Stage("resolve", resolve_workers, "resolved"),
+        Stage("download", max(download_window, download_workers), "downloaded"),
+        Stage("extract", extract_workers, "extracted"),
+        Stage("clean", clean_workers, "cleaned"),
+    ]
+    resolve, download, extract, clean = stages
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(4)]
+    to_resolve, to_download, to_extract, to_clean = queues
+    bucket = TokenBucket(rate)
+    fetcher = FetchScheduler(workers=download_workers, hedge_after=hedge_after)
+    extract_pool = WorkerPool(extract_workers, extract_timeout)
+    clean_pool = ProcessPoolExecutor(max_workers=clean_workers, mp_context=mp.get_context("spawn"))
+    written = 0
+
+    def fail(item, stage_name, reason):
+        ledger.record(item["doi"], stage_name, "failed", reason)
+        return None
+
+    async def do_resolve(item):
+        pdf_urls, error = await resolve_doi(session, bucket, item["doi"], email, api_base, cache, snapshot)
+        if not pdf_urls:
+            return fail(item, "resolved", error)
+        ledger.record(item["doi"], "resolved", "done", url=pdf_urls[0], locations=len(pdf_urls))
+        item["pdf_urls"] = pdf_urls
+        return item
+
+    async def do_download(item):
+        pdf_path = os.path.join(pdf_dir, encode_filename(item["doi"]) + ".pdf")
+        result = await asyncio.wrap_future(fetcher.submit(item["pdf_urls"], pdf_path))
+        if not result.ok:
+            return fail(item, "downloaded", result.reason)
+        ledger.record(item["doi"], "downloaded", "done", sha256=result.sha256, url=result.url,
+                      location=item["pdf_urls"].index(result.url) + 1)
+        item["pdf_path"] = pdf_path
+        item["sha256"] = result.sha256
+        return item
+
+    async def do_extract(item):
+        txt_path = os.path.join(text_dir, encode_filename(item["doi"]) + ".txt")
+        pages = None
+        if extract_cache is not None:
+            pages = extract_cache.get(item["sha256"])
+            metrics.inc("extract_cache_total", result="miss" if pages is None else "hit")
+        if pages is None:
+            start = time.perf_counter()
+            try:
+                status, reason, pages = await asyncio.wrap_future(
+                    extract_pool.submit(extract_pages_task, item["pdf_path"], extract_opts))
+            except TaskFailed as e:
+                status, reason = "failed", str(e)
+            if pages is not None:
+                metrics.observe("extract_seconds", time.perf_counter() - start)
+                metrics.inc("extract_pages_total", len(pages))
+                if extract_cache is not None:
+                    extract_cache.put(item["sha256"], pages)
+        if pages is not None:
+            status, reason, _ = save_text(pages, txt_path, extract_opts)
+        metrics.inc("extract_docs_total", status=status)
+        if status != "success":
+            return fail(item, "extracted", reason)
+        ledger.record(item["doi"], "extracted", "done", path=txt_path, pages=len(pages))
+        item["txt_path"] = txt_path
+        return item
+
+    async def do_clean(item):
+        nonlocal written
+        text = await loop.run_in_executor(clean_pool, clean_file, item["txt_path"])
+        if len(text) <= MIN_CHARS:
+            return fail(item, "cleaned", "Too short after cleaning")
+        out.write(json.dumps({"doi": item["doi"], "text": text, "label": item["label"]},
+                             ensure_ascii=False) + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+        ledger.record(item["doi"], "cleaned", "done")
+        written += 1
+        return item
+
+    async def feed():
+        for row in rows:
+            await to_resolve.put(row)
+        for _ in range(resolve_workers):
+            await to_resolve.put(DONE)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(REPORT_EVERY)
+            depths = " ".join(f"{s.name}={q.qsize()}" for s, q in zip(stages, queues))
+            print(f"📊 queues: {depths} | written {written}")
+            for stage in stages:
+                print(stage.report())
+
+    async with make_session(resolve_workers) as session:
+        with open_output(output_path, resume) as out:
+            progress = asyncio.create_task(reporter())
+            try:
+                await asyncio.gather(
+                    feed(),
+                    run_stage(resolve, do_resolve, to_resolve, to_download, download.workers, ledger),
+                    run_stage(download, do_download, to_download, to_extract, extract_workers, ledger),
+                    run_stage(extract, do_extract, to_extract, to_clean, clean_workers, ledger),
+                    run_stage(clean, do_clean, to_clean, None, 0, ledger),
+                )
+            finally:
+                progress.cancel()
+                fetcher.close(cancel=True)
+                extract_pool.close(cancel=True)
+                clean_pool.shutdown(cancel_futures=True)
+                if cache is not None:
+                    cache.commit()
+                if extract_cache is not None:
+                    extract_cache.commit()
+
+    return stages, written, fetcher.report()
+
+
+def load_rows(csv_path, ledger, resume):
+    """DOIs to run with their mapped labels; unknown labels are ledgered here, before any lookup."""
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        rows = []
+        seen = set()
+        unlabelled = 0
+        for row in csv.DictReader(f):
+            doi = (row.get("DOI") or "").strip()
+            if not doi or doi in seen:
+                continue
+            seen.add(doi)
+            if resume and ledger.should_skip(doi, "cleaned"):
+                continue
+            label = LABEL_MAP.get(str(row.get("Assigned Star", "")).strip())
+            if label is None:
+                ledger.record(doi, "cleaned", "failed", "Unknown label")
+                unlabelled += 1
+                continue
+            rows.append({"doi": doi, "label": label})
+    if unlabelled:
+        print(f"⚠️ Skipped {unlabelled} DOIs with an unknown label")
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pipelined resolve -> download -> extract -> clean")
+    parser.add_argument("csv_path", help="CSV with DOI and Assigned Star columns")
+    parser.add_argument("--email", required=True, help="Email for the Unpaywall API")
+    parser.add_argument("--pdf-dir", default="ref_pdfs")
+    parser.add_argument("--text-dir", default="uoa4_texts")
+    parser.add_argument("--output", default="cleaned_training_data.jsonl")
+    parser.add_argument("--ledger", default="uoa4_ledger.jsonl")
+    parser.add_argument("--cache", default="unpaywall_cache.sqlite")
+    parser.add_argument("--snapshot", default=None,
+                        help="Unpaywall snapshot index (unpaywall_snapshot.py); misses go to the API")
+    parser.add_argument("--offline", action="store_true", help="With --snapshot, don't call the API for misses")
+    parser.add_argument("--extract-cache", default="extraction_cache.sqlite",
+                        help="Extracted-text cache keyed by PDF hash ('' to disable)")
+    parser.add_argument("--resume", action="store_true", help="Skip DOIs the ledger marks finished")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT, help="Unpaywall requests per second")
+    parser.add_argument("--api-base", default=API_BASE, help="Unpaywall API root, e.g. a stub_server.py URL")
+    parser.add_argument("--resolve-workers", type=int, default=RESOLVE_WORKERS)
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--download-window", type=int, default=DOWNLOAD_WINDOW,
+                        help="DOIs waiting on the fetch scheduler at once")
+    parser.add_argument("--hedge-after", type=float, default=HEDGE_AFTER,
+                        help="Seconds without PDF bytes before also trying the next OA location")
+    parser.add_argument("--extract-workers", type=int, default=EXTRACT_WORKERS)
+    parser.add_argument("--clean-workers", type=int, default=CLEAN_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--extract-timeout", type=float, default=EXTRACT_TIMEOUT)
+    parser.add_argument("--sections", action="store_true",
+                        help="Stop extracting at the references and hand section offsets to the cleaner")
+    parser.add_argument("--headings", action="store_true",
+                        help="With --sections, end only at a standalone REFERENCES/BIBLIOGRAPHY line")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args)
+
+    os.makedirs(args.pdf_dir, exist_ok=True)
+    os.makedirs(args.text_dir, exist_ok=True)
+
+    extract_opts = extract_options(args.sections or args.headings, args.headings)
+    extract_cache = open_cache(args.extract_cache, extract_opts)
+    with Ledger(args.ledger) as ledger:
+        rows = load_rows(args.csv_path, ledger, args.resume)
+        print(f"🚀 Running pipeline over {len(rows)} DOIs")
+        start = time.monotonic()
+        try:
+            stages, written, hosts = asyncio.run(run_pipeline(
+                rows, args.email, args.pdf_dir, args.text_dir, args.output, ledger, resume=args.resume,
+                resolve_workers=args.resolve_workers, download_workers=args.download_workers,
+                download_window=args.download_window, hedge_after=args.hedge_after,
+                extract_workers=args.extract_workers, clean_workers=args.clean_workers,
+                queue_size=args.queue_size, rate=args.rate, extract_timeout=args.extract_timeout,
+                api_base=args.api_base,
+                cache=UnpaywallCache(args.cache) if args.cache else None,
+                snapshot=UnpaywallSnapshot(args.snapshot, fallback=not args.offline) if args.snapshot else None,
+                extract_cache=extract_cache, extract_opts=extract_opts,
+            ))
+        except KeyboardInterrupt:
+            print("\n🛑 Interrupted. Rerun with --resume to pick up where this left off.")
+        else:
+            elapsed = time.monotonic() - start
+            print(f"\n✅ Wrote {written} cleaned records to {args.output} in {elapsed:.1f}s")
+            print("📈 Stage throughput:")
+            for stage in stages:
+                print(stage.report())
+            print("📈 Per-host downloads:")
+            for line in hosts:
+                print(line)
+            if extract_cache is not None:
+                print(extract_cache.report())
+        finally:
+            metrics.finish(args)
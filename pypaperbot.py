@@ -1,13 +1,17 @@
-import os, csv, time, requests
+import os, csv, time, requests, argparse
 from urllib.parse import quote_plus
 from bs4 import BeautifulSoup
 import undetected_chromedriver as uc
 from selenium.common.exceptions import TimeoutException
 
+from doi_utils import encode_filename, filename_candidates
+from ledger import Ledger
+
 # -------- CONFIG --------
 DOI_FILE = "doi.txt"   # Change to the name of your doi file
 OUTPUT_DIR = "./pdfs"
 LOG_FILE = "scihub_log.csv"
+LEDGER_FILE = "scihub_ledger.jsonl"  # Per-DOI status, written as we go
 MIRRORS = [
     "https://sci-hub.in",
     "https://sci-hub.se",
@@ -18,6 +22,11 @@ MIRRORS = [
 PDF_MIN_SIZE = 10000  # in bytes
 
 # -------- SETUP --------
+parser = argparse.ArgumentParser(description="Download PDFs for a list of DOIs from Sci-Hub mirrors")
+parser.add_argument("--resume", action="store_true",
+                    help="Skip DOIs the ledger marks finished and retry only retryable failures")
+args = parser.parse_args()
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 def start_browser():
@@ -96,42 +105,56 @@ with open(DOI_FILE, "r") as f:
 
 driver = start_browser()
 results = []
-
-for i, doi in enumerate(dois, 1):
-    print(f"[{i}/{len(dois)}] DOI: {doi}")
-    filename = doi.replace("/", "_") + ".pdf"
-    output_path = os.path.join(OUTPUT_DIR, filename)
-
-    if os.path.exists(output_path):
-        print(f"✅ Already exists: {filename}")
-        results.append([doi, "SKIPPED", "Already downloaded", ""])
-        continue
-
-    success = False
-    for mirror in MIRRORS:
-        print(f"🌐 Trying mirror: {mirror}")
-        pdf_url = extract_pdf_url(driver, doi, mirror)
-
-        if pdf_url:
-            print(f"🔗 PDF link: {pdf_url}")
-            if download_pdf(pdf_url, output_path):
-                print(f"✅ Saved: {filename}")
-                results.append([doi, "DOWNLOADED", mirror, pdf_url])
-                success = True
-                break
+ledger = Ledger(LEDGER_FILE)
+
+try:
+    for i, doi in enumerate(dois, 1):
+        print(f"[{i}/{len(dois)}] DOI: {doi}")
+        filename = encode_filename(doi) + ".pdf"
+        output_path = os.path.join(OUTPUT_DIR, filename)
+
+        existing = next((name for name in filename_candidates(doi, ".pdf")
+                         if os.path.exists(os.path.join(OUTPUT_DIR, name))), None)
+        if existing:  # current or legacy filename
+            print(f"✅ Already exists: {existing}")
+            results.append([doi, "SKIPPED", "Already downloaded", ""])
+            continue
+
+        if args.resume and ledger.should_skip(doi, "downloaded"):
+            print(f"⏭️ Not retrying per ledger: {doi}")
+            results.append([doi, "SKIPPED", "Ledger", ""])
+            continue
+
+        success = False
+        for mirror in MIRRORS:
+            print(f"🌐 Trying mirror: {mirror}")
+            pdf_url = extract_pdf_url(driver, doi, mirror)
+
+            if pdf_url:
+                print(f"🔗 PDF link: {pdf_url}")
+                if download_pdf(pdf_url, output_path):
+                    print(f"✅ Saved: {filename}")
+                    results.append([doi, "DOWNLOADED", mirror, pdf_url])
+                    ledger.record(doi, "downloaded", "done", mirror=mirror, url=pdf_url)
+                    success = True
+                    break
+                else:
+                    print(f"❌ Failed to download from: {mirror}")
             else:
-                print(f"❌ Failed to download from: {mirror}")
-        else:
-            print(f"❌ No PDF found on: {mirror}")
-        time.sleep(1)
-
-    if not success:
-        results.append([doi, "FAILED", "None", "N/A"])
-        print(f"❌ Failed: {doi}")
-
-    time.sleep(2)
-
-driver.quit()
+                print(f"❌ No PDF found on: {mirror}")
+            time.sleep(1)
+
+        if not success:
+            results.append([doi, "FAILED", "None", "N/A"])
+            ledger.record(doi, "downloaded", "failed", "No mirror returned a PDF")
+            print(f"❌ Failed: {doi}")
+
+        time.sleep(2)
+except KeyboardInterrupt:
+    print("\n🛑 Interrupted. Rerun with --resume to pick up where this left off.")
+finally:
+    driver.quit()
+    ledger.close()
 
 # -------- LOG SAVE --------
 with open(LOG_FILE, "w", newline="") as f:
@@ -0,0 +1,445 @@
+"""
+Incremental rebuild of the training data: combine -> merge -> clean -> chunk.
+
+The stages form a DAG (STAGES, each naming the stages it depends on). Paths
+and settings come from DEFAULT_CONFIG, overridden by --config build.json, so
+no script's hardcoded paths have to be edited. A stage reruns only when its
+fingerprint changed: the size/mtime of its inputs, its settings, and the
+source of the modules it runs (e.g. cleaning.py for clean).
+
+Reruns are per record. combine, clean and chunk memoize each record's outputs
+under its key (the DOI) and a hash of the record plus the stage's code and
+settings, so only new or changed records are processed again: editing a regex
+in cleaning.py re-cleans every document, but chunk then re-tokenizes only the
+documents whose cleaned text actually changed. merge is a cheap streaming
+dedupe and simply reruns. Records that disappeared are dropped from the memo.
+
+State lives in STATE_DIR: state.json (stage fingerprints and last counts) and
+one <stage>.sqlite memo per record stage.
+
+Usage:
+    python rebuild.py --dry-run             # what would be rebuilt, and how many records
+    python rebuild.py --config build.json
+    python rebuild.py --force clean         # ignore clean's memo and recompute every record
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+
+from cleaning import LABEL_MAP, MIN_CHARS
+from doi_utils import normalize_doi
+from jsonl_io import iter_records, record_writer
+from parallel import batched
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 64
+
+DEFAULT_CONFIG = {
+    "state_dir": ".build",
+    "ratings_csv": "DOI___Star_Ratings_for_UoA_4.csv",
+    "texts_dir": "uoa4_texts",
+    "combined": "uoa4_combined.jsonl",
+    "extra_inputs": [],        # more JSON/JSONL datasets merged after the combined texts
+    "merged": "combined_training_data.jsonl",
+    "cleaned": "cleaned_training_data.jsonl",
+    "chunked": "uoa4_training_set_chunked.jsonl",
+    "read_workers": 16,
+    "min_chars": MIN_CHARS,
+    "label_map": LABEL_MAP,
+    "model_name": "google/bigbird-roberta-base",
+    "chunk_size": 4096,
+    "stride": 512,
+    "keep_short": True,
+}
+
+
+def hash_json(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def code_version(modules):
+    """Hash of the source files a stage runs."""
+    h = hashlib.sha256()
+    for module in modules:
+        h.update(module.encode("utf-8"))
+        with open(os.path.join(HERE, module), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def path_fingerprint(path):
+    """Cheap change detector: size and mtime of a file, or of every file under a directory."""
+    if not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+    count = size = newest = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            count += 1
+            size += st.st_size
+            newest = max(newest, st.st_mtime_ns)
+    return [count, size, newest]
+
+
+class Memo:
+    """Per-stage record memo: key -> (fingerprint, compressed outputs)."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, outputs BLOB NOT NULL)"
+        )
+
+    def get(self, key):
+        row = self.conn.execute("SELECT fingerprint, outputs FROM memo WHERE key = ?", (key,)).fetchone()
+        return row
+
+    def put(self, key, fingerprint, outputs):
+        blob = zlib.compress(json.dumps(outputs, ensure_ascii=False).encode("utf-8"))
+        self.conn.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?)", (key, fingerprint, blob))
+
+    def stale_keys(self, seen):
+        return [key for (key,) in self.conn.execute("SELECT key FROM memo") if key not in seen]
+
+    def delete(self, keys):
+        self.conn.executemany("DELETE FROM memo WHERE key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        self.conn.execute("DELETE FROM memo")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def decode_outputs(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+class Stage:
+    """One DAG node: reads `inputs()`, writes config[output]."""
+
+    name = None
+    deps = ()
+    modules = ()
+    settings = ()   # config keys that change the stage's output
+    output = None   # config key of the output path
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def output_path(self):
+        return self.config[self.output]
+
+    def inputs(self):
+        return []
+
+    def transform_fingerprint(self):
+        """Code + settings: what a record's output depends on besides the record."""
+        return hash_json({"code": code_version(self.modules),
+                          "settings": {key: self.config[key] for key in self.settings}})
+
+    def fingerprint(self):
+        return hash_json({"transform": self.transform_fingerprint(),
+                          "inputs": {path: path_fingerprint(path) for path in self.inputs()}})
+
+    def run(self, state_dir, dry_run=False, force=False):
+        raise NotImplementedError
+
+
+class RecordStage(Stage):
+    """A stage mapping each input record to zero or more output records, memoized."""
+
+    def records(self):
+        raise NotImplementedError
+
+    def process(self, batch):
+        """Output record lists for a batch of input records (same order)."""
+        raise NotImplementedError
+
+    def keyed_records(self):
+        occurrences = Counter()
+        for record in self.records():
+            key = normalize_doi(record.get("doi")) or "sha:" + hash_json(
+                [record.get("text"), record.get("label")])[:32]
+            occurrences[key] += 1
+            if occurrences[key] > 1:
+                key = f"{key}#{occurrences[key] - 1}"
+            yield key, record
+
+    def close(self):
+        pass
+
+    def run(self, state_dir, dry_run=False, force=False):
+        memo = Memo(os.path.join(state_dir, f"{self.name}.sqlite"))
+        if force and not dry_run:
+            memo.clear()
+        transform = self.transform_fingerprint()
+        counts = Counter()
+        seen = set()
+        writer = None if dry_run else record_writer(self.output_path, ensure_ascii=False, stage=self.name)
+        try:
+            for batch in batched(self.keyed_records(), BATCH_SIZE):
+                results = [None] * len(batch)
+                todo = []
+                for i, (key, record) in enumerate(batch):
+                    seen.add(key)
+                    fingerprint = hash_json([transform, record])
+                    cached = None if force else memo.get(key)
+                    if cached and cached[0] == fingerprint:
+                        counts["reused"] += 1
+                        if not dry_run:
+                            results[i] = decode_outputs(cached[1])
+                    else:
+                        counts["forced" if force else "changed" if cached else "new"] += 1
+                        todo.append((i, key, fingerprint))
+                if dry_run:
+                    continue
+                if todo:
+                    outputs = self.process([batch[i][1] for i, _, _ in todo])
+                    for (i, key, fingerprint), out in zip(todo, outputs):
+                        results[i] = out
+                        memo.put(key, fingerprint, out)
+                for out in results:
+                    for record in out:
+                        writer.write(record)
+                        counts["written"] += 1
+            removed = memo.stale_keys(seen)
+            counts["removed"] = len(removed)
+            if not dry_run:
+                memo.delete(removed)
+        finally:
+            if writer is not None:
+                writer.close()
+            self.close()
+            memo.close()
+        return counts
+
+
+class CombineStage(RecordStage):
+    """Ratings CSV + extracted .txt files -> {"doi", "text", "label"} (combiner.py)."""
+
+    name = "combine"
+    modules = ("combiner.py", "doi_utils.py", "extractor.py")
+    output = "combined"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.pool = None
+
+    def inputs(self):
+        return [self.config["ratings_csv"], self.config["texts_dir"]]
+
+    def records(self):
+        import pandas as pd
+        from combiner import join_ratings
+        from extractor import sections_path
+
+        df = join_ratings(pd.read_csv(self.config["ratings_csv"]), self.config["texts_dir"])
+        for doi, label, path in zip(df["DOI"], df["Assigned Star"], df["path"]):
+            if not isinstance(doi, str):
+                continue
+            record = {"doi": doi, "label": str(label), "path": None}
+            if isinstance(path, str):
+                st = os.stat(path)
+                record.update(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+                sidecar = sections_path(path)
+                if os.path.exists(sidecar):
+                    record["sections_mtime_ns"] = os.stat(sidecar).st_mtime_ns
+            yield record
+
+    def process(self, batch):
+        from multiprocessing.pool import ThreadPool
+
+        from combiner import make_record, read_document
+
+        if self.pool is None:
+            self.pool = ThreadPool(self.config["read_workers"])
+        docs = self.pool.map(lambda r: read_document(r["path"]) if r["path"] else ("", None), batch)
+        return [[make_record(r["doi"], r["label"], text, sections)] if text else []
+                for r, (text, sections) in zip(batch, docs)]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+class MergeStage(Stage):
+    """Exact-dedupe the combined texts with any extra datasets (merger.py)."""
+
+    name = "merge"
+    deps = ("combine",)
+    modules = ("merger.py",)
+    output = "merged"
+
+    def inputs(self):
+        return [self.config["combined"]] + list(self.config["extra_inputs"])
+
+    def run(self, state_dir, dry_run=False, force=False):
+        if dry_run:
+            return Counter()
+        from merger import merge
+
+        stats, conflicts, total = merge(self.inputs(), self.output_path)
+        counts = Counter(written=total, conflicts=len(conflicts))
+        for source in stats.values():
+            counts["duplicates"] += source["duplicates"]
+        return counts
+
+
+class CleanStage(RecordStage):
+    """cleaner.py's rules and filters (cleaning.Cleaner)."""
+
+    name = "clean"
+    deps = ("merge",)
+    modules = ("cleaning.py",)
+    settings = ("min_chars", "label_map")
+    output = "cleaned"
+
+    def inputs(self):
+        return [self.config["merged"]]
+
+    def records(self):
+        return iter_records(self.config["merged"])
+
+    def process(self, batch):
+        from cleaning import Cleaner
+
+        cleaner = Cleaner(self.config["min_chars"], self.config["label_map"])
+        cleaned = (cleaner.clean_record(record) for record in batch)
+        return [[record] if record is not None else [] for record in cleaned]
+
+
+class ChunkStage(RecordStage):
+    """Token-window chunks for BigBird (chunking.Chunker, as in chunker2.py)."""
+
+    name = "chunk"
+    deps = ("clean",)
+    modules = ("chunking.py",)
+    settings = ("model_name", "chunk_size", "stride", "keep_short")
+    output = "chunked"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.chunker = None
+
+    def inputs(self):
+        return [self.config["cleaned"]]
+
+    def records(self):
+        return iter_records(self.config["cleaned"])
+
+    def process(self, batch):
+        if self.chunker is None:
+            from chunking import Chunker
+
+            self.chunker = Chunker(self.config["model_name"], chunk_size=self.config["chunk_size"],
+                                   stride=self.config["stride"], keep_short=self.config["keep_short"])
+        return [chunks for chunks, _ in self.chunker.chunk_batch(batch)]
+
+
+STAGES = [CombineStage, MergeStage, CleanStage, ChunkStage]  # topological order
+
+
+def load_config(path=None):
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise KeyError(f"Unknown config keys in {path}: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+    return config
+
+
+def load_state(state_dir):
+    path = os.path.join(state_dir, "state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state_dir, state):
+    path = os.path.join(state_dir, "state.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def stale_reasons(stage, state, rebuilt, force):
+    reasons = []
+    if stage.name in force:
+        reasons.append("forced")
+    if not os.path.exists(stage.output_path):
+        reasons.append("output missing")
+    if any(dep in rebuilt for dep in stage.deps):
+        reasons.append("upstream rebuilt")
+    elif state.get(stage.name, {}).get("fingerprint") != stage.fingerprint():
+        reasons.append("inputs, settings or code changed")
+    return reasons
+
+
+def rebuild(config, dry_run=False, force=(), until=None):
+    state_dir = config["state_dir"]
+    os.makedirs(state_dir, exist_ok=True)
+    state = load_state(state_dir)
+    rebuilt = set()
+
+    for stage_cls in STAGES:
+        stage = stage_cls(config)
+        reasons = stale_reasons(stage, state, rebuilt, force)
+        if not reasons:
+            print(f"⏭️ {stage.name}: up to date ({stage.output_path})")
+        elif dry_run and any(dep in rebuilt for dep in stage.deps):
+            rebuilt.add(stage.name)
+            print(f"🔨 {stage.name}: would rebuild ({', '.join(reasons)}); "
+                  f"record counts are known once upstream has run")
+        else:
+            rebuilt.add(stage.name)
+            verb = "would rebuild" if dry_run else "rebuilding"
+            print(f"🔨 {stage.name}: {verb} ({', '.join(reasons)})")
+            start = time.time()
+            counts = stage.run(state_dir, dry_run=dry_run, force=stage.name in force)
+            summary = ", ".join(f"{key} {value}" for key, value in sorted(counts.items()))
+            if dry_run:
+                if summary:
+                    print(f"   records: {summary}")
+            else:
+                print(f"   ✅ {summary} in {time.time() - start:.1f}s -> {stage.output_path}")
+                state[stage.name] = {"fingerprint": stage.fingerprint(), "built_at": time.time(),
+                                     "counts": dict(counts)}
+                save_state(state_dir, state)
+        if stage.name == until:
+            break
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild only the stale stages and records of the dataset")
+    parser.add_argument("--config", default=None, help="JSON file overriding DEFAULT_CONFIG")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be rebuilt, change nothing")
+    parser.add_argument("--force", action="append", default=[], choices=[s.name for s in STAGES],
+                        help="Recompute every record of this stage (repeatable)")
+    parser.add_argument("--until", default=None, choices=[s.name for s in STAGES],
+                        help="Stop after this stage")
+    args = parser.parse_args()
+
+    rebuild(load_config(args.config), dry_run=args.dry_run, force=set(args.force), until=args.until)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Async Unpaywall resolver shared by downloadloop.py and unpawall api.py.
+
+Resolves many DOIs concurrently over one keep-alive session while a token
+bucket keeps us inside the requests-per-second budget. Every OA location in
+the record with a PDF URL is returned, best first, so the downloader can fall
+back to (or hedge with) PubMed Central or repository copies. 429s and 5xx
+are retried with exponential backoff (or the Retry-After they send), and the
+wait pauses the shared bucket so every worker slows down, not just the one
+that was throttled. With an
+UnpaywallSnapshot (unpaywall_snapshot.py) DOIs are looked up in a local index
+first and only the ones it doesn't have go to the API.
+
+Usage:
+    from resolver import resolve_dois
+    results = resolve_dois(dois, email="you@example.com", rate=10)
+    pdf_urls, error = results[doi]
+"""
+
+import asyncio
+import time
+
+import aiohttp
+
+import metrics
+from fetcher import backoff_delay, retry_after_seconds
+
+API_BASE = "https://api.unpaywall.org/v2"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+}
+RATE_LIMIT = 10      # requests per second
+CONCURRENCY = 20     # max requests in flight
+TIMEOUT = 15         # seconds per request
+RETRIES = 3          # extra attempts after a 429 or 5xx
+BACKOFF = 2          # base of the exponential backoff, seconds
+MAX_BACKOFF = 60     # longest pause, whatever Retry-After says
+
+# Ranking for the non-best locations: final versions first, then repositories
+# (PMC, institutional) ahead of publisher pages, which more often serve HTML.
+VERSION_RANK = {"publishedVersion": 0, "acceptedVersion": 1, "submittedVersion": 2}
+HOST_TYPE_RANK = {"repository": 0, "publisher": 1}
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.not_before = 0.0   # shared pause after a throttled request
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        """Hand out no tokens for `seconds`; restarts from an empty bucket, not a burst."""
+        self.not_before = max(self.not_before, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            if self.not_before > time.monotonic():
+                while self.not_before > time.monotonic():
+                    await asyncio.sleep(self.not_before - time.monotonic())
+                self.tokens, self.updated = 0.0, time.monotonic()
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def location_rank(location):
+    return (VERSION_RANK.get(location.get("version"), len(VERSION_RANK)),
+            HOST_TYPE_RANK.get(location.get("host_type"), len(HOST_TYPE_RANK)))
+
+
+def pdf_urls_from_record(data):
+    """Every OA PDF URL in an Unpaywall record: best_oa_location first, then the rest ranked."""
+    data = data or {}
+    others = sorted((loc for loc in data.get("oa_locations") or [] if loc), key=location_rank)
+    locations = [data.get("best_oa_location") or {}] + others
+    pdf_urls = list(dict.fromkeys(loc["url_for_pdf"] for loc in locations if loc.get("url_for_pdf")))
+    return pdf_urls, None if pdf_urls else "No OA PDF"
+
+
+def make_session(concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """One pooled keep-alive session for all resolver requests."""
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=HEADERS,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+
+
+def is_throttled(status):
+    return status == 429 or 500 <= status < 600
+
+
+async def fetch_record(session, bucket, doi, email, api_base=API_BASE, retries=RETRIES):
+    """Return (status, json_or_None, error) for one DOI.
+
+    A 429 or 5xx is retried up to `retries` times; only the last one is returned.
+    """
+    url = f"{api_base.rstrip('/')}/{doi}"
+    for attempt in range(retries + 1):
+        waited = time.perf_counter()
+        await bucket.acquire()
+        start = time.perf_counter()
+        metrics.observe("unpaywall_token_wait_seconds", start - waited)
+        try:
+            async with session.get(url, params={"email": email}) as response:
+                status = response.status
+                metrics.observe("unpaywall_request_seconds", time.perf_counter() - start, status=status)
+                metrics.inc("unpaywall_requests_total", status=status)
+                if status == 200:
+                    return 200, await response.json(content_type=None), None
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        except Exception as e:
+            metrics.inc("unpaywall_requests_total", status="exception")
+            return None, None, f"Unpaywall exception: {e}"
+        if not is_throttled(status) or attempt == retries:
+            break
+        delay = backoff_delay(attempt, BACKOFF, MAX_BACKOFF)
+        if retry_after is not None:
+            delay = min(max(delay, retry_after), MAX_BACKOFF)
+        metrics.inc("unpaywall_retries_total", status=status)
+        bucket.pause(delay)
+    return status, None, f"Unpaywall error {status}"
+
+
+def result_from_response(status, data):
+    if status != 200:
+        return [], f"Unpaywall error {status}"
+    return pdf_urls_from_record(data)
+
+
+async def resolve_doi(session, bucket, doi, email, api_base=API_BASE, cache=None, snapshot=None):
+    """Return (pdf_urls, error) for one DOI, consulting the snapshot and the cache first."""
+    if snapshot is not None:
+        found = snapshot.get(doi)
+        metrics.inc("unpaywall_snapshot_total", result="hit" if found else "miss")
+        if found:
+            return result_from_response(*found)
+        if not snapshot.fallback:
+            return [], "Not in snapshot"
+    if cache is not None:
+        cached = cache.get(doi)
+        metrics.inc("unpaywall_cache_total", result="hit" if cached else "miss")
+        if cached:
+            return result_from_response(*cached)
+    status, data, error = await fetch_record(session, bucket, doi, email, api_base)
+    if cache is not None and status is not None:
+        cache.put(doi, status, data)
+    if error:
+        return [], error
+    return pdf_urls_from_record(data)
+
+
+async def resolve_all(dois, email, rate=RATE_LIMIT, concurrency=CONCURRENCY,
+                      api_base=API_BASE, timeout=TIMEOUT, on_result=None, cache=None, snapshot=None):
+    """Resolve every DOI; returns {doi: (pdf_urls, error)}.
+
+    Pass an UnpaywallCache as `cache` to skip DOIs fetched on earlier runs, and
+    an UnpaywallSnapshot as `snapshot` to resolve from a local data dump.
+    """
+    bucket = TokenBucket(rate)
+    queue = asyncio.Queue()
+    for doi in dois:
+        queue.put_nowait(doi)
+    results = {}
+
+    async with make_session(concurrency, timeout) as session:
+        async def worker():
+            while True:
+                try:
+                    doi = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results[doi] = await resolve_doi(session, bucket, doi, email, api_base, cache, snapshot)
+                if on_result:
+                    on_result(doi, *results[doi])
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            if cache is not None:
+                cache.commit()
+
+    return results
+
+
+def resolve_dois(dois, email, **kwargs):
+    """Blocking wrapper around resolve_all for the plain scripts."""
+    return asyncio.run(resolve_all(list(dois), email, **kwargs))
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+
+    parser = argparse.ArgumentParser(description="Resolve DOIs to OA PDF URLs via Unpaywall")
+    parser.add_argument("csv_path", help="CSV with a 'DOI' column")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--api-base", default=API_BASE)
+    parser.add_argument("--output", default="resolved_dois.csv")
+    parser.add_argument("--cache", default=None, help="SQLite response cache path")
+    parser.add_argument("--snapshot", default=None, help="Snapshot index from unpaywall_snapshot.py")
+    parser.add_argument("--offline", action="store_true", help="With --snapshot, don't call the API for misses")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args)
+
+    with open(args.csv_path, newline="", encoding="utf-8") as f:
+        dois = list(dict.fromkeys(row["DOI"].strip() for row in csv.DictReader(f) if row.get("DOI")))
+
+    cache = None
+    if args.cache:
+        from unpaywall_cache import UnpaywallCache
+        cache = UnpaywallCache(args.cache)
+
+    snapshot = None
+    if args.snapshot:
+        from unpaywall_snapshot import UnpaywallSnapshot
+        snapshot = UnpaywallSnapshot(args.snapshot, fallback=not args.offline)
+
+    start = time.monotonic()
+    results = resolve_dois(dois, args.email, rate=args.rate, concurrency=args.concurrency,
+                           api_base=args.api_base, cache=cache, snapshot=snapshot)
+    elapsed = time.monotonic() - start
+
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["DOI", "PDF URL", "Other PDF URLs", "Reason"])
+        for doi in dois:
+            pdf_urls, error = results[doi]
+            writer.writerow([doi, pdf_urls[0] if pdf_urls else "", " ".join(pdf_urls[1:]), error or ""])
+
+    found = sum(1 for urls, _ in results.values() if urls)
+    locations = sum(len(urls) for urls, _ in results.values())
+    print(f"✅ Resolved {len(dois)} DOIs in {elapsed:.1f}s ({len(dois) / max(elapsed, 1e-9):.1f}/s)")
+    print(f"📄 OA PDFs found: {found} ({locations} locations). Saved to {args.output}")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"📦 Cache hits: {stats['hits']}, misses: {stats['misses']}")
+        cache.close()
+    if snapshot is not None:
+        stats = snapshot.stats()
+        print(f"🗄️ Snapshot hits: {stats['hits']}, misses: {stats['misses']}")
+        snapshot.close()
+    metrics.finish(args)
@@ -0,0 +1,186 @@
+"""
+Local stand-in for api.unpaywall.org/v2/ and the PDF hosts it points to.
+
+    GET /v2/<doi>?email=...   Unpaywall-shaped JSON; OA_RATE of DOIs get a
+                              best_oa_location plus `locations` oa_locations
+                              (/pdf/<name>.pdf?loc=N)
+    GET /pdf/<name>.pdf       a synthetic.make_pdf document, Range requests
+                              answered with 206 so fetcher.py can resume;
+                              stall_rate of them hang for `stall` seconds
+                              first, like a slow mirror
+
+Every response can be delayed (latency + random jitter) and replaced by a
+429 (with Retry-After) or a 500 at configurable rates, so resolve/download
+code can be benchmarked and stress-tested without touching the live API.
+
+Usage:
+    with StubServer(latency=0.05, rate_429=0.02) as server:
+        resolve_dois(dois, email, api_base=server.api_base)
+
+    python stub_server.py --port 8000 --latency 0.05 --error-rate 0.01
+    python resolver.py extracted_dois.csv --email you@example.com --api-base http://127.0.0.1:8000/v2
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from doi_utils import decode_filename
+from synthetic import OA_RATE, make_pdf, unpaywall_record
+
+PAGES = 10
+RETRY_AFTER = 1
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+@lru_cache(maxsize=256)
+def cached_pdf(doi, pages, seed):
+    return make_pdf(doi, pages, seed)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(status, len(body))
+
+    def do_GET(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + server.jitter * server.random())
+        roll = server.random()
+        if roll < server.rate_429:
+            return self.send(429, b'{"error": "rate limited"}', headers={"Retry-After": str(RETRY_AFTER)})
+        if roll < server.rate_429 + server.error_rate:
+            return self.send(500, b'{"error": "internal error"}')
+
+        path = urlsplit(self.path).path
+        if path.startswith("/v2/"):
+            return self.unpaywall(unquote(path[len("/v2/"):]))
+        if path.startswith("/pdf/") and path.endswith(".pdf"):
+            return self.pdf(decode_filename(unquote(path[len("/pdf/"):-len(".pdf")])))
+        self.send(404, b'{"error": "not found"}')
+
+    def unpaywall(self, doi):
+        server = self.server
+        record = unpaywall_record(doi, server.url, server.oa_rate, server.seed, server.locations)
+        self.send(200, json.dumps(record).encode("utf-8"))
+
+    def pdf(self, doi):
+        if self.server.stall and self.server.random() < self.server.stall_rate:
+            time.sleep(self.server.stall)
+        body = cached_pdf(doi, self.server.pages, self.server.seed)
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if not match:
+            return self.send(200, body, "application/pdf")
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(body) - 1
+        if start >= len(body):
+            return self.send(416, b"", "application/pdf", {"Content-Range": f"bytes */{len(body)}"})
+        end = min(end, len(body) - 1)
+        self.send(206, body[start:end + 1], "application/pdf",
+                  {"Content-Range": f"bytes {start}-{end}/{len(body)}"})
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub server; start() runs it in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_429=0.0, oa_rate=OA_RATE, pages=PAGES, seed=0, locations=1,
+                 stall_rate=0.0, stall=0.0):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.oa_rate = oa_rate
+        self.pages = pages
+        self.seed = seed
+        self.locations = max(1, locations)
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.statuses = Counter()
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self):
+        return self.url + "/v2"
+
+    def random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def record(self, status, size):
+        with self._lock:
+            self.statuses[status] += 1
+            self.bytes_sent += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local Unpaywall/PDF stub")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra random seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500 responses")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of 429 responses")
+    parser.add_argument("--oa-rate", type=float, default=OA_RATE, help="Share of DOIs with an OA PDF")
+    parser.add_argument("--pages", type=int, default=PAGES)
+    parser.add_argument("--locations", type=int, default=1, help="oa_locations per OA DOI")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of PDF responses that stall")
+    parser.add_argument("--stall", type=float, default=0.0, help="Seconds a stalled PDF response hangs")
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, rate_429=args.rate_429,
+                        oa_rate=args.oa_rate, pages=args.pages, locations=args.locations,
+                        stall_rate=args.stall_rate, stall=args.stall)
+    print(f"🧪 Unpaywall stub on {server.api_base} (PDFs under {server.url}/pdf/)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 Responses: {dict(server.statuses)}")
@@ -0,0 +1,256 @@
+"""
+Synthetic corpus for offline benchmarks and tests.
+
+Everything is generated from a seed, so two runs produce the same files:
+
+- a DOI CSV shaped like extracted_dois.csv (a single DOI column), including
+  DOIs with "_" and ":" to exercise the filename codec;
+- paper-like texts (title, ABSTRACT, body, copyright/doi noise lines,
+  REFERENCES) so cleaner rules fire the way they do on real extractions;
+- PDFs with a configurable page count, written by a tiny dependency-free PDF
+  writer that PyMuPDF can read;
+- JSONL with REF-style "4*".."1*" labels and a share of exact duplicates for
+  merge/dedupe benchmarks;
+- a small Unpaywall snapshot (gzipped JSONL) with the same records the stub
+  server returns, for unpaywall_snapshot.py.
+
+Usage:
+    python synthetic.py bench_data --docs 2000 --pdfs 50 --pages 12
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import random
+from urllib.parse import quote
+
+from doi_utils import encode_filename
+
+LABELS = ["4*", "3*", "2*", "1*"]
+SYLLABLES = ["ta", "ri", "mo", "ken", "sol", "va", "dex", "pra", "lu", "gen", "tor", "mi",
+             "sa", "qua", "bel", "ro", "ni", "stra", "cor", "phe"]
+WORDS_PER_PAGE = 450
+LINE_CHARS = 90
+LINES_PER_PAGE = 55
+OA_RATE = 0.8
+PDF_BASE = "http://127.0.0.1:8000"
+
+
+def make_dois(n, seed=0):
+    rng = random.Random(seed)
+    dois = []
+    for i in range(n):
+        prefix = f"10.{rng.randint(1000, 9999)}"
+        style = i % 10
+        if style == 0:
+            suffix = f"synth_{i}.{rng.randint(100, 999)}"       # underscore
+        elif style == 1:
+            suffix = f"(SICI)synth:{i}:{rng.randint(10, 99)}"   # colons
+        else:
+            suffix = f"synth.{2000 + i % 25}.{i:06d}"
+        dois.append(f"{prefix}/{suffix}")
+    return dois
+
+
+def make_words(rng, n):
+    return [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        for _ in range(n)
+    ]
+
+
+def make_paragraph(rng, words):
+    sentences = []
+    for start in range(0, len(words), 14):
+        sentence = " ".join(words[start:start + 14])
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+    return " ".join(sentences)
+
+
+def make_text(rng, words=3000, doi=None):
+    """One paper-like document with sections and typical extraction noise."""
+    body = make_words(rng, words)
+    paragraphs = [make_paragraph(rng, body[i:i + 120]) for i in range(0, len(body), 120)]
+    parts = [
+        make_paragraph(rng, make_words(rng, 8)).upper(),
+        "Journal of Synthetic Studies, vol. 12",
+        "ABSTRACT",
+        paragraphs[0],
+        "INTRODUCTION",
+    ]
+    for i, paragraph in enumerate(paragraphs[1:], 1):
+        parts.append(paragraph)
+        if i % 4 == 0:
+            parts.append(f"Copyright {rng.randint(2000, 2024)} The Authors. All rights reserved.")
+        if i % 7 == 0 and doi:
+            parts.append(f"doi: {doi}")
+    parts.append("REFERENCES")
+    for i in range(20):
+        parts.append(f"[{i + 1}] " + make_paragraph(rng, make_words(rng, 12)))
+    return "\n".join(parts)
+
+
+def wrap(text, width=LINE_CHARS):
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def pdf_bytes(text, lines_per_page=LINES_PER_PAGE):
+    """Minimal multi-page Helvetica PDF holding `text`."""
+    lines = wrap(text)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = []   # index i holds object i + 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for page_lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 760 Td"]
+        ops.extend(f"({_pdf_escape(line)}) Tj T*" for line in page_lines)
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def make_pdf(doi, pages, seed=0):
+    """Deterministic PDF for a DOI with roughly `pages` pages."""
+    rng = random.Random(f"{seed}:{doi}")
+    return pdf_bytes(make_text(rng, words=max(1, pages * WORDS_PER_PAGE - 400), doi=doi))
+
+
+def is_oa(doi, oa_rate=OA_RATE, seed=0):
+    digest = hashlib.sha256(f"{seed}:{doi}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < oa_rate
+
+
+def unpaywall_record(doi, pdf_base=PDF_BASE, oa_rate=OA_RATE, seed=0, locations=1):
+    """Unpaywall-shaped record; oa_rate of DOIs get `locations` PDF locations under pdf_base/pdf/."""
+    record = {"doi": doi.lower(), "is_oa": False, "best_oa_location": None, "oa_locations": []}
+    if is_oa(doi, oa_rate, seed):
+        url = f"{pdf_base}/pdf/{quote(encode_filename(doi))}.pdf"
+        urls = [url] + [f"{url}?loc={i}" for i in range(1, locations)]
+        oa_locations = [
+            {"url": u, "url_for_pdf": u, "host_type": "publisher" if i == 0 else "repository",
+             "version": "publishedVersion"}
+            for i, u in enumerate(urls)
+        ]
+        record.update(is_oa=True, best_oa_location=oa_locations[0], oa_locations=oa_locations)
+    return record
+
+
+def write_doi_csv(path, dois):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["DOI"])
+        writer.writerows([doi] for doi in dois)
+
+
+def write_pdfs(folder, dois, pages, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for doi in dois:
+        path = os.path.join(folder, encode_filename(doi) + ".pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(doi, pages, seed))
+        paths.append(path)
+    return paths
+
+
+def write_jsonl(path, dois, words=3000, duplicate_rate=0.1, seed=0):
+    """{"doi", "text", "label"} records; duplicate_rate of them repeat an earlier record."""
+    rng = random.Random(seed)
+    written = []
+    with open(path, "w", encoding="utf-8") as f:
+        for doi in dois:
+            if written and rng.random() < duplicate_rate:
+                record = rng.choice(written)
+            else:
+                doc_rng = random.Random(f"{seed}:{doi}")  # same DOI -> same record in every file
+                record = {"doi": doi, "text": make_text(doc_rng, doc_rng.randint(words // 2, words * 3 // 2), doi),
+                          "label": doc_rng.choice(LABELS)}
+                written.append(record)
+            f.write(json.dumps(record) + "\n")
+    return path
+
+
+def write_unpaywall_snapshot(path, dois, pdf_base=PDF_BASE, oa_rate=OA_RATE, seed=0, locations=1):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for doi in dois:
+            f.write(json.dumps(unpaywall_record(doi, pdf_base, oa_rate, seed, locations)) + "\n")
+    return path
+
+
+def generate(out_dir, docs=1000, pdfs=50, pages=10, words=3000, seed=0):
+    """Write the whole synthetic corpus; returns its paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    dois = make_dois(docs, seed)
+    corpus = {
+        "dois_csv": os.path.join(out_dir, "synthetic_dois.csv"),
+        "pdf_dir": os.path.join(out_dir, "pdfs"),
+        "jsonl": os.path.join(out_dir, "synthetic_a.jsonl"),
+        "jsonl_b": os.path.join(out_dir, "synthetic_b.jsonl"),
+        "snapshot": os.path.join(out_dir, "unpaywall_snapshot.jsonl.gz"),
+    }
+    write_doi_csv(corpus["dois_csv"], dois)
+    write_unpaywall_snapshot(corpus["snapshot"], dois, seed=seed)
+    write_pdfs(corpus["pdf_dir"], dois[:pdfs], pages, seed)
+    half = len(dois) // 2
+    write_jsonl(corpus["jsonl"], dois[:half], words, seed=seed)
+    # the second file overlaps the first, like newdata.json vs ref_training_data.json
+    write_jsonl(corpus["jsonl_b"], dois[half // 2:], words, seed=seed)
+    return corpus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic DOI/PDF/JSONL corpus")
+    parser.add_argument("out_dir")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--pdfs", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words", type=int, default=3000, help="Average words per JSONL document")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = generate(args.out_dir, args.docs, args.pdfs, args.pages, args.words, args.seed)
+    for name, path in corpus.items():
+        print(f"✅ {name}: {path}")
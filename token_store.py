@@ -0,0 +1,193 @@
+"""
+Pre-tokenized, memory-mappable chunk store for training.
+
+A store is a directory:
+
+    tokens.bin    flat token ids (uint16 when the vocab fits, else int32)
+    masks.bin     attention masks, one uint8 per token
+    offsets.bin   int64 start offset of each chunk (n + 1 entries)
+    labels.bin    int32 label id per chunk (index into meta["labels"])
+    meta.json     tokenizer name/class/version/fingerprint, dtype, counts
+
+TokenStore memory-maps the .bin files and hands out memoryview slices, so a
+data loader reads chunk i without parsing JSON or re-running the tokenizer
+(wrap with numpy.frombuffer / torch.frombuffer for zero-copy arrays). Opening
+a store with a different tokenizer raises StaleTokenStore.
+
+Label ids are assigned in the order labels are first added, so they differ
+from store to store; map them back with label_name() (meta["labels"]).
+
+Usage:
+    with TokenStoreWriter("uoa4_tokens", tokenizer_info(tokenizer)) as store:
+        store.add(input_ids, "4")
+
+    store = TokenStore("uoa4_tokens", expect=tokenizer_info(tokenizer))
+    item = store[0]   # {"input_ids": memoryview, "attention_mask": memoryview, "label": label_id}
+    store.label_name(item["label"])   # "4"
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+from array import array
+
+FORMAT_VERSION = 1
+FILES = ("tokens.bin", "masks.bin", "offsets.bin", "labels.bin")
+
+
+class StaleTokenStore(ValueError):
+    """The store was written by a different tokenizer (or format version)."""
+
+
+def tokenizer_info(tokenizer):
+    """Identity of a Hugging Face tokenizer, stored in meta.json."""
+    import transformers
+
+    if getattr(tokenizer, "is_fast", False):
+        spec = tokenizer.backend_tokenizer.to_str()
+    else:
+        spec = json.dumps(sorted(tokenizer.get_vocab().items()))
+    return {
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "transformers_version": transformers.__version__,
+        "vocab_size": len(tokenizer),
+        "fingerprint": hashlib.sha256(spec.encode("utf-8")).hexdigest(),
+    }
+
+
+def token_typecode(vocab_size):
+    return "H" if vocab_size <= 0xFFFF else "i"
+
+
+class TokenStoreWriter:
+    """Append chunks to a token store; meta.json is written on close."""
+
+    def __init__(self, path, tokenizer, extra=None):
+        self.path = path
+        self.tokenizer = tokenizer
+        self.extra = extra or {}
+        self.typecode = token_typecode(tokenizer["vocab_size"])
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            os.remove(os.path.join(path, "meta.json"))  # invalid until closed
+        self.tokens = open(os.path.join(path, "tokens.bin"), "wb")
+        self.masks = open(os.path.join(path, "masks.bin"), "wb")
+        self.labels = open(os.path.join(path, "labels.bin"), "wb")
+        self.offsets = array("q", [0])
+        self.label_ids = {}
+        self.count = 0
+
+    def add(self, input_ids, label, attention_mask=None):
+        ids = array(self.typecode, input_ids)
+        self.tokens.write(ids.tobytes())
+        if attention_mask is None:
+            self.masks.write(b"\x01" * len(ids))
+        else:
+            self.masks.write(bytes(attention_mask))
+        label_id = self.label_ids.setdefault(str(label), len(self.label_ids))
+        self.labels.write(array("i", [label_id]).tobytes())
+        self.offsets.append(self.offsets[-1] + len(ids))
+        self.count += 1
+
+    def close(self):
+        for f in (self.tokens, self.masks, self.labels):
+            f.close()
+        with open(os.path.join(self.path, "offsets.bin"), "wb") as f:
+            f.write(self.offsets.tobytes())
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "tokenizer": self.tokenizer,
+            "token_dtype": "uint16" if self.typecode == "H" else "int32",
+            "byteorder": sys.byteorder,
+            "num_chunks": self.count,
+            "num_tokens": self.offsets[-1],
+            "labels": sorted(self.label_ids, key=self.label_ids.get),
+        }
+        meta.update(self.extra)
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _map(path, typecode):
+    size = os.path.getsize(path)
+    if size == 0:
+        return None, memoryview(array(typecode))
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, memoryview(mm).cast(typecode)
+
+
+class TokenStore:
+    """Read-only, memory-mapped view of a token store."""
+
+    def __init__(self, path, expect=None):
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"{path} is not a finished token store (no meta.json)")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise StaleTokenStore(f"{path}: format version {self.meta.get('format_version')}")
+        if self.meta["byteorder"] != sys.byteorder:
+            raise StaleTokenStore(f"{path}: written on a {self.meta['byteorder']}-endian machine")
+        if expect is not None:
+            stored = self.meta["tokenizer"]
+            for key in ("name", "fingerprint"):
+                if stored.get(key) != expect.get(key):
+                    raise StaleTokenStore(
+                        f"{path}: built with tokenizer {stored.get('name')} "
+                        f"({stored.get('fingerprint', '')[:12]}), expected {expect.get('name')} "
+                        f"({expect.get('fingerprint', '')[:12]}); rebuild the store"
+                    )
+
+        typecode = "H" if self.meta["token_dtype"] == "uint16" else "i"
+        self._maps = []
+        self.tokens = self._open(path, "tokens.bin", typecode)
+        self.masks = self._open(path, "masks.bin", "B")
+        self.offsets = self._open(path, "offsets.bin", "q")
+        self.label_ids = self._open(path, "labels.bin", "i")
+        self.labels = self.meta["labels"]
+
+    def _open(self, path, name, typecode):
+        mm, view = _map(os.path.join(path, name), typecode)
+        if mm is not None:
+            self._maps.append((mm, view))
+        return view
+
+    def __len__(self):
+        return self.meta["num_chunks"]
+
+    def length(self, i):
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {
+            "input_ids": self.tokens[start:end],
+            "attention_mask": self.masks[start:end],
+            "label": self.label_ids[i],
+        }
+
+    def label_name(self, label_id):
+        return self.labels[label_id]
+
+    def close(self):
+        for mm, view in self._maps:
+            view.release()
+            mm.close()
+        self._maps = []
@@ -1,106 +1,170 @@
+import argparse
 import pandas as pd
+from collections import deque
 from pathlib import Path
-import requests
-import time
-import fitz  # PyMuPDF
 import os
+import tempfile
+
+from doi_utils import encode_filename, filename_candidates
+from extractor import extract_document, extract_options, open_cache, write_text
+from fetch_scheduler import FetchScheduler
+from ledger import Ledger
+from resolver import resolve_dois
+from unpaywall_cache import UnpaywallCache
+from unpaywall_snapshot import UnpaywallSnapshot
 
 # Config
 INPUT_CSV = "DOI___Star_Ratings_for_UoA_4.csv"  
 OUTPUT_DIR = Path("uoa4_texts")
 LOG_CSV = "uoa4_extraction_log.csv"
+LEDGER_PATH = "uoa4_ledger.jsonl"  # Per-DOI stage status, written as we go
 UNPAYWALL_EMAIL = ""  
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
-}
-RETRY_LIMIT = 2
+DOWNLOAD_WORKERS = 16  # PDF downloads in flight, spread across hosts
+DOWNLOAD_AHEAD = 64  # PDFs fetched ahead of extraction; bounds the temp PDFs on disk
+RATE_LIMIT = 10   # Unpaywall requests per second
+CONCURRENCY = 20  # Unpaywall requests in flight
+CACHE_PATH = "unpaywall_cache.sqlite"  # Unpaywall responses reused across runs
+SNAPSHOT_INDEX = None  # e.g. "unpaywall_snapshot.sqlite" from unpaywall_snapshot.py; misses still use the API
+EXTRACT_CACHE_PATH = "extraction_cache.sqlite"  # Page texts by PDF hash, so reruns skip PyMuPDF
+SECTIONS = False  # Stop at the references and save section offsets next to each text
+
+parser = argparse.ArgumentParser(description="Download OA PDFs via Unpaywall and extract their text")
+parser.add_argument("--resume", action="store_true",
+                    help="Skip DOIs the ledger marks finished and retry only retryable failures")
+args = parser.parse_args()
 
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 # Load dataset
 df = pd.read_csv(INPUT_CSV)
 log = []
+ledger = Ledger(LEDGER_PATH)
+extract_opts = extract_options(SECTIONS)
+extract_cache = open_cache(EXTRACT_CACHE_PATH, extract_opts)
 
-def get_pdf_url_from_unpaywall(doi):
-    print(f"🔍 Checking Unpaywall for DOI: {doi}")
-    url = f"https://api.unpaywall.org/v2/{doi}?email={UNPAYWALL_EMAIL}"
-    try:
-        response = requests.get(url, timeout=15, headers=HEADERS)
-        if response.status_code != 200:
-            return None, f"Unpaywall error {response.status_code}"
-        data = response.json()
-        pdf_url = data.get("best_oa_location", {}).get("url_for_pdf")
-        return pdf_url, None if pdf_url else "No OA PDF"
-    except Exception as e:
-        return None, f"Unpaywall exception: {e}"
-
-def download_pdf(pdf_url, filename):
-    for attempt in range(RETRY_LIMIT):
-        try:
-            r = requests.get(pdf_url, stream=True, timeout=20, headers=HEADERS)
-            if r.status_code == 200:
-                with open(filename, 'wb') as f:
-                    f.write(r.content)
-                print(f"✅ PDF downloaded: {filename}")
-                return True, None
-            else:
-                print(f"⚠️ Attempt {attempt+1} failed: {r.status_code}")
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt+1} exception: {e}")
-        time.sleep(2)
-    return False, f"Download failed after {RETRY_LIMIT} attempts"
+def get_pdf_urls_from_unpaywall(dois):
+    print(f"🔍 Checking Unpaywall for {len(dois)} DOIs")
+    snapshot = UnpaywallSnapshot(SNAPSHOT_INDEX) if SNAPSHOT_INDEX else None
+    return resolve_dois(dois, UNPAYWALL_EMAIL, rate=RATE_LIMIT, concurrency=CONCURRENCY,
+                        cache=UnpaywallCache(CACHE_PATH), snapshot=snapshot)
+
+def temp_pdf_path(doi):
+    return os.path.join(temp_dir.name, f"{encode_filename(doi)}.pdf")
 
-def extract_text_from_pdf(pdf_path):
+def download_ahead(dois, ahead=DOWNLOAD_AHEAD):
+    """Yield (doi, DownloadResult) in order while up to `ahead` later PDFs download, interleaving hosts."""
+    queued = deque()
+    for doi in dois:
+        queued.append((doi, scheduler.submit(resolved[doi][0], temp_pdf_path(doi))))
+        if len(queued) >= ahead:
+            doi, future = queued.popleft()
+            yield doi, future.result()
+    while queued:
+        doi, future = queued.popleft()
+        yield doi, future.result()
+
+def download_result(doi):
+    """Advance the download stream (in row order) until this DOI's result is in."""
+    while doi not in downloads:
+        key, result = next(stream)
+        downloads[key] = result
+    return downloads[doi]
+
+def extract_text_from_pdf(pdf_path, sha256=None):
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        text, _, sections = extract_document(pdf_path, cache=extract_cache, sha256=sha256,
+                                             options=extract_opts)
+        return text, sections
     except Exception as e:
         print(f"❌ Extraction error: {e}")
-        return ""
-
-for idx, row in df.iterrows():
-    doi = row['DOI']
-    star = row['Assigned Star']
-    safe_name = doi.replace('/', '_').replace(':', '_')
-    out_path = OUTPUT_DIR / f"{safe_name}.txt"
-    temp_pdf = f"temp_{safe_name}.pdf"
-
-    print(f"\n[{idx+1}/{len(df)}] Processing DOI: {doi}")
-
-    if out_path.exists():
-        print("⚠️ Already exists. Skipping.")
-        log.append([doi, "✅ success", "", star])
-        continue
-
-    pdf_url, error = get_pdf_url_from_unpaywall(doi)
-    if not pdf_url:
-        print(f"❌ No PDF URL: {error}")
-        log.append([doi, "❌ failed", error, star])
-        continue
-
-    success, reason = download_pdf(pdf_url, temp_pdf)
-    if not success:
-        print(f"❌ PDF download failed: {reason}")
-        log.append([doi, "❌ failed", reason, star])
-        continue
-
-    text = extract_text_from_pdf(temp_pdf)
-    if not text.strip():
-        print("❌ Extracted text is empty.")
-        log.append([doi, "❌ failed", "Empty text", star])
-    else:
-        out_path.write_text(text, encoding='utf-8')
-        print(f"💾 Text saved to: {out_path.name}")
-        log.append([doi, "✅ success", "", star])
-
-    if os.path.exists(temp_pdf):
-        os.remove(temp_pdf)
-
-    time.sleep(1)  # Respect API rate limits
-
-# Save log
-pd.DataFrame(log, columns=["DOI", "Status", "Reason", "Assigned Star"]).to_csv(LOG_CSV, index=False)
+        return "", None
+
+def is_finished(doi):
+    if args.resume and ledger.should_skip(doi, "extracted"):
+        return True
+    return any((OUTPUT_DIR / name).exists() for name in filename_candidates(doi, ".txt"))
+
+pending = [doi for doi in df['DOI'].dropna().unique() if not is_finished(doi)]
+resolved = get_pdf_urls_from_unpaywall(pending)
+
+# PDFs are fetched into a temp dir just ahead of extraction and deleted after it,
+# so disk use stays bounded and an interrupted run leaves nothing behind
+temp_dir = tempfile.TemporaryDirectory(prefix="unpaywall_pdfs_")
+scheduler = FetchScheduler(workers=DOWNLOAD_WORKERS)
+jobs = [doi for doi in pending if resolved[doi][0]]
+print(f"⬇️ Downloading {len(jobs)} PDFs, up to {DOWNLOAD_AHEAD} ahead of extraction")
+stream = download_ahead(jobs)
+downloads = {}
+
+try:
+    for idx, row in df.iterrows():
+        doi = row['DOI']
+        star = row['Assigned Star']
+        safe_name = encode_filename(doi)
+        out_path = OUTPUT_DIR / f"{safe_name}.txt"
+        temp_pdf = temp_pdf_path(doi)
+
+        print(f"\n[{idx+1}/{len(df)}] Processing DOI: {doi}")
+
+        if any((OUTPUT_DIR / name).exists() for name in filename_candidates(doi, ".txt")):
+            print("⚠️ Already exists. Skipping.")
+            log.append([doi, "✅ success", "", star, ""])
+            continue
+
+        if args.resume and ledger.should_skip(doi, "extracted"):
+            print("⏭️ Finished or not retryable per ledger. Skipping.")
+            failure = ledger.last_failure(doi)
+            if failure:
+                log.append([doi, "❌ failed", failure["reason"], star, ""])
+            else:
+                log.append([doi, "✅ success", "", star, ""])
+            continue
+
+        pdf_urls, error = resolved.get(doi, ([], "Unpaywall: DOI not resolved"))
+        if not pdf_urls:
+            print(f"❌ No PDF URL: {error}")
+            ledger.record(doi, "resolved", "failed", error)
+            log.append([doi, "❌ failed", error, star, ""])
+            continue
+        ledger.record(doi, "resolved", "done", url=pdf_urls[0], locations=len(pdf_urls))
+
+        result = download_result(doi)
+        if not result.ok:
+            print(f"❌ PDF download failed: {result.reason}")
+            ledger.record(doi, "downloaded", "failed", result.reason)
+            log.append([doi, "❌ failed", result.reason, star, ""])
+            continue
+        print(f"✅ PDF downloaded from {result.url}")
+        ledger.record(doi, "downloaded", "done", url=result.url,
+                      location=pdf_urls.index(result.url) + 1)
+
+        text, sections = extract_text_from_pdf(temp_pdf, result.sha256)
+        if not text.strip():
+            print("❌ Extracted text is empty.")
+            ledger.record(doi, "extracted", "failed", "Empty text")
+            log.append([doi, "❌ failed", "Empty text", star, result.url])
+        else:
+            write_text(str(out_path), text, sections)
+            print(f"💾 Text saved to: {out_path.name}")
+            ledger.record(doi, "extracted", "done", path=str(out_path))
+            log.append([doi, "✅ success", "", star, result.url])
+
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+except KeyboardInterrupt:
+    print("\n🛑 Interrupted. Rerun with --resume to pick up where this left off.")
+finally:
+    scheduler.close(cancel=True)
+    temp_dir.cleanup()
+    if scheduler.hosts:
+        print("📈 Per-host downloads:")
+        for line in scheduler.report():
+            print(line)
+    ledger.close()
+    if extract_cache is not None:
+        print(extract_cache.report())
+        extract_cache.close()
+    # Save log
+    pd.DataFrame(log, columns=["DOI", "Status", "Reason", "Assigned Star", "PDF URL"]).to_csv(LOG_CSV, index=False)
+
 print("\n✅ Extraction process complete. See log for details.")
@@ -0,0 +1,147 @@
+"""
+Persistent SQLite cache for Unpaywall responses.
+
+Stores the full JSON record, HTTP status and fetch time per normalized DOI so
+reruns over the same CSV skip the API. Positive hits (an OA PDF URL) and
+negative hits ("No OA PDF", 404) get separate TTLs.
+
+Usage:
+    cache = UnpaywallCache("unpaywall_cache.sqlite")
+    resolve_dois(dois, email, cache=cache)
+"""
+
+import json
+import sqlite3
+import time
+
+from doi_utils import normalize_doi
+
+CACHE_PATH = "unpaywall_cache.sqlite"
+TTL = 30 * 24 * 3600           # positive entries: 30 days
+NEGATIVE_TTL = 7 * 24 * 3600   # "No OA PDF" and 404s: 7 days
+MAX_BYTES = 512 * 1024 * 1024  # evict oldest entries beyond this
+CACHEABLE_STATUSES = {200, 404}
+
+
+def is_negative(status, data):
+    if status != 200:
+        return True
+    data = data or {}
+    locations = [data.get("best_oa_location")] + list(data.get("oa_locations") or [])
+    return not any(loc and loc.get("url_for_pdf") for loc in locations)
+
+
+class UnpaywallCache:
+    """DOI -> (status, json) cache with TTLs and size-based eviction."""
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes_since_evict = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                doi TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                body TEXT,
+                negative INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)")
+        self.conn.commit()
+
+    def get(self, doi):
+        """Return (status, data) if a fresh entry exists, else None."""
+        row = self.conn.execute(
+            "SELECT status, body, negative, fetched_at FROM responses WHERE doi = ?",
+            (normalize_doi(doi),),
+        ).fetchone()
+        if row:
+            status, body, negative, fetched_at = row
+            ttl = self.negative_ttl if negative else self.ttl
+            if time.time() - fetched_at <= ttl:
+                self.hits += 1
+                return status, json.loads(body) if body else None
+        self.misses += 1
+        return None
+
+    def put(self, doi, status, data):
+        """Store a response; statuses outside CACHEABLE_STATUSES are ignored."""
+        if status not in CACHEABLE_STATUSES:
+            return
+        body = json.dumps(data) if data is not None else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (normalize_doi(doi), status, body, int(is_negative(status, data)),
+             time.time(), len(body or "")),
+        )
+        self.writes_since_evict += 1
+        if self.writes_since_evict >= 500:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Drop the oldest entries until the cache fits in max_bytes."""
+        self.writes_since_evict = 0
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for doi, size in self.conn.execute(
+            "SELECT doi, size FROM responses ORDER BY fetched_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE doi = ?", (doi,))
+            total -= size
+            removed += 1
+        self.conn.commit()
+        return removed
+
+    def purge_expired(self):
+        now = time.time()
+        cur = self.conn.execute(
+            "DELETE FROM responses WHERE (negative = 0 AND fetched_at < ?) OR (negative = 1 AND fetched_at < ?)",
+            (now - self.ttl, now - self.negative_ttl),
+        )
+        self.conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        count, size, negative = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(negative), 0) FROM responses"
+        ).fetchone()
+        return {"entries": count, "bytes": size, "negative": negative,
+                "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or prune the Unpaywall response cache")
+    parser.add_argument("path", nargs="?", default=CACHE_PATH)
+    parser.add_argument("--purge-expired", action="store_true")
+    args = parser.parse_args()
+
+    cache = UnpaywallCache(args.path)
+    if args.purge_expired:
+        print(f"🧹 Removed {cache.purge_expired()} expired entries")
+    stats = cache.stats()
+    print(f"📦 Entries: {stats['entries']} ({stats['negative']} negative)")
+    print(f"💾 Size: {stats['bytes'] / 1e6:.1f} MB")
+    cache.close()
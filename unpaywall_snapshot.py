@@ -0,0 +1,183 @@
+"""
+Offline Unpaywall lookups from a data snapshot.
+
+Unpaywall publishes its whole database as gzipped JSONL, one record per DOI.
+build() streams a snapshot once into a SQLite index that keeps only what the
+resolver uses: per normalized DOI, the OA locations that have a PDF URL
+(url_for_pdf, version, host_type), or NULL for DOIs without one. After that:
+
+- thousands of DOIs resolve locally in milliseconds, with no rate limit;
+- get(doi) returns (200, record) like UnpaywallCache.get, so
+  resolver.pdf_urls_from_record ranks locations exactly as for API responses;
+- DOIs the snapshot doesn't have fall back to the live API (and the response
+  cache) unless fallback=False; DOIs it has, OA or not, never hit the API;
+- --dois keeps only the DOIs of one CSV, so an index built from the full
+  snapshot stays small, and other lines are skipped before json parsing.
+
+Usage:
+    python unpaywall_snapshot.py unpaywall_snapshot.jsonl.gz --dois extracted_dois.csv
+    python unpaywall_snapshot.py --index unpaywall_snapshot.sqlite     # entry count and age
+
+    snapshot = UnpaywallSnapshot("unpaywall_snapshot.sqlite")
+    resolve_dois(dois, email, snapshot=snapshot, cache=UnpaywallCache(CACHE_PATH))
+"""
+
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+
+from doi_utils import normalize_doi
+
+INDEX_PATH = "unpaywall_snapshot.sqlite"
+BATCH_SIZE = 10000
+LOCATION_FIELDS = ("url_for_pdf", "version", "host_type")
+DOI_RE = re.compile(rb'"doi"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def open_snapshot(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _slim(location):
+    return {key: location[key] for key in LOCATION_FIELDS if location.get(key)}
+
+
+def oa_fields(record):
+    """The resolver's part of an Unpaywall record, or None if it has no PDF location."""
+    best = record.get("best_oa_location") or {}
+    locations = [_slim(loc) for loc in record.get("oa_locations") or [] if loc and loc.get("url_for_pdf")]
+    if not locations and not best.get("url_for_pdf"):
+        return None
+    return {"best_oa_location": _slim(best) if best.get("url_for_pdf") else None,
+            "oa_locations": locations}
+
+
+def might_want(line, wanted):
+    """Cheap pre-filter on the raw line: False only if no "doi" value in it is wanted."""
+    for match in DOI_RE.finditer(line):
+        value = match.group(1)
+        if b"\\" in value or normalize_doi(value.decode("utf-8", "replace")) in wanted:
+            return True
+    return False
+
+
+class UnpaywallSnapshot:
+    """Normalized DOI -> OA locations, built from an Unpaywall snapshot.
+
+    Opening an index that doesn't exist is an error unless create=True (for build()).
+    """
+
+    def __init__(self, path=INDEX_PATH, fallback=True, create=False):
+        if not create and not os.path.exists(path):
+            raise FileNotFoundError(f"{path}: no Unpaywall snapshot index; build one with "
+                                    "python unpaywall_snapshot.py <snapshot.jsonl.gz> --index ...")
+        self.path = path
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        if not create and self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'records'").fetchone() is None:
+            self.conn.close()
+            raise ValueError(f"{path} is not an Unpaywall snapshot index (no records table)")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS records (
+                doi TEXT PRIMARY KEY,
+                body TEXT
+            ) WITHOUT ROWID"""
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def build(self, paths, dois=None, batch_size=BATCH_SIZE):
+        """Add every record in the snapshot files (only `dois`, if given); returns counts."""
+        wanted = {normalize_doi(doi) for doi in dois} if dois is not None else None
+        counts = {"lines": 0, "records": 0, "oa": 0, "bad": 0}
+        batch = []
+
+        def flush():
+            self.conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?)", batch)
+            self.conn.commit()
+            batch.clear()
+
+        for path in paths:
+            with open_snapshot(path) as f:
+                for line in f:
+                    counts["lines"] += 1
+                    if wanted is not None and not might_want(line, wanted):
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        counts["bad"] += 1
+                        continue
+                    doi = normalize_doi(record.get("doi"))
+                    if not doi or (wanted is not None and doi not in wanted):
+                        continue
+                    body = oa_fields(record)
+                    batch.append((doi, json.dumps(body, separators=(",", ":")) if body else None))
+                    counts["records"] += 1
+                    counts["oa"] += body is not None
+                    if len(batch) >= batch_size:
+                        flush()
+        flush()
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [("built_at", str(time.time())), ("sources", json.dumps(list(paths)))])
+        self.conn.commit()
+        return counts
+
+    def get(self, doi):
+        """Return (200, record) if the snapshot has this DOI, else None."""
+        row = self.conn.execute("SELECT body FROM records WHERE doi = ?", (normalize_doi(doi),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return 200, json.loads(row[0]) if row[0] else {}
+
+    def stats(self):
+        count, oa = self.conn.execute(
+            "SELECT COUNT(*), COUNT(body) FROM records"
+        ).fetchone()
+        built_at = self.conn.execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        age = (time.time() - float(built_at[0])) / 86400 if built_at else None
+        return {"entries": count, "oa": oa, "age_days": age, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+
+    parser = argparse.ArgumentParser(description="Index an Unpaywall snapshot for offline DOI lookups")
+    parser.add_argument("snapshots", nargs="*", help="Snapshot .jsonl.gz / .jsonl files to add")
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--dois", default=None, help="CSV with a 'DOI' column; index only these")
+    args = parser.parse_args()
+
+    dois = None
+    if args.dois:
+        with open(args.dois, newline="", encoding="utf-8") as f:
+            dois = [row["DOI"] for row in csv.DictReader(f) if row.get("DOI")]
+
+    snapshot = UnpaywallSnapshot(args.index, create=bool(args.snapshots))
+    if args.snapshots:
+        start = time.monotonic()
+        counts = snapshot.build(args.snapshots, dois)
+        elapsed = time.monotonic() - start
+        print(f"✅ Indexed {counts['records']} records ({counts['oa']} with an OA PDF) "
+              f"from {counts['lines']} lines in {elapsed:.1f}s")
+        if counts["bad"]:
+            print(f"⚠️  Skipped {counts['bad']} malformed lines")
+    stats = snapshot.stats()
+    print(f"📦 Entries: {stats['entries']} ({stats['oa']} OA)")
+    if stats["age_days"] is not None:
+        print(f"🕒 Built {stats['age_days']:.1f} days ago")
+    snapshot.close()